@@ -0,0 +1,22 @@
+#!/bin/bash -l
+
+# Archive the old transactional email send logs (to S3)
+
+# Do not run if this env var is not set:
+if [[ -z "$CRON_CONVERSATIONS_ARCHIVE_SEND_LOGS_ENABLED" ]]; then
+    echo "CRON_CONVERSATIONS_ARCHIVE_SEND_LOGS_ENABLED not set. Exiting..."
+    exit 0
+fi
+
+# About clever cloud cronjobs:
+# https://developers.clever-cloud.com/doc/administrate/cron/
+
+if [[ "$INSTANCE_NUMBER" != "0" ]]; then
+    echo "Instance number is ${INSTANCE_NUMBER}. Stop here."
+    exit 0
+fi
+
+# $APP_HOME is set by default by clever cloud.
+cd $APP_HOME
+
+django-admin archive_template_transactional_send_logs
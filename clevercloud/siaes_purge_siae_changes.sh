@@ -0,0 +1,22 @@
+#!/bin/bash -l
+
+# Purge the old siae changes (API change feed)
+
+# Do not run if this env var is not set:
+if [[ -z "$CRON_SIAES_PURGE_SIAE_CHANGES_ENABLED" ]]; then
+    echo "CRON_SIAES_PURGE_SIAE_CHANGES_ENABLED not set. Exiting..."
+    exit 0
+fi
+
+# About clever cloud cronjobs:
+# https://developers.clever-cloud.com/doc/administrate/cron/
+
+if [[ "$INSTANCE_NUMBER" != "0" ]]; then
+    echo "Instance number is ${INSTANCE_NUMBER}. Stop here."
+    exit 0
+fi
+
+# $APP_HOME is set by default by clever cloud.
+cd $APP_HOME
+
+django-admin purge_siae_changes
@@ -0,0 +1,22 @@
+#!/bin/bash -l
+
+# Update the daily siae view counters (stats rollup)
+
+# Do not run if this env var is not set:
+if [[ -z "$CRON_UPDATE_SIAE_VIEW_DAILY_STATS_ENABLED" ]]; then
+    echo "CRON_UPDATE_SIAE_VIEW_DAILY_STATS_ENABLED not set. Exiting..."
+    exit 0
+fi
+
+# About clever cloud cronjobs:
+# https://developers.clever-cloud.com/doc/administrate/cron/
+
+if [[ "$INSTANCE_NUMBER" != "0" ]]; then
+    echo "Instance number is ${INSTANCE_NUMBER}. Stop here."
+    exit 0
+fi
+
+# $APP_HOME is set by default by clever cloud.
+cd $APP_HOME
+
+django-admin update_siae_view_daily_stats
@@ -0,0 +1,22 @@
+#!/bin/bash -l
+
+# Match the updated Siae activities with the live tenders
+
+# Do not run if this env var is not set:
+if [[ -z "$CRON_TENDER_MATCH_UPDATED_SIAE_ACTIVITIES_ENABLED" ]]; then
+    echo "CRON_TENDER_MATCH_UPDATED_SIAE_ACTIVITIES_ENABLED not set. Exiting..."
+    exit 0
+fi
+
+# About clever cloud cronjobs:
+# https://developers.clever-cloud.com/doc/administrate/cron/
+
+if [[ "$INSTANCE_NUMBER" != "0" ]]; then
+    echo "Instance number is ${INSTANCE_NUMBER}. Stop here."
+    exit 0
+fi
+
+# $APP_HOME is set by default by clever cloud.
+cd $APP_HOME
+
+django-admin match_updated_siae_activities_with_live_tenders
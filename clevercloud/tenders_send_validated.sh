@@ -19,4 +19,9 @@ fi
 # $APP_HOME is set by default by clever cloud.
 cd $APP_HOME
 
-django-admin send_validated_tenders
+# Dispatch each tender to the huey workers if this env var is set
+if [[ -n "$CRON_TENDER_SEND_VALIDATED_DISPATCH" ]]; then
+    django-admin send_validated_tenders --dispatch
+else
+    django-admin send_validated_tenders
+fi
@@ -102,6 +102,7 @@ DJANGO_APPS = [
     "django.contrib.sites",
     "django.contrib.flatpages",
     "django.contrib.gis",
+    "django.contrib.postgres",
     "django.contrib.humanize",
 ]
 
@@ -257,6 +258,10 @@ DATABASES = {
         "NAME": env.str("POSTGRESQL_ADDON_DB", "marche"),
         "USER": env.str("POSTGRESQL_ADDON_USER", "user"),
         "PASSWORD": env.str("POSTGRESQL_ADDON_PASSWORD", "password"),
+        "OPTIONS": {
+            # threshold of the trigram word similarity operator (%>), used by the Siae full-text search
+            "options": "-c pg_trgm.word_similarity_threshold=0.4",
+        },
     },
     "stats": {
         "ENGINE": "django.db.backends.postgresql",
@@ -356,6 +361,12 @@ INBOUND_EMAIL_IS_ACTIVATED = env.bool("INBOUND_EMAIL_IS_ACTIVATED", True)
 # https://help.brevo.com/hc/en-us/articles/15127404548498-Brevo-IP-ranges-List-of-publicly-exposed-services
 BREVO_IP_WHITELIST_RANGE: str = env.str("BREVO_IP_WHITELIST_RANGE", "127.0.0.0/20")
 
+# TemplateTransactionalSendLog older than this are archived (see archive_template_transactional_send_logs)
+# more than 1 year: anonymize_old_users relies on the logs of the warning emails
+TEMPLATE_TRANSACTIONAL_SEND_LOG_RETENTION_DAYS = env.int("TEMPLATE_TRANSACTIONAL_SEND_LOG_RETENTION_DAYS", 730)
+# read the TemplateTransactional from a process-local cache (see lemarche.conversations.cache)
+TEMPLATE_TRANSACTIONAL_CACHE_ENABLED = env.bool("TEMPLATE_TRANSACTIONAL_CACHE_ENABLED", True)
+
 # Caching
 # https://docs.djangoproject.com/en/4.0/topics/cache/
 # ------------------------------------------------------------------------------
@@ -375,7 +386,12 @@ if REDIS_CACHE_ENABLED:
         "default": {
             "BACKEND": "django.core.cache.backends.redis.RedisCache",
             "LOCATION": f"redis://:{REDIS_PASSWORD}@{REDIS_URL}:{REDIS_PORT}",
-        }
+        },
+        "geocoding": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": f"redis://:{REDIS_PASSWORD}@{REDIS_URL}:{REDIS_PORT}",
+            "KEY_PREFIX": "geocoding",
+        },
     }
 else:
     # Simple DB caching, we need it for Select2 (don't ask me why...)
@@ -383,11 +399,24 @@ else:
         "default": {
             "BACKEND": "django.core.cache.backends.db.DatabaseCache",
             "LOCATION": "django_cache",
-        }
+        },
+        # geocoding results (see lemarche.utils.apis.geocoding): in their own table, sized for all the Siae addresses
+        # (the default MAX_ENTRIES of 300 would cull them, and the Select2 entries with them)
+        "geocoding": {
+            "BACKEND": "django.core.cache.backends.db.DatabaseCache",
+            "LOCATION": "django_cache_geocoding",
+            "OPTIONS": {
+                "MAX_ENTRIES": env.int("GEOCODING_CACHE_MAX_ENTRIES", 100_000),
+                "CULL_FREQUENCY": 10,
+            },
+        },
     }
 
 SELECT2_CACHE_BACKEND = "default"
 
+# Siae search: cache the results count for a few minutes (in seconds)
+SIAE_SEARCH_COUNT_CACHE_TIMEOUT = env.int("SIAE_SEARCH_COUNT_CACHE_TIMEOUT", 60 * 5)
+
 
 # Security
 # ------------------------------------------------------------------------------
@@ -460,6 +489,7 @@ LABEL_LOGO_FOLDER_NAME = "label_logo"
 USER_IMAGE_FOLDER_NAME = "user_image"
 SIAE_EXPORT_FOLDER_NAME = "siae_export"
 STAT_EXPORT_FOLDER_NAME = "stat_export"
+TEMPLATE_TRANSACTIONAL_SEND_LOG_ARCHIVE_FOLDER_NAME = "template_transactional_send_log_archive"
 
 STORAGE_UPLOAD_KINDS = {
     "default": {
@@ -492,10 +522,15 @@ STORAGE_UPLOAD_KINDS = {
 # ------------------------------------------------------------------------------
 
 API_PERIMETER_AUTOCOMPLETE_MAX_RESULTS = 20
+# answer the perimeter autocomplete from a process-local index (see lemarche.perimeters.autocomplete)
+API_PERIMETER_AUTOCOMPLETE_INDEX_ENABLED = env.bool("API_PERIMETER_AUTOCOMPLETE_INDEX_ENABLED", True)
 
 # Base Adresse Nationale (BAN).
 # https://adresse.data.gouv.fr/faq
 API_BAN_BASE_URL = "https://api-adresse.data.gouv.fr"
+# geocoding results are cached (in seconds), "not found" for a shorter time
+GEOCODING_CACHE_TIMEOUT = env.int("GEOCODING_CACHE_TIMEOUT", 60 * 60 * 24 * 30)
+GEOCODING_NOT_FOUND_CACHE_TIMEOUT = env.int("GEOCODING_NOT_FOUND_CACHE_TIMEOUT", 60 * 60 * 24)
 # https://api.gouv.fr/api/api-geo.html#doc_tech
 API_GEO_BASE_URL = "https://geo.api.gouv.fr"
 
@@ -551,6 +586,15 @@ REST_FRAMEWORK = {
     "DEFAULT_PERMISSION_CLASSES": ["rest_framework.permissions.IsAuthenticated"],
 }
 
+# API lists: cache the results count for a few minutes (in seconds)
+API_LIST_COUNT_CACHE_TIMEOUT = env.int("API_LIST_COUNT_CACHE_TIMEOUT", 60 * 5)
+
+# API Siae change feed: the most recent changes are only returned after a few seconds (in seconds)
+API_SIAE_CHANGES_DELAY = env.int("API_SIAE_CHANGES_DELAY", 5)
+API_SIAE_CHANGES_MAX_LIMIT = 1000
+# SiaeChange older than this are deleted (see purge_siae_changes): older cursors must reload everything
+API_SIAE_CHANGES_RETENTION_DAYS = env.int("API_SIAE_CHANGES_RETENTION_DAYS", 30)
+
 
 # DRF Spectacular
 # https://drf-spectacular.readthedocs.io/en/latest/settings.html
@@ -598,6 +642,12 @@ MATOMO_HOST = env.str("MATOMO_HOST", "")
 MATOMO_TAG_MANAGER_CONTAINER_ID = env.str("MATOMO_TAG_MANAGER_CONTAINER_ID", "")
 CRISP_ID = env.str("CRISP_ID", "")
 
+# Internal tracker (lemarche/utils/tracker.py): events are buffered in memory and written by batches
+TRACKER_BUFFER_ENABLED = env.bool("TRACKER_BUFFER_ENABLED", True)
+TRACKER_BUFFER_MAX_SIZE = env.int("TRACKER_BUFFER_MAX_SIZE", 10000)  # beyond that, new events are dropped
+TRACKER_BUFFER_FLUSH_SIZE = env.int("TRACKER_BUFFER_FLUSH_SIZE", 200)
+TRACKER_BUFFER_FLUSH_INTERVAL = env.int("TRACKER_BUFFER_FLUSH_INTERVAL", 5)  # in seconds
+
 
 # Metabase
 # ------------------------------------------------------------------------------
@@ -31,5 +31,13 @@ CACHES = {
     "default": {
         "BACKEND": "django.core.cache.backends.dummy.DummyCache",
         "LOCATION": "django_cache",
-    }
+    },
+    "geocoding": {
+        "BACKEND": "django.core.cache.backends.dummy.DummyCache",
+        "LOCATION": "django_cache_geocoding",
+    },
 }
+
+# the process-local cache outlives the test transactions (rolled back without the invalidation signals):
+# disabled, except in its own tests (which reset it in setUp)
+TEMPLATE_TRANSACTIONAL_CACHE_ENABLED = False
@@ -1,9 +1,12 @@
 from django.conf import settings
+from django_filters import utils as django_filters_utils
 from drf_spectacular.utils import extend_schema
 from rest_framework import mixins, viewsets
+from rest_framework.response import Response
 
 from lemarche.api.perimeters.filters import PerimeterAutocompleteFilter, PerimeterFilter
 from lemarche.api.perimeters.serializers import PerimeterChoiceSerializer, PerimeterSimpleSerializer
+from lemarche.perimeters.autocomplete import perimeter_autocomplete_index
 from lemarche.perimeters.models import Perimeter
 
 
@@ -41,7 +44,19 @@ class PerimeterAutocompleteViewSet(mixins.ListModelMixin, viewsets.GenericViewSe
         """
         Maximum 20 résultats renvoyés
         """
-        return super().list(request, args, kwargs)
+        if not settings.API_PERIMETER_AUTOCOMPLETE_INDEX_ENABLED:
+            return super().list(request, args, kwargs)
+        # same validation as the filter backend, but the results come from the in-memory index
+        filterset = self.filterset_class(request.query_params, queryset=self.queryset.none(), request=request)
+        if not filterset.is_valid():
+            raise django_filters_utils.translate_validation(filterset.errors)
+        kind = request.query_params.get("kind", None)
+        if kind not in [id for (id, name) in Perimeter.KIND_CHOICES]:
+            kind = None
+        limit = int(filterset.form.cleaned_data["results"] or 0)
+        if not 0 < limit <= settings.API_PERIMETER_AUTOCOMPLETE_MAX_RESULTS:
+            limit = settings.API_PERIMETER_AUTOCOMPLETE_MAX_RESULTS
+        return Response(perimeter_autocomplete_index.search(filterset.form.cleaned_data["q"], kind=kind, limit=limit))
 
     def get_queryset(self):
         kind = self.request.query_params.get("kind", None)
@@ -36,7 +36,7 @@ class SiaeLabelOldSimpleSerializer(serializers.ModelSerializer):
 class SiaeDetailSerializer(serializers.ModelSerializer):
     kind_parent = serializers.ReadOnlyField()
     sectors = SectorSimpleSerializer(many=True, source="get_sectors")
-    presta_types = serializers.MultipleChoiceField(choices=constants.PRESTA_CHOICES, source="presta_types_annotated")
+    presta_types = serializers.MultipleChoiceField(choices=constants.PRESTA_CHOICES, source="get_presta_types")
     networks = NetworkSimpleSerializer(many=True)
     offers = SiaeOfferSimpleSerializer(many=True)
     client_references = SiaeClientReferenceSimpleSerializer(many=True)
@@ -1,4 +1,6 @@
-from django.test import TestCase
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 
 from lemarche.api.utils import generate_random_string
@@ -6,7 +8,7 @@ from lemarche.networks.factories import NetworkFactory
 from lemarche.sectors.factories import SectorFactory
 from lemarche.siaes import constants as siae_constants
 from lemarche.siaes.factories import SiaeActivityFactory, SiaeFactory
-from lemarche.siaes.models import Siae
+from lemarche.siaes.models import Siae, SiaeChange
 from lemarche.users.factories import UserFactory
 
 
@@ -41,6 +43,63 @@ class SiaeListApiTest(TestCase):
         response = self.client.get(url, headers={"authorization": "wrong"})
         self.assertEqual(response.status_code, 401)
 
+    def test_should_paginate_siae_list_with_cursor(self):
+        url = reverse("api:siae-list") + "?limit=5"
+        siae_id_list = list()
+        while url:
+            response = self.client.get(url, headers={"authorization": f"Bearer {self.user_token}"})
+            self.assertEqual(response.data["count"], 12)
+            self.assertLessEqual(len(response.data["results"]), 5)
+            siae_id_list += [siae["id"] for siae in response.data["results"]]
+            url = response.data["next"]
+            if url:
+                self.assertIn("cursor=", url)
+        self.assertEqual(siae_id_list, sorted(Siae.objects.values_list("id", flat=True)))
+        # backward compatibility: limit/offset
+        url = reverse("api:siae-list") + "?limit=5&offset=10"
+        response = self.client.get(url, headers={"authorization": f"Bearer {self.user_token}"})
+        self.assertEqual(response.data["count"], 12)
+        self.assertEqual(len(response.data["results"]), 2)
+
+    def test_siae_list_number_of_queries_does_not_depend_on_the_number_of_siae(self):
+        siae = Siae.objects.first()
+        SiaeActivityFactory(siae=siae, sectors=[SectorFactory()], presta_type=[siae_constants.PRESTA_BUILD])
+        siae.networks.add(NetworkFactory())
+        url = reverse("api:siae-list")
+        with CaptureQueriesContext(connection) as queries_with_12_siaes:
+            response = self.client.get(url, headers={"authorization": f"Bearer {self.user_token}"})
+        self.assertEqual(len(response.data["results"]), 12)
+        siae_result = next(result for result in response.data["results"] if result["id"] == siae.id)
+        self.assertEqual(len(siae_result["sectors"]), 1)
+        self.assertEqual(siae_result["presta_types"], {siae_constants.PRESTA_BUILD})
+        self.assertEqual(len(siae_result["networks"]), 1)
+        for _ in range(10):
+            SiaeActivityFactory(siae=SiaeFactory(), sectors=[SectorFactory()])
+        with CaptureQueriesContext(connection) as queries_with_22_siaes:
+            response = self.client.get(url, headers={"authorization": f"Bearer {self.user_token}"})
+        self.assertEqual(len(response.data["results"]), 22)
+        self.assertEqual(len(queries_with_22_siaes), len(queries_with_12_siaes))
+
+    def test_siae_list_should_return_304_if_not_modified(self):
+        url = reverse("api:siae-list")
+        response = self.client.get(url, headers={"authorization": f"Bearer {self.user_token}"})
+        self.assertEqual(response.status_code, 200)
+        etag = response["ETag"]
+        self.assertIn("Last-Modified", response)
+        response = self.client.get(url, headers={"authorization": f"Bearer {self.user_token}", "if-none-match": etag})
+        self.assertEqual(response.status_code, 304)
+        # a Siae of the page is updated
+        Siae.objects.first().save()
+        response = self.client.get(url, headers={"authorization": f"Bearer {self.user_token}", "if-none-match": etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+        etag = response["ETag"]
+        # a related object of a Siae of the page is updated (the Siae updated_at doesn't change)
+        Siae.objects.first().offers.create(name="Offre")
+        response = self.client.get(url, headers={"authorization": f"Bearer {self.user_token}", "if-none-match": etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
 
 class SiaeListFilterApiTest(TestCase):
     @classmethod
@@ -184,6 +243,80 @@ class SiaeDetailApiTest(TestCase):
         self.assertTrue("labels_old" in response.data)
 
 
+@override_settings(API_SIAE_CHANGES_DELAY=0)
+class SiaeChangesApiTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.siae_1 = SiaeFactory(name="Structure 1")
+        cls.siae_2 = SiaeFactory(name="Structure 2")
+        cls.siae_3 = SiaeFactory(name="Structure 3")
+        cls.user_token = generate_random_string()
+        UserFactory(api_key=cls.user_token)
+        cls.authenticated_client = cls.client_class(headers={"authorization": f"Bearer {cls.user_token}"})
+        cls.url = reverse("api:siae-changes")
+
+    def test_should_return_401_to_anonymous_users(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 401)
+
+    def test_should_return_the_changes_since_the_cursor(self):
+        response = self.authenticated_client.get(self.url, {"since": 0})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [siae["id"] for siae in response.data["results"]], [self.siae_1.id, self.siae_2.id, self.siae_3.id]
+        )
+        self.assertEqual(response.data["deleted"], [])
+        self.assertFalse(response.data["has_more"])
+        cursor = response.data["cursor"]
+        # nothing new
+        response = self.authenticated_client.get(self.url, {"since": cursor})
+        self.assertEqual(response.data["results"], [])
+        self.assertEqual(response.data["cursor"], cursor)
+        # bulk update (no updated_at change) & deletion
+        self.siae_1.name = "Structure 1 renommée"
+        Siae.objects.bulk_update([self.siae_1], ["name"])
+        SiaeChange.objects.record([self.siae_1.id])
+        siae_2_id = self.siae_2.id
+        self.siae_2.delete()
+        response = self.authenticated_client.get(self.url, {"since": cursor})
+        self.assertEqual([siae["id"] for siae in response.data["results"]], [self.siae_1.id])
+        self.assertEqual(response.data["results"][0]["name"], "Structure 1 renommée")
+        self.assertEqual(response.data["deleted"], [siae_2_id])
+        self.assertGreater(response.data["cursor"], cursor)
+
+    def test_should_log_the_related_objects_changes(self):
+        cursor = SiaeChange.objects.last().id
+        self.siae_3.offers.create(name="Offre")
+        response = self.authenticated_client.get(self.url, {"since": cursor})
+        self.assertEqual([siae["id"] for siae in response.data["results"]], [self.siae_3.id])
+        self.assertEqual(response.data["results"][0]["offers"][0]["name"], "Offre")
+
+    def test_should_not_log_the_saves_of_other_fields(self):
+        cursor = SiaeChange.objects.last().id
+        self.siae_3.user_count = 2
+        self.siae_3.save(update_fields=["user_count"])
+        self.assertFalse(SiaeChange.objects.filter(id__gt=cursor).exists())
+        self.siae_3.contact_email = "contact@example.com"
+        self.siae_3.save(update_fields=["contact_email"])
+        self.assertEqual(
+            list(SiaeChange.objects.filter(id__gt=cursor).values_list("siae_id", flat=True)), [self.siae_3.id]
+        )
+
+    def test_should_paginate_the_changes(self):
+        siae_id_list = list()
+        cursor, has_more = 0, True
+        while has_more:
+            response = self.authenticated_client.get(self.url, {"since": cursor, "limit": 1})
+            self.assertLessEqual(len(response.data["results"]), 1)
+            siae_id_list += [siae["id"] for siae in response.data["results"]]
+            cursor, has_more = response.data["cursor"], response.data["has_more"]
+        self.assertEqual(set(siae_id_list), {self.siae_1.id, self.siae_2.id, self.siae_3.id})
+
+    def test_should_return_400_if_cursor_invalid(self):
+        response = self.authenticated_client.get(self.url, {"since": "abc"})
+        self.assertEqual(response.status_code, 400)
+
+
 class SiaeRetrieveBySlugApiTest(TestCase):
     @classmethod
     def setUpTestData(cls):
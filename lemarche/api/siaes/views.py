@@ -1,15 +1,45 @@
-from django.db.models import F
+import hashlib
+
+from django.conf import settings
+from django.db.models import Max, prefetch_related_objects
 from django.http import HttpResponseBadRequest
 from django.shortcuts import get_object_or_404
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
 from drf_spectacular.utils import extend_schema
 from rest_framework import mixins, viewsets
 from rest_framework.response import Response
 
 from lemarche.api.siaes.filters import SiaeFilter
 from lemarche.api.siaes.serializers import SiaeDetailSerializer
-from lemarche.api.utils import BasicChoiceSerializer, BasicChoiceWithParentSerializer
+from lemarche.api.utils import BasicChoiceSerializer, BasicChoiceWithParentSerializer, CursorWithCountPagination
 from lemarche.siaes import constants as siae_constants
-from lemarche.siaes.models import Siae
+from lemarche.siaes.models import Siae, SiaeChange
+
+
+# all the nested relations of SiaeDetailSerializer: a constant number of queries, whatever the number of Siae
+SIAE_PREFETCH_LOOKUPS = ["activities__sectors", "networks", "offers", "client_references", "labels_old"]
+SIAE_CHANGES_DEFAULT_LIMIT = 100
+
+
+def get_page_etag_and_last_modified(request, siae_list):
+    """
+    ETag: the request (filters, cursor...), the (id, updated_at) of each Siae of the page
+    and the latest SiaeChange of the page (the changes of the related objects don't update the Siae updated_at)
+    Last-Modified: the most recent updated_at or SiaeChange of the page
+    """
+    latest_change = SiaeChange.objects.filter(siae_id__in=[siae.id for siae in siae_list]).aggregate(
+        id=Max("id"), created_at=Max("created_at")
+    )
+    etag_source = request.get_full_path() + "".join(f"|{siae.id}:{siae.updated_at.isoformat()}" for siae in siae_list)
+    etag_source += f"|{latest_change['id']}"
+    etag = quote_etag(hashlib.sha1(etag_source.encode()).hexdigest())
+    last_modified = max(
+        [siae.updated_at.timestamp() for siae in siae_list]
+        + ([latest_change["created_at"].timestamp()] if latest_change["created_at"] else []),
+        default=None,
+    )
+    return etag, int(last_modified) if last_modified else None
 
 
 class SiaeViewSet(mixins.ListModelMixin, mixins.RetrieveModelMixin, viewsets.GenericViewSet):
@@ -20,10 +50,7 @@ class SiaeViewSet(mixins.ListModelMixin, mixins.RetrieveModelMixin, viewsets.Gen
     queryset = Siae.objects.api_query_set()
     serializer_class = SiaeDetailSerializer
     filterset_class = SiaeFilter
-
-    def get_queryset(self):
-        """Annotate sectors to be directly available in the serializer"""
-        return super().get_queryset().annotate(presta_types_annotated=F("activities__presta_type"))
+    pagination_class = CursorWithCountPagination
 
     @extend_schema(
         summary="Lister toutes les structures",
@@ -33,9 +60,68 @@ class SiaeViewSet(mixins.ListModelMixin, mixins.RetrieveModelMixin, viewsets.Gen
         """
         Liste exhaustive des structures d'insertion par l'activité économique (SIAE).
 
+        Pagination : suivre le lien `next` (curseur). Les pages non modifiées renvoient une 304
+        (en-têtes `If-None-Match` / `If-Modified-Since`).
+
         <i>Un <strong>token</strong> est nécessaire pour l'accès complet à cette ressource.</i>
         """
-        return super().list(request, format)
+        queryset = self.filter_queryset(self.get_queryset())
+        siae_list = self.paginate_queryset(queryset)
+        etag, last_modified = get_page_etag_and_last_modified(request, siae_list)
+        not_modified_response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if not_modified_response is not None:
+            return not_modified_response
+
+        prefetch_related_objects(siae_list, *SIAE_PREFETCH_LOOKUPS)
+        serializer = self.get_serializer(siae_list, many=True)
+        response = self.get_paginated_response(serializer.data)
+        response["ETag"] = etag
+        if last_modified:
+            response["Last-Modified"] = http_date(last_modified)
+        return response
+
+    @extend_schema(
+        summary="Lister les structures modifiées depuis un curseur",
+        tags=[Siae._meta.verbose_name_plural],
+    )
+    def changes(self, request, format=None):
+        """
+        Flux des structures créées, modifiées ou supprimées (pour garder une copie à jour sans tout recharger).
+
+        Paramètres : `since` (le `cursor` de la réponse précédente, 0 au premier appel) et `limit` (max 1000).
+        Réponse : `results` (les structures créées ou modifiées, au même format que la liste),
+        `deleted` (les ids des structures supprimées), `cursor` (à renvoyer au prochain appel)
+        et `has_more` (s'il reste des changements : rappeler immédiatement).
+
+        <i>Un <strong>token</strong> est nécessaire pour l'accès complet à cette ressource.</i>
+        """
+        try:
+            since = int(request.query_params.get("since", 0))
+            limit = int(request.query_params.get("limit", SIAE_CHANGES_DEFAULT_LIMIT))
+        except ValueError:
+            return HttpResponseBadRequest("since and limit must be integers")
+        if not 0 < limit <= settings.API_SIAE_CHANGES_MAX_LIMIT:
+            limit = settings.API_SIAE_CHANGES_MAX_LIMIT
+
+        # one more, to know if there are more changes
+        change_list = list(SiaeChange.objects.since(since).values_list("id", "siae_id")[: limit + 1])
+        has_more = len(change_list) > limit
+        change_list = change_list[:limit]
+
+        # several changes of the same Siae: only its current state is returned
+        siae_id_set = {siae_id for (_, siae_id) in change_list}
+        siae_list = list(self.get_queryset().filter(id__in=siae_id_set).order_by("id"))
+        prefetch_related_objects(siae_list, *SIAE_PREFETCH_LOOKUPS)
+        serializer = self.get_serializer(siae_list, many=True)
+        return Response(
+            {
+                "cursor": change_list[-1][0] if change_list else since,
+                "has_more": has_more,
+                "results": serializer.data,
+                # deleted, or no longer exposed by the API
+                "deleted": sorted(siae_id_set - {siae.id for siae in siae_list}),
+            }
+        )
 
     @extend_schema(
         summary="Détail d'une structure (par son id)",
@@ -46,7 +132,7 @@ class SiaeViewSet(mixins.ListModelMixin, mixins.RetrieveModelMixin, viewsets.Gen
         """
         <i>Un <strong>token</strong> est nécessaire pour l'accès complet à cette ressource.</i>
         """
-        queryset = self.get_queryset().prefetch_many_to_many().prefetch_many_to_one()
+        queryset = self.get_queryset().prefetch_related(*SIAE_PREFETCH_LOOKUPS)
         queryset_or_404 = get_object_or_404(queryset, pk=pk)
         return self._retrieve_return(request, queryset_or_404, format)
 
@@ -60,7 +146,7 @@ class SiaeViewSet(mixins.ListModelMixin, mixins.RetrieveModelMixin, viewsets.Gen
         Note : le slug est un champ unique.<br /><br />
         <i>Un <strong>token</strong> est nécessaire pour l'accès complet à cette ressource.</i>
         """
-        queryset = self.get_queryset().prefetch_many_to_many().prefetch_many_to_one()
+        queryset = self.get_queryset().prefetch_related(*SIAE_PREFETCH_LOOKUPS)
         queryset_or_404 = get_object_or_404(queryset, slug=slug)
         return self._retrieve_return(request, queryset_or_404, format)
 
@@ -76,7 +162,7 @@ class SiaeViewSet(mixins.ListModelMixin, mixins.RetrieveModelMixin, viewsets.Gen
         """
         if len(siren) != 9:
             return HttpResponseBadRequest("siren must be 9 caracters long")
-        queryset = self.get_queryset().prefetch_many_to_many().prefetch_many_to_one().filter(siret__startswith=siren)
+        queryset = self.get_queryset().prefetch_related(*SIAE_PREFETCH_LOOKUPS).filter(siret__startswith=siren)
         return self._list_return(request, queryset, format)
 
     @extend_schema(
@@ -91,7 +177,7 @@ class SiaeViewSet(mixins.ListModelMixin, mixins.RetrieveModelMixin, viewsets.Gen
         """
         if len(siret) != 14:
             return HttpResponseBadRequest("siret must be 14 caracters long")
-        queryset = self.get_queryset().prefetch_many_to_many().prefetch_many_to_one().filter(siret=siret)
+        queryset = self.get_queryset().prefetch_related(*SIAE_PREFETCH_LOOKUPS).filter(siret=siret)
         return self._list_return(request, queryset, format)
 
     def _retrieve_return(self, request, queryset, format):
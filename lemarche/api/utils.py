@@ -1,7 +1,12 @@
+import hashlib
 import random
 import string
 
+from django.conf import settings
+from django.core.cache import cache
 from rest_framework import serializers
+from rest_framework.pagination import CursorPagination, LimitOffsetPagination
+from rest_framework.response import Response
 
 
 def custom_preprocessing_hook(endpoints):
@@ -28,3 +33,61 @@ class BasicChoiceSerializer(serializers.Serializer):
 
 class BasicChoiceWithParentSerializer(BasicChoiceSerializer):
     parent = serializers.CharField()
+
+
+def get_cached_count(queryset) -> int:
+    """
+    Count cached for a few minutes, per query (avoid a full COUNT(*) on every page)
+    """
+    count_cache_key = f"api_count:{hashlib.sha1(str(queryset.query).encode()).hexdigest()}"
+    count = cache.get(count_cache_key)
+    if count is None:
+        count = queryset.count()
+        cache.set(count_cache_key, count, settings.API_LIST_COUNT_CACHE_TIMEOUT)
+    return count
+
+
+class CachedCountLimitOffsetPagination(LimitOffsetPagination):
+    def get_count(self, queryset):
+        return get_cached_count(queryset)
+
+
+class CursorWithCountPagination(CursorPagination):
+    """
+    Cursor pagination: each page is fetched with a WHERE on the ordering field (instead of an OFFSET),
+    so the last pages are as fast as the first ones, and stable while the data changes.
+    - the total count is kept in the response (cached for a few minutes, per query)
+    - the requests with an 'offset' parameter keep the limit/offset pagination (backward compatibility)
+    """
+
+    ordering = "id"
+    page_size_query_param = "limit"
+    max_page_size = 1000
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if "offset" in request.query_params:
+            self.limit_offset_pagination = CachedCountLimitOffsetPagination()
+            return self.limit_offset_pagination.paginate_queryset(queryset, request, view)
+        self.limit_offset_pagination = None
+        self.count = get_cached_count(queryset)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.limit_offset_pagination:
+            return self.limit_offset_pagination.get_paginated_response(data)
+        return Response(
+            {
+                "count": self.count,
+                "next": self.get_next_link(),
+                "previous": self.get_previous_link(),
+                "results": data,
+            }
+        )
+
+    def get_paginated_response_schema(self, schema):
+        paginated_response_schema = super().get_paginated_response_schema(schema)
+        paginated_response_schema["properties"] = {
+            "count": {"type": "integer", "example": 123},
+            **paginated_response_schema["properties"],
+        }
+        return paginated_response_schema
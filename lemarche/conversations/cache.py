@@ -0,0 +1,82 @@
+import copy
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+
+# bumped when a TemplateTransactional (or an EmailGroup) is saved, so that every process reloads its templates
+TEMPLATE_VERSION_CACHE_KEY = "template_transactional_version"
+# how often (in seconds) each process checks the templates version in the shared cache
+TEMPLATE_VERSION_CHECK_INTERVAL = 60
+
+
+class TemplateTransactionalCache:
+    """
+    Process-local cache of the TemplateTransactional (with their group), by code:
+    the (few) templates are loaded in a single query, instead of a query for each email sent
+
+    The templates are reloaded:
+    - in the current process: as soon as a TemplateTransactional or an EmailGroup is saved or deleted
+    - in the other processes: within TEMPLATE_VERSION_CHECK_INTERVAL (invalidate() bumps a version in the shared cache)
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.data = None
+        self.version = None
+        self.version_checked_at = 0
+
+    def load(self) -> dict:
+        from lemarche.conversations.models import TemplateTransactional
+
+        return {
+            template.code: template
+            for template in TemplateTransactional.objects.select_related("group").exclude(code=None)
+        }
+
+    def get_data(self) -> dict:
+        if time.monotonic() - self.version_checked_at > TEMPLATE_VERSION_CHECK_INTERVAL:
+            version = cache.get(TEMPLATE_VERSION_CACHE_KEY)
+            self.version_checked_at = time.monotonic()
+            if version != self.version:
+                self.version = version
+                self.data = None
+        data = self.data
+        if data is None:
+            with self.lock:
+                if self.data is None:
+                    self.data = self.load()
+                data = self.data
+        return data
+
+    def get(self, code):
+        """
+        Returns a copy of the template (the cached instances are shared by the threads of the process)
+        Raises TemplateTransactional.DoesNotExist, like TemplateTransactional.objects.get(code=code)
+        """
+        from lemarche.conversations.models import TemplateTransactional
+
+        if not settings.TEMPLATE_TRANSACTIONAL_CACHE_ENABLED:
+            return TemplateTransactional.objects.select_related("group").get(code=code)
+        template = self.get_data().get(code)
+        if template is None:
+            raise TemplateTransactional.DoesNotExist(f"TemplateTransactional matching code '{code}' does not exist.")
+        return copy.copy(template)
+
+    def mark_stale(self):
+        """
+        Reload the templates (of the current process) on the next get
+        """
+        self.data = None
+
+    def invalidate(self):
+        """
+        Reload the templates of every process
+        """
+        cache.set(TEMPLATE_VERSION_CACHE_KEY, time.time(), None)
+        self.mark_stale()
+
+
+template_transactional_cache = TemplateTransactionalCache()
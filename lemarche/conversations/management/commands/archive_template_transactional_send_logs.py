@@ -0,0 +1,103 @@
+import gzip
+import json
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Max
+from django.utils import timezone
+
+from lemarche.conversations.models import TemplateTransactionalSendLog
+from lemarche.utils.commands import BaseCommand
+from lemarche.utils.s3 import S3MultipartUpload
+
+
+SEND_LOG_ITERATOR_CHUNK_SIZE = 2000
+DELETE_BATCH_SIZE = 5000
+
+SEND_LOG_FIELDS = [field.attname for field in TemplateTransactionalSendLog._meta.fields]
+
+
+class Command(BaseCommand):
+    """
+    Retention policy of the TemplateTransactionalSendLog: the logs older than
+    TEMPLATE_TRANSACTIONAL_SEND_LOG_RETENTION_DAYS are moved to a compressed file on S3 (gzipped JSON lines, private),
+    then deleted by batches (only once the file is uploaded)
+
+    The send counters (TemplateTransactionalSendCounter) are kept: the admin counts include the archived logs.
+
+    Note: run via a CRON every week
+    Usage:
+    poetry run python manage.py archive_template_transactional_send_logs --dry-run
+    poetry run python manage.py archive_template_transactional_send_logs
+    poetry run python manage.py archive_template_transactional_send_logs --days 365
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--days",
+            type=int,
+            default=settings.TEMPLATE_TRANSACTIONAL_SEND_LOG_RETENTION_DAYS,
+            help="Archiver les logs plus anciens que ce nombre de jours",
+        )
+        parser.add_argument("--dry-run", dest="dry_run", action="store_true", help="Dry run (no changes to the DB)")
+
+    def handle(self, *args, **options):
+        start_time = time.perf_counter()
+        created_before = timezone.now() - timedelta(days=options["days"])
+        send_log_queryset = TemplateTransactionalSendLog.objects.filter(created_at__lt=created_before)
+
+        self.stdout_info(f"Archiving the send logs created before {created_before:%Y-%m-%d}")
+        if options["dry_run"]:
+            self.stdout_info(f"Found {send_log_queryset.count()} send logs to archive (dry run)")
+            return
+
+        # the logs created during the archive are not deleted
+        max_id = send_log_queryset.aggregate(Max("id"))["id__max"]
+        if max_id is None:
+            self.stdout_info("No send log to archive")
+            return
+        send_log_queryset = send_log_queryset.filter(id__lte=max_id)
+
+        self.stdout_info("Step 1: export the send logs to S3")
+        s3_file_key = (
+            f"{settings.TEMPLATE_TRANSACTIONAL_SEND_LOG_ARCHIVE_FOLDER_NAME}/"
+            f"send_logs_{created_before:%Y-%m-%d}_{max_id}.jsonl.gz"
+        )
+        count_archive = self.archive(send_log_queryset, s3_file_key)
+
+        self.stdout_info("Step 2: delete the archived send logs")
+        count_delete = self.delete(send_log_queryset)
+
+        self.stdout_messages_success(
+            [
+                "----- Template transactional send logs archive -----",
+                f"Archived {count_archive} send logs in {s3_file_key}",
+                f"Deleted {count_delete} send logs",
+                f"Duration: {time.perf_counter() - start_time:.2f}s",
+            ]
+        )
+
+    def archive(self, send_log_queryset, s3_file_key) -> int:
+        count_archive = 0
+        with S3MultipartUpload(
+            settings.S3_STORAGE_BUCKET_NAME, s3_file_key, content_type="application/gzip", acl="private"
+        ) as file:
+            with gzip.GzipFile(fileobj=file, mode="wb") as gzip_file:
+                for send_log in (
+                    send_log_queryset.order_by("id").values(*SEND_LOG_FIELDS).iterator(SEND_LOG_ITERATOR_CHUNK_SIZE)
+                ):
+                    gzip_file.write((json.dumps(send_log, cls=DjangoJSONEncoder) + "\n").encode("utf-8"))
+                    count_archive += 1
+        return count_archive
+
+    def delete(self, send_log_queryset) -> int:
+        count_delete = 0
+        while True:
+            send_log_id_list = list(send_log_queryset.values_list("id", flat=True)[:DELETE_BATCH_SIZE])
+            if not send_log_id_list:
+                break
+            count, _ = TemplateTransactionalSendLog.objects.filter(id__in=send_log_id_list).delete()
+            count_delete += count
+        return count_delete
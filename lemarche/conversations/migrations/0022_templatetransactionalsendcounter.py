@@ -0,0 +1,92 @@
+# Generated by Django 5.1.6 on 2026-10-18 13:51
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def build_send_counters(apps, schema_editor):
+    ContentType = apps.get_model("contenttypes", "ContentType")
+    TemplateTransactionalSendLog = apps.get_model("conversations", "TemplateTransactionalSendLog")
+    TemplateTransactionalSendCounter = apps.get_model("conversations", "TemplateTransactionalSendCounter")
+    if not TemplateTransactionalSendLog.objects.exists():
+        return
+
+    template_content_type, _ = ContentType.objects.get_or_create(
+        app_label="conversations", model="templatetransactional"
+    )
+    send_counter_list = [
+        TemplateTransactionalSendCounter(
+            content_type_id=template_content_type.id,
+            object_id=send_log["template_transactional_id"],
+            role="TEMPLATE",
+            count=send_log["count"],
+        )
+        for send_log in TemplateTransactionalSendLog.objects.exclude(template_transactional=None)
+        .values("template_transactional_id")
+        .annotate(count=Count("id"))
+        .order_by()
+    ]
+    for role, prefix in [("RECIPIENT", "recipient"), ("PARENT", "parent")]:
+        send_counter_list += [
+            TemplateTransactionalSendCounter(
+                content_type_id=send_log[f"{prefix}_content_type_id"],
+                object_id=send_log[f"{prefix}_object_id"],
+                role=role,
+                count=send_log["count"],
+            )
+            for send_log in TemplateTransactionalSendLog.objects.exclude(**{f"{prefix}_content_type": None})
+            .exclude(**{f"{prefix}_object_id": None})
+            .values(f"{prefix}_content_type_id", f"{prefix}_object_id")
+            .annotate(count=Count("id"))
+            .order_by()
+        ]
+    TemplateTransactionalSendCounter.objects.bulk_create(send_counter_list, batch_size=5000)
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("contenttypes", "0002_remove_content_type_name"),
+        ("conversations", "0021_add_templatetransactional_tender_author_modification_request_and_reject_message"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="TemplateTransactionalSendCounter",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("object_id", models.PositiveBigIntegerField()),
+                (
+                    "role",
+                    models.CharField(
+                        choices=[("TEMPLATE", "Template"), ("RECIPIENT", "Destinataire"), ("PARENT", "Contexte")],
+                        max_length=20,
+                        verbose_name="Rôle",
+                    ),
+                ),
+                ("count", models.PositiveIntegerField(default=0, verbose_name="Nombre d'envois")),
+                ("updated_at", models.DateTimeField(auto_now=True, verbose_name="Date de modification")),
+                (
+                    "content_type",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="send_counters",
+                        to="contenttypes.contenttype",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Template transactionnel: compteur d'envois",
+                "verbose_name_plural": "Templates transactionnels: compteurs d'envois",
+                "constraints": [
+                    models.UniqueConstraint(
+                        models.F("content_type"),
+                        models.F("object_id"),
+                        models.F("role"),
+                        name="unique_send_counter_per_object_role",
+                    )
+                ],
+            },
+        ),
+        migrations.RunPython(build_send_counters, migrations.RunPython.noop),
+    ]
@@ -1,21 +1,29 @@
+from collections import Counter
 from uuid import uuid4
 
 from django.conf import settings
 from django.contrib.contenttypes.fields import GenericForeignKey
 from django.contrib.contenttypes.models import ContentType
 from django.core.validators import ValidationError
-from django.db import IntegrityError, models
-from django.db.models import Count, Func, IntegerField, Q
+from django.db import IntegrityError, connections, models, transaction
+from django.db.models import Func, IntegerField, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
 from django.utils import timezone
 from django.utils.text import slugify
 from django_extensions.db.fields import ShortUUIDField
 from shortuuid import uuid
 
+from lemarche.conversations.cache import template_transactional_cache
 from lemarche.users import constants as user_constants
 from lemarche.utils.apis import api_brevo
 from lemarche.utils.data import add_validation_error
 
 
+SEND_LOG_BATCH_SIZE = 1000
+
+
 class ConversationQuerySet(models.QuerySet):
     def has_answer(self):
         return self.exclude(data=[])
@@ -215,10 +223,22 @@ class EmailGroup(models.Model):
 
 class TemplateTransactionalQuerySet(models.QuerySet):
     def with_stats(self):
+        # from the counters: the log table is not counted
+        send_counter_queryset = TemplateTransactionalSendCounter.objects.filter(
+            content_type=ContentType.objects.get_for_model(self.model),
+            object_id=OuterRef("pk"),
+            role=TemplateTransactionalSendCounter.ROLE_TEMPLATE,
+        )
         return self.annotate(
-            send_log_count=Count("send_logs"),
+            send_log_count=Coalesce(Subquery(send_counter_queryset.values("count")[:1]), 0),
         )
 
+    def get_by_code(self, code):
+        """
+        Same as get(code=code), from the process-local cache of the templates (see TemplateTransactionalCache)
+        """
+        return template_transactional_cache.get(code)
+
 
 class TemplateTransactional(models.Model):
     name = models.CharField(verbose_name="Nom", max_length=255)
@@ -274,7 +294,8 @@ class TemplateTransactional(models.Model):
         return None
 
     def create_send_log(self, **kwargs):
-        TemplateTransactionalSendLog.objects.create(template_transactional=self, **kwargs)
+        with TemplateTransactionalSendLogWriter() as send_log_writer:
+            send_log_writer.add(template_transactional=self, **kwargs)
 
     def send_transactional_email(
         self,
@@ -311,6 +332,66 @@ class TemplateTransactional(models.Model):
 
             api_brevo.send_transactional_email_with_template(**args)
 
+    def send_transactional_email_batch(
+        self,
+        recipient_list,
+        subject=None,
+        from_email=settings.DEFAULT_FROM_EMAIL,
+        from_name=settings.DEFAULT_FROM_NAME,
+    ):
+        """
+        Same as send_transactional_email(), for several recipients:
+        the emails are sent by batches (Brevo message versions) by a single task, instead of one task per recipient
+
+        recipient_list: dicts with the recipient_email, recipient_name & variables of each recipient
+        (and optionally the recipient_content_object & parent_content_object of the send log)
+        """
+        if self.is_active:
+            # the opt-outs of all the recipients, in a single query
+            disabled_email_group_set = (
+                DisabledEmail.objects.email_group_set([recipient["recipient_email"] for recipient in recipient_list])
+                if self.group_id
+                else set()
+            )
+            recipient_to_send_list = list()
+            # the logs are inserted by batches
+            with TemplateTransactionalSendLogWriter() as send_log_writer:
+                for recipient in recipient_list:
+                    # check that the recipient (if associated to a user) did not disable the email group
+                    if (recipient["recipient_email"], self.group_id) in disabled_email_group_set:
+                        continue
+
+                    args = {
+                        "template_id": self.get_template_id,
+                        "recipient_email": recipient["recipient_email"],
+                        "recipient_name": recipient["recipient_name"],
+                        "variables": recipient["variables"],
+                        "subject": subject,
+                        "from_email": from_email,
+                        "from_name": from_name,
+                    }
+
+                    # create log
+                    send_log_writer.add(
+                        template_transactional=self,
+                        recipient_content_object=recipient.get("recipient_content_object"),
+                        parent_content_object=recipient.get("parent_content_object"),
+                        extra_data={"source": "BREVO", "args": args},
+                    )
+
+                    recipient_to_send_list.append(
+                        {key: recipient[key] for key in ("recipient_email", "recipient_name", "variables")}
+                    )
+
+            if recipient_to_send_list:
+                api_brevo.send_transactional_email_batch_with_template(
+                    template_id=self.get_template_id,
+                    recipient_list=recipient_to_send_list,
+                    subject=subject,
+                    from_email=from_email,
+                    from_name=from_name,
+                )
+
 
 class TemplateTransactionalSendLog(models.Model):
     template_transactional = models.ForeignKey(
@@ -345,12 +426,157 @@ class TemplateTransactionalSendLog(models.Model):
         verbose_name_plural = "Templates transactionnels: logs d'envois"
 
 
+class TemplateTransactionalSendLogWriter:
+    """
+    Buffered writer of TemplateTransactionalSendLog: the logs are inserted by batches (bulk_create),
+    and the counters of their template, recipient & parent (TemplateTransactionalSendCounter) are incremented
+    in the same transaction (a single upsert per batch)
+
+    Usage:
+    with TemplateTransactionalSendLogWriter() as send_log_writer:
+        send_log_writer.add(template_transactional=template, recipient_content_object=user, extra_data={...})
+
+    The remaining logs are written when leaving the block (but not on error).
+    """
+
+    def __init__(self, batch_size=SEND_LOG_BATCH_SIZE):
+        self.batch_size = batch_size
+        self.send_log_list = list()
+
+    def __enter__(self):
+        return self
+
+    def add(self, **kwargs):
+        self.send_log_list.append(TemplateTransactionalSendLog(**kwargs))
+        if len(self.send_log_list) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.send_log_list:
+            return
+        template_content_type_id = ContentType.objects.get_for_model(TemplateTransactional).id
+        count_dict = Counter()
+        for send_log in self.send_log_list:
+            for content_type_id, object_id, role in [
+                (
+                    template_content_type_id,
+                    send_log.template_transactional_id,
+                    TemplateTransactionalSendCounter.ROLE_TEMPLATE,
+                ),
+                (
+                    send_log.recipient_content_type_id,
+                    send_log.recipient_object_id,
+                    TemplateTransactionalSendCounter.ROLE_RECIPIENT,
+                ),
+                (
+                    send_log.parent_content_type_id,
+                    send_log.parent_object_id,
+                    TemplateTransactionalSendCounter.ROLE_PARENT,
+                ),
+            ]:
+                if content_type_id and object_id:
+                    count_dict[(content_type_id, object_id, role)] += 1
+        with transaction.atomic():
+            TemplateTransactionalSendLog.objects.bulk_create(self.send_log_list)
+            TemplateTransactionalSendCounter.objects.increment(count_dict)
+        self.send_log_list = list()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.flush()
+        return False
+
+
+class TemplateTransactionalSendCounterQuerySet(models.QuerySet):
+    def increment(self, count_dict):
+        """
+        count_dict: {(content_type_id, object_id, role): count}
+        A single upsert (INSERT ... ON CONFLICT DO UPDATE), whatever the number of counters
+        """
+        if not count_dict:
+            return
+        table_name = self.model._meta.db_table
+        now = timezone.now()
+        values = ", ".join(["(%s, %s, %s, %s, %s)"] * len(count_dict))
+        params = list()
+        # always lock the rows in the same order: concurrent workers updating the same counters can't deadlock
+        for (content_type_id, object_id, role), count in sorted(count_dict.items()):
+            params += [content_type_id, object_id, role, count, now]
+        with connections[self.db].cursor() as cursor:
+            cursor.execute(
+                f"INSERT INTO {table_name} (content_type_id, object_id, role, count, updated_at) VALUES {values} "
+                "ON CONFLICT (content_type_id, object_id, role) DO UPDATE "
+                f"SET count = {table_name}.count + EXCLUDED.count, updated_at = EXCLUDED.updated_at",
+                params,
+            )
+
+    def get_count(self, obj, role) -> int:
+        return (
+            self.filter(content_type=ContentType.objects.get_for_model(obj), object_id=obj.pk, role=role)
+            .values_list("count", flat=True)
+            .first()
+            or 0
+        )
+
+
+class TemplateTransactionalSendCounter(models.Model):
+    """
+    Number of emails sent, for each template, recipient (User, Siae...) & parent (TenderSiae, SiaeUserRequest...):
+    read by the admin instead of counting the TemplateTransactionalSendLog (the archived logs are still counted)
+    """
+
+    ROLE_TEMPLATE = "TEMPLATE"
+    ROLE_RECIPIENT = "RECIPIENT"
+    ROLE_PARENT = "PARENT"
+    ROLE_CHOICES = (
+        (ROLE_TEMPLATE, "Template"),
+        (ROLE_RECIPIENT, "Destinataire"),
+        (ROLE_PARENT, "Contexte"),
+    )
+
+    content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE, related_name="send_counters")
+    object_id = models.PositiveBigIntegerField()
+    content_object = GenericForeignKey("content_type", "object_id")
+    role = models.CharField(verbose_name="Rôle", max_length=20, choices=ROLE_CHOICES)
+    count = models.PositiveIntegerField(verbose_name="Nombre d'envois", default=0)
+
+    updated_at = models.DateTimeField(verbose_name="Date de modification", auto_now=True)
+
+    objects = models.Manager.from_queryset(TemplateTransactionalSendCounterQuerySet)()
+
+    class Meta:
+        verbose_name = "Template transactionnel: compteur d'envois"
+        verbose_name_plural = "Templates transactionnels: compteurs d'envois"
+        constraints = [
+            models.UniqueConstraint("content_type", "object_id", "role", name="unique_send_counter_per_object_role"),
+        ]
+
+
+class DisabledEmailQuerySet(models.QuerySet):
+    def email_group_set(self, email_list) -> set:
+        """
+        The (email, group_id) opt-outs of a list of emails, in a single query
+        (instead of a EmailGroup.disabled_for_email() query for each email)
+        """
+        return set(self.filter(user__email__in=set(email_list)).values_list("user__email", "group_id"))
+
+
 class DisabledEmail(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="disabled_emails")
     group = models.ForeignKey("EmailGroup", on_delete=models.CASCADE)
     disabled_at = models.DateTimeField(auto_now_add=True)
 
+    objects = models.Manager.from_queryset(DisabledEmailQuerySet)()
+
     class Meta:
         constraints = [
             models.UniqueConstraint("user", "group", name="unique_group_per_user"),
         ]
+
+
+@receiver(post_save, sender=TemplateTransactional)
+@receiver(post_delete, sender=TemplateTransactional)
+@receiver(post_save, sender=EmailGroup)
+@receiver(post_delete, sender=EmailGroup)
+def template_transactional_post_save_or_delete(sender, instance, **kwargs):
+    template_transactional_cache.invalidate()
@@ -1,15 +1,28 @@
-from datetime import datetime, timezone as datetime_timezone
+import gzip
+import json
+from datetime import datetime, timedelta, timezone as datetime_timezone
+from io import StringIO
 from unittest.mock import patch
 
 from django.core.exceptions import ValidationError
 from django.core.management import call_command
 from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
 
+from lemarche.conversations.cache import template_transactional_cache
 from lemarche.conversations.constants import ATTRIBUTES_TO_NOT_ANONYMIZE_FOR_INBOUND, ATTRIBUTES_TO_SAVE_FOR_INBOUND
 from lemarche.conversations.factories import ConversationFactory, EmailGroupFactory, TemplateTransactionalFactory
-from lemarche.conversations.models import Conversation, DisabledEmail, TemplateTransactional
+from lemarche.conversations.models import (
+    Conversation,
+    DisabledEmail,
+    TemplateTransactional,
+    TemplateTransactionalSendCounter,
+    TemplateTransactionalSendLog,
+    TemplateTransactionalSendLogWriter,
+)
 from lemarche.siaes.factories import SiaeFactory
 from lemarche.users.factories import UserFactory
+from lemarche.utils.tests_s3 import FakeS3Client
 
 
 class ConversationModelTest(TestCase):
@@ -122,6 +135,10 @@ class TemplateTransactionalModelTest(TestCase):
             name="Email 3", code="EMAIL_3", brevo_id=41, is_active=True, group=cls.email_group
         )
 
+    def setUp(self):
+        # the templates cache is process-local: not rolled back with the test transactions
+        template_transactional_cache.mark_stale()
+
     def test_get_template_id(self):
         self.assertIsNone(self.tt_active_empty.get_template_id)
         self.assertEqual(self.tt_inactive.get_template_id, self.tt_inactive.brevo_id)
@@ -154,6 +171,132 @@ class TemplateTransactionalModelTest(TestCase):
         self.tt_active_brevo.send_transactional_email(recipient_email=email_test, recipient_name="test", variables={})
         mock_send_transactional_email_brevo.assert_not_called()
 
+    @patch("lemarche.conversations.models.api_brevo.send_transactional_email_batch_with_template")
+    def test_send_transactional_email_batch(self, mock_send_transactional_email_batch_brevo):
+        user = UserFactory(email="disabled@example.com")
+        DisabledEmail.objects.create(user=user, group=self.email_group)
+        self.tt_active_brevo.save()
+        self.tt_active_brevo.send_transactional_email_batch(
+            [
+                {"recipient_email": "test1@example.com", "recipient_name": "test 1", "variables": {"ID": 1}},
+                {"recipient_email": "disabled@example.com", "recipient_name": "test 2", "variables": {"ID": 2}},
+                {"recipient_email": "test3@example.com", "recipient_name": "test 3", "variables": {"ID": 3}},
+            ],
+            subject="Sujet",
+        )
+        mock_send_transactional_email_batch_brevo.assert_called_once()
+        recipient_list = mock_send_transactional_email_batch_brevo.call_args.kwargs["recipient_list"]
+        self.assertEqual([recipient["variables"]["ID"] for recipient in recipient_list], [1, 3])
+        self.assertEqual(self.tt_active_brevo.send_logs.count(), 2)
+        self.assertEqual(TemplateTransactional.objects.with_stats().get(id=self.tt_active_brevo.id).send_log_count, 2)
+
+    def test_send_log_writer(self):
+        self.tt_active_brevo.save()
+        user_list = UserFactory.create_batch(3)
+        siae = SiaeFactory()
+        with TemplateTransactionalSendLogWriter(batch_size=2) as send_log_writer:
+            for user in user_list:
+                send_log_writer.add(
+                    template_transactional=self.tt_active_brevo,
+                    recipient_content_object=user,
+                    parent_content_object=siae,
+                )
+            # the first batch is written
+            self.assertEqual(self.tt_active_brevo.send_logs.count(), 2)
+        self.assertEqual(self.tt_active_brevo.send_logs.count(), 3)
+        self.assertEqual(TemplateTransactional.objects.with_stats().get(id=self.tt_active_brevo.id).send_log_count, 3)
+        self.assertEqual(
+            TemplateTransactionalSendCounter.objects.get_count(
+                user_list[0], TemplateTransactionalSendCounter.ROLE_RECIPIENT
+            ),
+            1,
+        )
+        self.assertEqual(
+            TemplateTransactionalSendCounter.objects.get_count(siae, TemplateTransactionalSendCounter.ROLE_PARENT), 3
+        )
+        self.assertEqual(
+            TemplateTransactionalSendCounter.objects.get_count(siae, TemplateTransactionalSendCounter.ROLE_RECIPIENT),
+            0,
+        )
+        # not written on error
+        with self.assertRaises(ValueError):
+            with TemplateTransactionalSendLogWriter() as send_log_writer:
+                send_log_writer.add(template_transactional=self.tt_active_brevo, recipient_content_object=siae)
+                raise ValueError
+        self.assertEqual(self.tt_active_brevo.send_logs.count(), 3)
+
+    @override_settings(TEMPLATE_TRANSACTIONAL_CACHE_ENABLED=True)
+    def test_get_by_code(self):
+        self.tt_active_brevo.save()
+        # cached: a single query for all the templates
+        with self.assertNumQueries(1):
+            TemplateTransactional.objects.get_by_code("EMAIL_3")
+            template = TemplateTransactional.objects.get_by_code("EMAIL_3")
+            self.assertEqual(template.group, self.email_group)
+        self.assertEqual(template, self.tt_active_brevo)
+        self.assertRaises(TemplateTransactional.DoesNotExist, TemplateTransactional.objects.get_by_code, "EMAIL_1")
+        # invalidated on save
+        self.tt_inactive.save()
+        self.assertEqual(TemplateTransactional.objects.get_by_code("EMAIL_1"), self.tt_inactive)
+        self.tt_active_brevo.brevo_id = 42
+        self.tt_active_brevo.save()
+        self.assertEqual(TemplateTransactional.objects.get_by_code("EMAIL_3").brevo_id, 42)
+
+    def test_disabled_email_group_set(self):
+        other_email_group = EmailGroupFactory()
+        user = UserFactory(email="disabled@example.com")
+        DisabledEmail.objects.create(user=user, group=self.email_group)
+        DisabledEmail.objects.create(user=user, group=other_email_group)
+        DisabledEmail.objects.create(user=UserFactory(email="other@example.com"), group=self.email_group)
+        with self.assertNumQueries(1):
+            disabled_email_group_set = DisabledEmail.objects.email_group_set(
+                ["test@example.com", "disabled@example.com"]
+            )
+        self.assertEqual(
+            disabled_email_group_set,
+            {("disabled@example.com", self.email_group.id), ("disabled@example.com", other_email_group.id)},
+        )
+
+
+class TemplateTransactionalSendLogArchiveCommandTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.template = TemplateTransactionalFactory()
+        cls.user = UserFactory()
+        for _ in range(3):
+            cls.template.create_send_log(recipient_content_object=cls.user, extra_data={"source": "BREVO"})
+        cls.old_send_log_id_list = list(
+            TemplateTransactionalSendLog.objects.order_by("id").values_list("id", flat=True)[:2]
+        )
+        TemplateTransactionalSendLog.objects.filter(id__in=cls.old_send_log_id_list).update(
+            created_at=timezone.now() - timedelta(days=800)
+        )
+
+    def test_archive_dry_run(self):
+        with patch("lemarche.utils.s3.boto3.client") as mock_client:
+            call_command("archive_template_transactional_send_logs", dry_run=True, stdout=StringIO())
+        mock_client.assert_not_called()
+        self.assertEqual(TemplateTransactionalSendLog.objects.count(), 3)
+
+    def test_archive(self):
+        client = FakeS3Client()
+        with patch("lemarche.utils.s3.boto3.client", return_value=client):
+            call_command("archive_template_transactional_send_logs", stdout=StringIO())
+        # the old logs are in the archive...
+        line_list = gzip.decompress(b"".join(client.part_list)).decode("utf-8").splitlines()
+        self.assertEqual([json.loads(line)["id"] for line in line_list], self.old_send_log_id_list)
+        self.assertEqual(json.loads(line_list[0])["extra_data"], {"source": "BREVO"})
+        # ... and no longer in the db
+        self.assertEqual(TemplateTransactionalSendLog.objects.count(), 1)
+        self.assertFalse(TemplateTransactionalSendLog.objects.filter(id__in=self.old_send_log_id_list).exists())
+        # the counters are kept
+        self.assertEqual(
+            TemplateTransactionalSendCounter.objects.get_count(
+                self.user, TemplateTransactionalSendCounter.ROLE_RECIPIENT
+            ),
+            3,
+        )
+
 
 class TemplateTransactionalModelSaveTest(TransactionTestCase):
     def test_template_transactional_validation_on_save(self):
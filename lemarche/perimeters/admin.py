@@ -1,6 +1,6 @@
 from django.contrib import admin
 
-from lemarche.perimeters.models import Perimeter
+from lemarche.perimeters.models import Perimeter, Qpv, Zrr
 from lemarche.utils.admin.admin_site import admin_site
 
 
@@ -36,3 +36,33 @@ class PerimeterAdmin(admin.ModelAdmin):
 
     def has_delete_permission(self, request, obj=None):
         return False
+
+
+@admin.register(Qpv, site=admin_site)
+class QpvAdmin(admin.ModelAdmin):
+    list_display = ["id", "code", "name", "created_at"]
+    search_fields = ["id", "code", "name"]
+    search_help_text = "Cherche sur les champs : ID, Code, Nom"
+
+    readonly_fields = [field.name for field in Qpv._meta.fields]
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(Zrr, site=admin_site)
+class ZrrAdmin(admin.ModelAdmin):
+    list_display = ["id", "insee_code", "name", "created_at"]
+    search_fields = ["id", "insee_code", "name"]
+    search_help_text = "Cherche sur les champs : ID, Code INSEE, Nom"
+
+    readonly_fields = [field.name for field in Zrr._meta.fields]
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
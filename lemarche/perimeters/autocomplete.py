@@ -0,0 +1,177 @@
+import bisect
+import re
+import threading
+import time
+import unicodedata
+from collections import Counter, defaultdict
+
+from django.core.cache import cache
+
+from lemarche.perimeters.models import Perimeter
+
+
+# bumped by the import commands, so that every process reloads its index (see invalidate())
+INDEX_VERSION_CACHE_KEY = "perimeter_autocomplete_index_version"
+# how often (in seconds) each process checks the index version in the shared cache
+INDEX_VERSION_CHECK_INTERVAL = 60
+# same threshold as PerimeterQuerySet.name_search
+SIMILARITY_THRESHOLD = 0.1
+# same fields as PerimeterSimpleSerializer
+PERIMETER_FIELDS = ["id", "name", "slug", "kind", "insee_code", "post_codes", "department_code", "region_code"]
+
+WORD_SEPARATOR_REGEX = re.compile(r"[^a-z0-9]+")
+
+
+def normalize(value) -> str:
+    """
+    Lowercase, without accents
+    """
+    value = unicodedata.normalize("NFKD", value or "")
+    return "".join(char for char in value if not unicodedata.combining(char)).lower()
+
+
+def trigrams(value) -> set:
+    """
+    Same trigrams as pg_trgm (on the normalized value): each word is padded with 2 spaces before & 1 space after
+    """
+    trigram_set = set()
+    for word in WORD_SEPARATOR_REGEX.split(normalize(value)):
+        if word:
+            padded_word = f"  {word} "
+            trigram_set.update(padded_word[i : i + 3] for i in range(len(padded_word) - 2))
+    return trigram_set
+
+
+class PerimeterAutocompleteIndex:
+    """
+    Process-local index of the Perimeters, to answer the autocomplete without querying the database:
+    - names: trigram similarity (like pg_trgm), with a boost for the names (or slugs) starting with the search
+    - post codes: same rules as PerimeterQuerySet.post_code_search
+
+    The index is loaded lazily (on the first search), and reloaded:
+    - in the current process: as soon as a Perimeter is saved or deleted (see the Perimeter signals)
+    - in the other processes: after the import commands (invalidate() bumps a version in the shared cache)
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.data = None
+        self.version = None
+        self.version_checked_at = 0
+
+    def load(self) -> dict:
+        perimeter_list = list()
+        trigram_index = defaultdict(list)
+        post_code_index = defaultdict(list)
+        for perimeter in Perimeter.objects.values(*PERIMETER_FIELDS).order_by("insee_code"):
+            perimeter_index = len(perimeter_list)
+            perimeter_trigrams = trigrams(perimeter["name"])
+            perimeter_list.append(
+                {
+                    "data": perimeter,
+                    "trigram_count": len(perimeter_trigrams),
+                    "prefixes": (normalize(perimeter["name"]), perimeter["slug"]),
+                }
+            )
+            for trigram in perimeter_trigrams:
+                trigram_index[trigram].append(perimeter_index)
+            for post_code in set(perimeter["post_codes"] or []):
+                post_code_index[post_code].append(perimeter_index)
+        return {
+            "perimeter_list": perimeter_list,
+            "trigram_index": dict(trigram_index),
+            "post_code_index": dict(post_code_index),
+            # sorted (first post_code, index): for the post_code prefix search
+            "first_post_code_list": sorted(
+                (perimeter["data"]["post_codes"][0], index)
+                for index, perimeter in enumerate(perimeter_list)
+                if perimeter["data"]["post_codes"]
+            ),
+            "insee_code_index": {
+                perimeter["data"]["insee_code"]: index for index, perimeter in enumerate(perimeter_list)
+            },
+        }
+
+    def get_data(self) -> dict:
+        if time.monotonic() - self.version_checked_at > INDEX_VERSION_CHECK_INTERVAL:
+            version = cache.get(INDEX_VERSION_CACHE_KEY)
+            self.version_checked_at = time.monotonic()
+            if version != self.version:
+                self.version = version
+                self.data = None
+        data = self.data
+        if data is None:
+            with self.lock:
+                if self.data is None:
+                    self.data = self.load()
+                data = self.data
+        return data
+
+    def mark_stale(self):
+        """
+        Reload the index (of the current process) on the next search
+        """
+        self.data = None
+
+    def invalidate(self):
+        """
+        Reload the index of every process
+        """
+        cache.set(INDEX_VERSION_CACHE_KEY, time.time(), None)
+        self.mark_stale()
+
+    def search(self, value, kind=None, limit=None) -> list:
+        """
+        Returns the serialized Perimeters (see PERIMETER_FIELDS), best results first
+        """
+        value = value.strip()
+        if not value:
+            return []
+        data = self.get_data()
+        if value.isnumeric():
+            index_list = self.post_code_search(data, value)
+        else:
+            index_list = self.name_search(data, value)
+        perimeter_list = [data["perimeter_list"][index]["data"] for index in index_list]
+        if kind:
+            perimeter_list = [perimeter for perimeter in perimeter_list if perimeter["kind"] == kind]
+        return perimeter_list[:limit] if limit else perimeter_list
+
+    def name_search(self, data, value) -> list:
+        value_trigrams = trigrams(value)
+        common_trigram_count = Counter()
+        for trigram in value_trigrams:
+            common_trigram_count.update(data["trigram_index"].get(trigram, []))
+
+        value_prefix = normalize(value)
+        value_slug_prefix = WORD_SEPARATOR_REGEX.sub("-", value_prefix)
+        result_list = list()
+        for index, common_count in common_trigram_count.items():
+            perimeter = data["perimeter_list"][index]
+            similarity = common_count / (len(value_trigrams) + perimeter["trigram_count"] - common_count)
+            if similarity > SIMILARITY_THRESHOLD:
+                name_prefix, slug = perimeter["prefixes"]
+                is_prefix = name_prefix.startswith(value_prefix) or slug.startswith(value_slug_prefix)
+                result_list.append((is_prefix, similarity, -index))
+        result_list.sort(reverse=True)
+        return [-minus_index for (_, _, minus_index) in result_list]
+
+    def post_code_search(self, data, value) -> list:
+        """
+        The perimeter_list is ordered by insee_code: so are the results
+        """
+        # city post_code
+        if len(value) == 5:
+            return data["post_code_index"].get(value, [])
+        # beginning of city post_code (only the first one, like PerimeterQuerySet.post_code_search)
+        first_post_code_list = data["first_post_code_list"]
+        start = bisect.bisect_left(first_post_code_list, (value,))
+        end = bisect.bisect_left(first_post_code_list, (value + "\uffff",))
+        index_set = {index for (_, index) in first_post_code_list[start:end]}
+        # department code
+        if len(value) == 2 and value in data["insee_code_index"]:
+            index_set.add(data["insee_code_index"][value])
+        return sorted(index_set)
+
+
+perimeter_autocomplete_index = PerimeterAutocompleteIndex()
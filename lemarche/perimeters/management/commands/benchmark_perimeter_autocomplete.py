@@ -0,0 +1,79 @@
+from timeit import default_timer as timer
+
+from django.conf import settings
+
+from lemarche.api.perimeters.serializers import PerimeterSimpleSerializer
+from lemarche.perimeters.autocomplete import perimeter_autocomplete_index
+from lemarche.perimeters.models import Perimeter
+from lemarche.utils.commands import BaseCommand
+
+
+def percentile(duration_list, percent):
+    duration_list = sorted(duration_list)
+    return duration_list[min(int(len(duration_list) * percent / 100), len(duration_list) - 1)]
+
+
+class Command(BaseCommand):
+    """
+    Goal: compare the perimeter autocomplete answered by the database (PerimeterQuerySet)
+    with the in-memory index (lemarche.perimeters.autocomplete), on real data
+
+    By default the queries are the successive keystrokes of the names & post codes of the biggest cities.
+
+    Usage:
+    python manage.py benchmark_perimeter_autocomplete
+    python manage.py benchmark_perimeter_autocomplete --limit 50
+    python manage.py benchmark_perimeter_autocomplete --query gre --query 3800
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument("--query", action="append", default=[], help="Recherche à tester (répétable)")
+        parser.add_argument("--limit", type=int, default=20, help="Nombre de villes (si pas de --query)")
+
+    def handle(self, *args, **options):
+        self.stdout_messages_info("Benchmarking perimeter autocomplete...")
+        max_results = settings.API_PERIMETER_AUTOCOMPLETE_MAX_RESULTS
+
+        query_list = options["query"]
+        if not query_list:
+            city_list = Perimeter.objects.cities().exclude(population=None).order_by("-population")
+            for name, post_codes in city_list.values_list("name", "post_codes")[: options["limit"]]:
+                query_list += [name[:length] for length in range(3, len(name) + 1)]
+                if post_codes:
+                    query_list += [post_codes[0][:length] for length in range(2, 6)]
+
+        if not query_list:
+            self.stdout_warning("No query found")
+            return
+
+        start_time = timer()
+        perimeter_autocomplete_index.get_data()
+        load_duration = timer() - start_time
+
+        database_duration_list, index_duration_list = [], []
+        same_first_result_count = 0
+        for query in query_list:
+            start_time = timer()
+            database_result_list = PerimeterSimpleSerializer(
+                Perimeter.objects.name_or_post_code_autocomplete_search(query)[:max_results], many=True
+            ).data
+            database_duration_list.append(timer() - start_time)
+
+            start_time = timer()
+            index_result_list = perimeter_autocomplete_index.search(query, limit=max_results)
+            index_duration_list.append(timer() - start_time)
+
+            if database_result_list[:1] == index_result_list[:1]:
+                same_first_result_count += 1
+
+        msg_success = [
+            "----- Perimeter autocomplete benchmark -----",
+            f"Queries: {len(query_list)} (same first result: {same_first_result_count})",
+            f"Index load: {load_duration:.3f}s",
+        ]
+        for label, duration_list in [("Database", database_duration_list), ("Index", index_duration_list)]:
+            msg_success.append(
+                f"{label}: p50 {percentile(duration_list, 50) * 1000:.3f}ms"
+                f" / p99 {percentile(duration_list, 99) * 1000:.3f}ms"
+            )
+        self.stdout_messages_success(msg_success)
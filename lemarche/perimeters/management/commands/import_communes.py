@@ -7,7 +7,8 @@ import os
 from django.contrib.gis.geos import GEOSGeometry
 from django.core.management.base import BaseCommand
 
-from lemarche.perimeters.models import Perimeter
+from lemarche.perimeters.autocomplete import perimeter_autocomplete_index
+from lemarche.perimeters.models import Perimeter, PerimeterAncestry, perimeter_ancestry_refresh_disabled
 from lemarche.utils.constants import (
     DEPARTMENT_TO_REGION,
     DEPARTMENTS,
@@ -172,6 +173,8 @@ class Command(BaseCommand):
         if verbosity > 1:
             self.logger.setLevel(logging.DEBUG)
 
+    # the PerimeterAncestry table is rebuilt at the end
+    @perimeter_ancestry_refresh_disabled()
     def handle(self, dry_run=False, **options):
         self.stdout.write("-" * 80)
         self.stdout.write("Importing Perimeters > communes...")
@@ -251,6 +254,12 @@ class Command(BaseCommand):
                         },
                     )
 
+        if not dry_run:
+            # reload the autocomplete index of every process
+            perimeter_autocomplete_index.invalidate()
+            # rebuild the perimeter hierarchy (closure table)
+            PerimeterAncestry.objects.rebuild()
+
         self.stdout.write("Done.")
         self.stdout.write(
             f"After: {Perimeter.objects.filter(kind=Perimeter.KIND_CITY).count()} {Perimeter.KIND_CITY}s"
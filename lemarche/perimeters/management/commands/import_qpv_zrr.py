@@ -0,0 +1,93 @@
+import json
+
+import requests
+from django.contrib.gis.geos import GEOSGeometry, MultiPolygon
+from django.core.management.base import CommandError
+from django.db import transaction
+
+from lemarche.perimeters.models import Qpv, Zrr
+from lemarche.utils.commands import BaseCommand
+
+
+# same datasets as lemarche.utils.apis.api_qpv & api_zrr
+QPV_GEOJSON_URL = "https://equipements.sports.gouv.fr/api/explore/v2.1/catalog/datasets/quartiers-prioritaires-de-la-politique-de-la-ville-qpv/exports/geojson"  # noqa
+ZRR_GEOJSON_URL = 'https://public.opendatasoft.com/api/explore/v2.1/catalog/datasets/communes-zrr-2017/exports/geojson?refine=zrr_2017:"Classée"'  # noqa
+
+
+def load_geojson(file_path=None, url=None) -> list:
+    if file_path:
+        with open(file_path) as f:
+            return json.load(f)["features"]
+    response = requests.get(url, timeout=600)
+    response.raise_for_status()
+    return response.json()["features"]
+
+
+def feature_multipolygon(feature):
+    geometry = GEOSGeometry(json.dumps(feature["geometry"]))
+    if geometry.geom_type == "Polygon":
+        geometry = MultiPolygon(geometry, srid=geometry.srid)
+    return geometry
+
+
+class Command(BaseCommand):
+    """
+    Import the QPV polygons & the ZRR communes (with their shape) in the database,
+    to compute the Siae QPV & ZRR fields locally (see update_api_qpv_fields & update_api_zrr_fields)
+
+    The layers are replaced as a whole (in a transaction).
+
+    Usage:
+    python manage.py import_qpv_zrr
+    python manage.py import_qpv_zrr --layer qpv --file qpv.geojson
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--layer", type=str, choices=["qpv", "zrr", "all"], default="all", help="Couche à importer"
+        )
+        parser.add_argument("--file", type=str, default=None, help="Fichier GeoJSON (au lieu du téléchargement)")
+        parser.add_argument("--dry-run", dest="dry_run", action="store_true", help="Dry run, no writes")
+
+    def handle(self, *args, **options):
+        if options["file"] and options["layer"] == "all":
+            raise CommandError("--file requires --layer qpv or --layer zrr")
+
+        if options["layer"] in ("qpv", "all"):
+            features = load_geojson(options["file"], QPV_GEOJSON_URL)
+            qpv_list = [
+                Qpv(
+                    code=feature["properties"]["identifiant"],
+                    name=feature["properties"]["nom_qp"],
+                    geometry=feature_multipolygon(feature),
+                )
+                for feature in features
+                if feature["geometry"]
+            ]
+            self.replace_layer(Qpv, qpv_list, options["dry_run"])
+
+        if options["layer"] in ("zrr", "all"):
+            features = load_geojson(options["file"], ZRR_GEOJSON_URL)
+            zrr_list = [
+                Zrr(
+                    insee_code=feature["properties"]["com17"],
+                    name=feature["properties"]["nom_commune"],
+                    geometry=feature_multipolygon(feature),
+                )
+                for feature in features
+                if feature["geometry"]
+            ]
+            self.replace_layer(Zrr, zrr_list, options["dry_run"])
+
+    def replace_layer(self, model, object_list, dry_run=False):
+        count_before = model.objects.count()
+        if not dry_run:
+            with transaction.atomic():
+                model.objects.all().delete()
+                model.objects.bulk_create(object_list, batch_size=500)
+        self.stdout_messages_success(
+            [
+                f"----- Import {model._meta.verbose_name} -----",
+                f"Before: {count_before} / imported: {len(object_list)}" + (" (dry run)" if dry_run else ""),
+            ]
+        )
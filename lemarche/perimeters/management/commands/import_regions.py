@@ -4,7 +4,8 @@ import os
 
 from django.core.management.base import BaseCommand
 
-from lemarche.perimeters.models import Perimeter
+from lemarche.perimeters.autocomplete import perimeter_autocomplete_index
+from lemarche.perimeters.models import Perimeter, PerimeterAncestry, perimeter_ancestry_refresh_disabled
 from lemarche.utils.constants import REGIONS
 
 
@@ -44,6 +45,8 @@ class Command(BaseCommand):
         if verbosity > 1:
             self.logger.setLevel(logging.DEBUG)
 
+    # the PerimeterAncestry table is rebuilt at the end
+    @perimeter_ancestry_refresh_disabled()
     def handle(self, dry_run=False, **options):
         self.stdout.write("-" * 80)
         self.stdout.write("Importing Perimeters > regions...")
@@ -91,6 +94,12 @@ class Command(BaseCommand):
                 insee_code=insee_code,
             )
 
+        if not dry_run:
+            # reload the autocomplete index of every process
+            perimeter_autocomplete_index.invalidate()
+            # rebuild the perimeter hierarchy (closure table)
+            PerimeterAncestry.objects.rebuild()
+
         self.stdout.write("Done.")
         self.stdout.write(
             f"After: {Perimeter.objects.filter(kind=Perimeter.KIND_REGION).count()} {Perimeter.KIND_REGION}s"
@@ -0,0 +1,58 @@
+# Generated by Django 5.1.6 on 2026-10-18 13:23
+
+import django.contrib.gis.db.models.fields
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("perimeters", "0005_alter_perimeter_post_codes"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="Qpv",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("code", models.CharField(max_length=16, unique=True, verbose_name="Code QPV")),
+                ("name", models.CharField(max_length=255, verbose_name="Nom")),
+                (
+                    "geometry",
+                    django.contrib.gis.db.models.fields.MultiPolygonField(
+                        geography=True, srid=4326, verbose_name="Contour"
+                    ),
+                ),
+                (
+                    "created_at",
+                    models.DateTimeField(default=django.utils.timezone.now, verbose_name="Date de création"),
+                ),
+            ],
+            options={
+                "verbose_name": "QPV",
+                "verbose_name_plural": "QPV",
+            },
+        ),
+        migrations.CreateModel(
+            name="Zrr",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("insee_code", models.CharField(max_length=5, unique=True, verbose_name="Code INSEE")),
+                ("name", models.CharField(max_length=255, verbose_name="Nom")),
+                (
+                    "geometry",
+                    django.contrib.gis.db.models.fields.MultiPolygonField(
+                        geography=True, srid=4326, verbose_name="Contour"
+                    ),
+                ),
+                (
+                    "created_at",
+                    models.DateTimeField(default=django.utils.timezone.now, verbose_name="Date de création"),
+                ),
+            ],
+            options={
+                "verbose_name": "ZRR",
+                "verbose_name_plural": "ZRR",
+            },
+        ),
+    ]
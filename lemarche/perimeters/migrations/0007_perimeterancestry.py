@@ -0,0 +1,83 @@
+# Generated by Django 5.1.6 on 2026-10-18 13:44
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+# frozen copy of lemarche.perimeters.models.PERIMETER_ANCESTRY_FIELDS & build_perimeter_ancestry_list
+PERIMETER_ANCESTRY_FIELDS = ["id", "kind", "insee_code", "department_code", "region_code"]
+
+
+def build_perimeter_ancestry_list(perimeter_list, parent_list) -> list:
+    parent_id_by_kind_and_insee_code = {
+        (parent["kind"], parent["insee_code"]): parent["id"] for parent in parent_list if parent["kind"] != "CITY"
+    }
+    perimeter_ancestry_list = list()
+    for perimeter in perimeter_list:
+        perimeter_ancestry_list.append((perimeter["id"], perimeter["id"], 0))
+        parent_key_list = list()
+        if perimeter["kind"] == "CITY":
+            parent_key_list.append(("DEPARTMENT", perimeter["department_code"]))
+        if perimeter["kind"] in ("CITY", "DEPARTMENT"):
+            parent_key_list.append(("REGION", f"R{perimeter['region_code']}"))
+        for depth, parent_key in enumerate(parent_key_list, start=1):
+            if parent_key in parent_id_by_kind_and_insee_code:
+                perimeter_ancestry_list.append((perimeter["id"], parent_id_by_kind_and_insee_code[parent_key], depth))
+    return perimeter_ancestry_list
+
+
+def build_perimeter_ancestry(apps, schema_editor):
+    Perimeter = apps.get_model("perimeters", "Perimeter")
+    PerimeterAncestry = apps.get_model("perimeters", "PerimeterAncestry")
+    perimeter_list = list(Perimeter.objects.values(*PERIMETER_ANCESTRY_FIELDS))
+    PerimeterAncestry.objects.bulk_create(
+        [
+            PerimeterAncestry(perimeter_id=perimeter_id, ancestor_id=ancestor_id, depth=depth)
+            for (perimeter_id, ancestor_id, depth) in build_perimeter_ancestry_list(perimeter_list, perimeter_list)
+        ],
+        batch_size=5000,
+    )
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("perimeters", "0006_qpv_zrr"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="PerimeterAncestry",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("depth", models.PositiveSmallIntegerField(default=0, verbose_name="Profondeur")),
+                (
+                    "ancestor",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="descendant_ancestry",
+                        to="perimeters.perimeter",
+                        verbose_name="Périmètre parent (ou lui-même)",
+                    ),
+                ),
+                (
+                    "perimeter",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="ancestry",
+                        to="perimeters.perimeter",
+                        verbose_name="Périmètre",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Hiérarchie des périmètres",
+                "verbose_name_plural": "Hiérarchie des périmètres",
+                "constraints": [
+                    models.UniqueConstraint(
+                        models.F("perimeter"), models.F("ancestor"), name="unique_perimeter_ancestor"
+                    )
+                ],
+            },
+        ),
+        migrations.RunPython(build_perimeter_ancestry, migrations.RunPython.noop),
+    ]
@@ -1,11 +1,16 @@
 # https://github.com/betagouv/itou/blob/master/itou/cities/models.py
 # code_insee --> insee_code
 
+from contextlib import contextmanager
+from contextvars import ContextVar
+
 from django.contrib.gis.db import models as gis_models
 from django.contrib.postgres.indexes import GinIndex
 from django.contrib.postgres.search import TrigramSimilarity
-from django.db import models
+from django.db import models, transaction
 from django.db.models import Q
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
 from django.template.defaultfilters import slugify
 from django.utils import timezone
 
@@ -139,3 +144,183 @@ class Perimeter(models.Model):
         if self.coords:
             return self.coords.x
         return None
+
+
+class Qpv(models.Model):
+    """
+    Quartiers prioritaires de la politique de la ville (local copy of the reference layer)
+    See the import_qpv_zrr command
+    """
+
+    code = models.CharField(verbose_name="Code QPV", max_length=16, unique=True)
+    name = models.CharField(verbose_name="Nom", max_length=255)
+    geometry = gis_models.MultiPolygonField(verbose_name="Contour", geography=True)
+
+    created_at = models.DateTimeField(verbose_name="Date de création", default=timezone.now)
+
+    class Meta:
+        verbose_name = "QPV"
+        verbose_name_plural = "QPV"
+
+    def __str__(self):
+        return f"{self.name} ({self.code})"
+
+
+class Zrr(models.Model):
+    """
+    Communes classées en Zone de revitalisation rurale (local copy of the reference layer)
+    See the import_qpv_zrr command
+    """
+
+    insee_code = models.CharField(verbose_name="Code INSEE", max_length=5, unique=True)
+    name = models.CharField(verbose_name="Nom", max_length=255)
+    geometry = gis_models.MultiPolygonField(verbose_name="Contour", geography=True)
+
+    created_at = models.DateTimeField(verbose_name="Date de création", default=timezone.now)
+
+    class Meta:
+        verbose_name = "ZRR"
+        verbose_name_plural = "ZRR"
+
+    def __str__(self):
+        return f"{self.name} ({self.insee_code})"
+
+
+# the fields needed to build the PerimeterAncestry rows
+PERIMETER_ANCESTRY_FIELDS = ["id", "kind", "insee_code", "department_code", "region_code"]
+
+
+def build_perimeter_ancestry_list(perimeter_list, parent_list) -> list:
+    """
+    Returns the (perimeter_id, ancestor_id, depth) tuples of each perimeter (dicts of PERIMETER_ANCESTRY_FIELDS):
+    itself (depth 0), its department (cities only) and its region, found in parent_list
+    (Note: a frozen copy is used by the perimeters 0007 migration)
+    """
+    parent_id_by_kind_and_insee_code = {
+        (parent["kind"], parent["insee_code"]): parent["id"]
+        for parent in parent_list
+        if parent["kind"] != Perimeter.KIND_CITY
+    }
+    perimeter_ancestry_list = list()
+    for perimeter in perimeter_list:
+        perimeter_ancestry_list.append((perimeter["id"], perimeter["id"], 0))
+        parent_key_list = list()
+        if perimeter["kind"] == Perimeter.KIND_CITY:
+            parent_key_list.append((Perimeter.KIND_DEPARTMENT, perimeter["department_code"]))
+        if perimeter["kind"] in (Perimeter.KIND_CITY, Perimeter.KIND_DEPARTMENT):
+            parent_key_list.append((Perimeter.KIND_REGION, f"R{perimeter['region_code']}"))
+        for depth, parent_key in enumerate(parent_key_list, start=1):
+            if parent_key in parent_id_by_kind_and_insee_code:
+                perimeter_ancestry_list.append((perimeter["id"], parent_id_by_kind_and_insee_code[parent_key], depth))
+    return perimeter_ancestry_list
+
+
+class PerimeterAncestryQuerySet(models.QuerySet):
+    def ancestor_id_subquery(self, perimeter_id_list):
+        """
+        The ids of the perimeters that include (or are) one of the perimeters
+        """
+        return self.filter(perimeter_id__in=perimeter_id_list).values("ancestor_id")
+
+    def rebuild(self) -> int:
+        """
+        Rebuild the whole table (see the import_communes, import_departements & import_regions commands)
+        """
+        perimeter_list = list(Perimeter.objects.values(*PERIMETER_ANCESTRY_FIELDS))
+        perimeter_ancestry_list = build_perimeter_ancestry_list(perimeter_list, perimeter_list)
+        with transaction.atomic():
+            self.all().delete()
+            self.bulk_create(
+                [
+                    PerimeterAncestry(perimeter_id=perimeter_id, ancestor_id=ancestor_id, depth=depth)
+                    for (perimeter_id, ancestor_id, depth) in perimeter_ancestry_list
+                ],
+                batch_size=5000,
+            )
+        return len(perimeter_ancestry_list)
+
+    def refresh_for_perimeter(self, perimeter):
+        """
+        Refresh the rows of the perimeter, and of its cities (& departments) if it is a department (or a region)
+        """
+        perimeter_queryset = Perimeter.objects.filter(id=perimeter.id)
+        if perimeter.kind == Perimeter.KIND_DEPARTMENT:
+            perimeter_queryset |= Perimeter.objects.cities().filter(department_code=perimeter.insee_code)
+        elif perimeter.kind == Perimeter.KIND_REGION:
+            perimeter_queryset |= Perimeter.objects.exclude(kind=Perimeter.KIND_REGION).filter(
+                region_code=perimeter.insee_code[1:]
+            )
+        perimeter_list = list(perimeter_queryset.values(*PERIMETER_ANCESTRY_FIELDS))
+        parent_list = list(Perimeter.objects.exclude(kind=Perimeter.KIND_CITY).values(*PERIMETER_ANCESTRY_FIELDS))
+        with transaction.atomic():
+            self.filter(perimeter_id__in=[perimeter["id"] for perimeter in perimeter_list]).delete()
+            self.bulk_create(
+                [
+                    PerimeterAncestry(perimeter_id=perimeter_id, ancestor_id=ancestor_id, depth=depth)
+                    for (perimeter_id, ancestor_id, depth) in build_perimeter_ancestry_list(
+                        perimeter_list, parent_list
+                    )
+                ]
+            )
+
+
+class PerimeterAncestry(models.Model):
+    """
+    Closure table of the Perimeter hierarchy (city -> department -> region):
+    one row per (perimeter, ancestor-or-self), to match "this location includes the searched perimeter"
+    with one indexed join (see SiaeActivityQuerySet.geo_range_in_perimeter_list)
+    """
+
+    perimeter = models.ForeignKey(
+        "perimeters.Perimeter", verbose_name="Périmètre", related_name="ancestry", on_delete=models.CASCADE
+    )
+    ancestor = models.ForeignKey(
+        "perimeters.Perimeter",
+        verbose_name="Périmètre parent (ou lui-même)",
+        related_name="descendant_ancestry",
+        on_delete=models.CASCADE,
+    )
+    depth = models.PositiveSmallIntegerField(verbose_name="Profondeur", default=0)
+
+    objects = models.Manager.from_queryset(PerimeterAncestryQuerySet)()
+
+    class Meta:
+        verbose_name = "Hiérarchie des périmètres"
+        verbose_name_plural = "Hiérarchie des périmètres"
+        constraints = [
+            models.UniqueConstraint("perimeter", "ancestor", name="unique_perimeter_ancestor"),
+        ]
+
+    def __str__(self):
+        return f"{self.perimeter_id} -> {self.ancestor_id}"
+
+
+@receiver(post_save, sender=Perimeter)
+@receiver(post_delete, sender=Perimeter)
+def perimeter_post_save_or_delete(sender, instance, **kwargs):
+    from lemarche.perimeters.autocomplete import perimeter_autocomplete_index
+
+    perimeter_autocomplete_index.mark_stale()
+
+
+# the import commands rebuild the whole PerimeterAncestry table at the end: no refresh on each save
+perimeter_ancestry_refresh_enabled = ContextVar("perimeter_ancestry_refresh_enabled", default=True)
+
+
+@contextmanager
+def perimeter_ancestry_refresh_disabled():
+    """
+    Context manager (or decorator): the Perimeter saves don't refresh their PerimeterAncestry rows
+    (the caller is in charge of calling PerimeterAncestry.objects.rebuild())
+    """
+    token = perimeter_ancestry_refresh_enabled.set(False)
+    try:
+        yield
+    finally:
+        perimeter_ancestry_refresh_enabled.reset(token)
+
+
+@receiver(post_save, sender=Perimeter)
+def perimeter_ancestry_post_save(sender, instance, **kwargs):
+    if perimeter_ancestry_refresh_enabled.get():
+        PerimeterAncestry.objects.refresh_for_perimeter(instance)
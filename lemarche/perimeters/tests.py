@@ -1,7 +1,17 @@
-from django.test import TestCase
+import json
+import tempfile
+from io import StringIO
+from unittest.mock import patch
 
+from django.contrib.gis.geos import MultiPolygon, Polygon
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import SimpleTestCase, TestCase
+
+from lemarche.perimeters.autocomplete import perimeter_autocomplete_index, trigrams
 from lemarche.perimeters.factories import PerimeterFactory
-from lemarche.perimeters.models import Perimeter
+from lemarche.perimeters.management.commands.import_qpv_zrr import feature_multipolygon
+from lemarche.perimeters.models import Perimeter, PerimeterAncestry, Qpv, Zrr, perimeter_ancestry_refresh_disabled
 
 
 class PerimeterModelTest(TestCase):
@@ -91,3 +101,169 @@ class PerimeterQuerysetTest(TestCase):
         qs = Perimeter.objects.post_code_search("38185", include_insee_code=True)
         self.assertEqual(qs.count(), 1)
         self.assertEqual(qs.first(), self.perimeter_city)
+
+
+class PerimeterAutocompleteIndexTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.perimeter_city = PerimeterFactory(
+            name="Grenoble",
+            kind=Perimeter.KIND_CITY,
+            insee_code="38185",
+            department_code="38",
+            region_code="84",
+            post_codes=["38000", "38100", "38700"],
+        )
+        cls.perimeter_city_2 = PerimeterFactory(
+            name="Saint-Égrève",
+            kind=Perimeter.KIND_CITY,
+            insee_code="38382",
+            department_code="38",
+            region_code="84",
+            post_codes=["38120"],
+        )
+        cls.perimeter_department = PerimeterFactory(
+            name="Isère", kind=Perimeter.KIND_DEPARTMENT, insee_code="38", region_code="84"
+        )
+        cls.perimeter_department_2 = PerimeterFactory(
+            name="Guadeloupe", kind=Perimeter.KIND_DEPARTMENT, insee_code="971", region_code="01"
+        )
+        cls.perimeter_region_2 = PerimeterFactory(name="Guadeloupe", kind=Perimeter.KIND_REGION, insee_code="R01")
+
+    def test_trigrams(self):
+        # same as pg_trgm: SELECT show_trgm('Isère');
+        self.assertEqual(trigrams("Isère"), {"  i", " is", "ise", "ser", "ere", "re "})
+
+    def test_name_search(self):
+        perimeter_autocomplete_index.get_data()
+        with self.assertNumQueries(0):
+            result_list = perimeter_autocomplete_index.search("grenob")
+        self.assertEqual([perimeter["id"] for perimeter in result_list], [self.perimeter_city.id])
+        self.assertEqual(result_list[0]["slug"], self.perimeter_city.slug)
+        self.assertEqual(result_list[0]["post_codes"], ["38000", "38100", "38700"])
+        # accents are ignored
+        result_list = perimeter_autocomplete_index.search("saint egr")
+        self.assertEqual(result_list[0]["id"], self.perimeter_city_2.id)
+        # kind & limit
+        self.assertEqual(len(perimeter_autocomplete_index.search("guadelou")), 2)
+        self.assertEqual(len(perimeter_autocomplete_index.search("guadelou", limit=1)), 1)
+        result_list = perimeter_autocomplete_index.search("guadelou", kind=Perimeter.KIND_REGION)
+        self.assertEqual([perimeter["id"] for perimeter in result_list], [self.perimeter_region_2.id])
+
+    def test_post_code_search(self):
+        result_list = perimeter_autocomplete_index.search("38100")
+        self.assertEqual([perimeter["id"] for perimeter in result_list], [self.perimeter_city.id])
+        # department code first (ordered by insee_code), then the cities
+        result_list = perimeter_autocomplete_index.search("38")
+        self.assertEqual(
+            [perimeter["id"] for perimeter in result_list],
+            [self.perimeter_department.id, self.perimeter_city.id, self.perimeter_city_2.id],
+        )
+        # only the first post_code (like PerimeterQuerySet.post_code_search)
+        self.assertEqual(len(perimeter_autocomplete_index.search("3812")), 1)
+        self.assertEqual(len(perimeter_autocomplete_index.search("3810")), 0)
+
+    def test_index_is_reloaded_on_save(self):
+        self.assertEqual(len(perimeter_autocomplete_index.search("lyon")), 0)
+        PerimeterFactory(name="Lyon", kind=Perimeter.KIND_CITY, insee_code="69123", post_codes=["69001"])
+        self.assertEqual(len(perimeter_autocomplete_index.search("lyon")), 1)
+
+
+class PerimeterAncestryTest(TestCase):
+    def get_ancestor_list(self, perimeter):
+        return list(
+            PerimeterAncestry.objects.filter(perimeter=perimeter).order_by("depth").values_list("ancestor", "depth")
+        )
+
+    def test_ancestry_is_kept_up_to_date_whatever_the_creation_order(self):
+        city = PerimeterFactory(kind=Perimeter.KIND_CITY, insee_code="38185", department_code="38", region_code="84")
+        self.assertEqual(self.get_ancestor_list(city), [(city.id, 0)])
+        department = PerimeterFactory(
+            kind=Perimeter.KIND_DEPARTMENT, insee_code="38", department_code="", region_code="84"
+        )
+        region = PerimeterFactory(kind=Perimeter.KIND_REGION, insee_code="R84", department_code="", region_code="")
+        self.assertEqual(self.get_ancestor_list(city), [(city.id, 0), (department.id, 1), (region.id, 2)])
+        self.assertEqual(self.get_ancestor_list(department), [(department.id, 0), (region.id, 1)])
+        self.assertEqual(self.get_ancestor_list(region), [(region.id, 0)])
+
+    def test_rebuild(self):
+        department = PerimeterFactory(
+            kind=Perimeter.KIND_DEPARTMENT, insee_code="38", department_code="", region_code="84"
+        )
+        city = PerimeterFactory(kind=Perimeter.KIND_CITY, insee_code="38185", department_code="38", region_code="84")
+        PerimeterAncestry.objects.all().delete()
+        self.assertEqual(PerimeterAncestry.objects.rebuild(), 3)
+        self.assertEqual(self.get_ancestor_list(city), [(city.id, 0), (department.id, 1)])
+
+    def test_refresh_disabled(self):
+        with perimeter_ancestry_refresh_disabled():
+            city = PerimeterFactory(
+                kind=Perimeter.KIND_CITY, insee_code="38185", department_code="38", region_code="84"
+            )
+        self.assertEqual(self.get_ancestor_list(city), [])
+        PerimeterAncestry.objects.rebuild()
+        self.assertEqual(self.get_ancestor_list(city), [(city.id, 0)])
+
+
+SQUARE_COORDINATES = [[[5.70, 45.17], [5.74, 45.17], [5.74, 45.20], [5.70, 45.20], [5.70, 45.17]]]
+
+
+def build_feature(properties, geometry_type="Polygon"):
+    coordinates = SQUARE_COORDINATES if geometry_type == "Polygon" else [SQUARE_COORDINATES]
+    return {
+        "type": "Feature",
+        "properties": properties,
+        "geometry": {"type": geometry_type, "coordinates": coordinates},
+    }
+
+
+class FeatureMultipolygonTest(SimpleTestCase):
+    def test_feature_multipolygon(self):
+        for geometry_type in ["Polygon", "MultiPolygon"]:
+            geometry = feature_multipolygon(build_feature({}, geometry_type))
+            self.assertEqual(geometry.geom_type, "MultiPolygon")
+            self.assertEqual(len(geometry), 1)
+
+
+class ImportQpvZrrCommandTest(TestCase):
+    def write_geojson(self, feature_list):
+        geojson_file = tempfile.NamedTemporaryFile(mode="w", suffix=".geojson")
+        json.dump({"type": "FeatureCollection", "features": feature_list}, geojson_file)
+        geojson_file.flush()
+        self.addCleanup(geojson_file.close)
+        return geojson_file.name
+
+    def test_import_qpv_replaces_the_layer(self):
+        square = Polygon(SQUARE_COORDINATES[0], srid=4326)
+        Qpv.objects.create(code="QN00000A", name="Ancien QPV", geometry=MultiPolygon(square, srid=4326))
+        file_path = self.write_geojson(
+            [
+                build_feature({"identifiant": "QN03801M", "nom_qp": "Villeneuve"}),
+                build_feature({"identifiant": "QN03802M", "nom_qp": "Mistral"}, geometry_type="MultiPolygon"),
+                # without geometry: ignored
+                {
+                    "type": "Feature",
+                    "properties": {"identifiant": "QN03803M", "nom_qp": "Sans contour"},
+                    "geometry": None,
+                },
+            ]
+        )
+        call_command("import_qpv_zrr", layer="qpv", file=file_path, stdout=StringIO())
+        self.assertEqual(
+            set(Qpv.objects.values_list("code", "name")), {("QN03801M", "Villeneuve"), ("QN03802M", "Mistral")}
+        )
+        self.assertEqual(Qpv.objects.get(code="QN03801M").geometry.geom_type, "MultiPolygon")
+        self.assertEqual(Zrr.objects.count(), 0)
+
+    def test_import_zrr_dry_run(self):
+        file_path = self.write_geojson([build_feature({"com17": "38185", "nom_commune": "Grenoble"})])
+        call_command("import_qpv_zrr", layer="zrr", file=file_path, dry_run=True, stdout=StringIO())
+        self.assertEqual(Zrr.objects.count(), 0)
+        call_command("import_qpv_zrr", layer="zrr", file=file_path, stdout=StringIO())
+        self.assertEqual(list(Zrr.objects.values_list("insee_code", "name")), [("38185", "Grenoble")])
+
+    @patch("lemarche.perimeters.management.commands.import_qpv_zrr.load_geojson")
+    def test_file_requires_a_layer(self, mock_load_geojson):
+        with self.assertRaises(CommandError):
+            call_command("import_qpv_zrr", file="qpv.geojson", stdout=StringIO())
+        mock_load_geojson.assert_not_called()
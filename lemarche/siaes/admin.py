@@ -9,7 +9,7 @@ from django.urls import reverse
 from django.utils.html import format_html, mark_safe
 from simple_history.admin import SimpleHistoryAdmin
 
-from lemarche.conversations.models import Conversation, TemplateTransactionalSendLog
+from lemarche.conversations.models import Conversation, TemplateTransactionalSendCounter, TemplateTransactionalSendLog
 from lemarche.labels.models import Label
 from lemarche.networks.models import Network
 from lemarche.notes.models import Note
@@ -648,7 +648,10 @@ class SiaeAdmin(FieldsetsInlineMixin, gis_admin.GISModelAdmin, SimpleHistoryAdmi
 
     def recipient_transactional_send_logs_count_with_link(self, obj):
         url = reverse("admin:conversations_templatetransactionalsendlog_changelist") + f"?siae__id__exact={obj.id}"
-        return format_html(f'<a href="{url}">{obj.recipient_transactional_send_logs.count()}</a>')
+        send_count = TemplateTransactionalSendCounter.objects.get_count(
+            obj, TemplateTransactionalSendCounter.ROLE_RECIPIENT
+        )
+        return format_html(f'<a href="{url}">{send_count}</a>')
 
     recipient_transactional_send_logs_count_with_link.short_description = (
         TemplateTransactionalSendLog._meta.verbose_name
@@ -700,7 +703,10 @@ class SiaeUserRequestAdmin(admin.ModelAdmin):
             reverse("admin:conversations_templatetransactionalsendlog_changelist")
             + f"?siaeuserrequest__id__exact={obj.id}"
         )
-        return format_html(f'<a href="{url}">{obj.parent_transactional_send_logs.count()}</a>')
+        send_count = TemplateTransactionalSendCounter.objects.get_count(
+            obj, TemplateTransactionalSendCounter.ROLE_PARENT
+        )
+        return format_html(f'<a href="{url}">{send_count}</a>')
 
     parent_transactional_send_logs_count_with_link.short_description = TemplateTransactionalSendLog._meta.verbose_name
 
@@ -6,7 +6,7 @@ from django.conf import settings
 from django.db.models import Q
 from django.utils import timezone
 
-from lemarche.siaes.models import Siae
+from lemarche.siaes.models import Siae, SiaeChange
 from lemarche.utils.apis import api_slack
 from lemarche.utils.commands import BaseCommand
 
@@ -14,11 +14,17 @@ from lemarche.utils.commands import BaseCommand
 class UpdateAPICommand(BaseCommand):
     """
     Base class for QPV and ZRR API fetch commands
+
+    If the local reference layer (LOCAL_MODEL, see the import_qpv_zrr command) is imported,
+    the fields are computed with a spatial join in the database instead of one API call per Siae
+    (--api to force the API)
     """
 
     API_NAME: str = None
     FIELDS_TO_BULK_UPDATE = []
     CLIENT = None
+    LOCAL_MODEL = None
+    TARGET_FIELD: str = None
 
     def __init__(self, stdout=None, stderr=None, no_color=False):
         super().__init__(stdout, stderr, no_color)
@@ -35,6 +41,9 @@ class UpdateAPICommand(BaseCommand):
             default=None,
             help="Forcer l'update sans la vérification de la dernière mise à jour",
         )
+        parser.add_argument(
+            "--api", action="store_true", help="Utiliser l'API (au lieu de la couche géographique locale)"
+        )
 
     @staticmethod
     def get_filter_query(date_limit) -> Q:
@@ -45,6 +54,11 @@ class UpdateAPICommand(BaseCommand):
     def is_in_target(latitude, longitude, client):
         raise NotImplementedError
 
+    @staticmethod
+    def update_from_local_layer(siae_queryset) -> int:
+        """Set-based update of the FIELDS_TO_BULK_UPDATE, returns the number of Siae updated"""
+        raise NotImplementedError
+
     def get_query_set(self, **options):
         siaes_queryset = Siae.objects.filter(Q(coords__isnull=False)).order_by("id")
 
@@ -56,7 +70,27 @@ class UpdateAPICommand(BaseCommand):
             siaes_queryset = siaes_queryset[: options["limit"]]
         return siaes_queryset
 
+    def handle_local_layer(self, **options):
+        siae_queryset = self.get_query_set(**options)
+        if options["limit"]:
+            siae_queryset = Siae.objects.filter(id__in=list(siae_queryset.values_list("id", flat=True)))
+        self.stdout_messages_info(f"Populating {self.API_NAME} from the local layer...")
+
+        siae_updated_count = self.update_from_local_layer(siae_queryset)
+        siae_target_count = siae_queryset.filter(**{self.TARGET_FIELD: True}).count()
+
+        msg_success = [
+            f"----- Synchronisation {self.API_NAME} (couche locale) -----",
+            f"Done! Processed {siae_updated_count} siaes",
+            f"True count: {siae_target_count}/{siae_updated_count}",
+        ]
+        self.stdout_messages_success(msg_success)
+        api_slack.send_message_to_channel("\n".join(msg_success))
+
     def handle(self, *args, **options):
+        if not options.get("api") and self.LOCAL_MODEL.objects.exists():
+            return self.handle_local_layer(**options)
+
         siae_list = self.get_query_set(**options)
         self.stdout_messages_info([f"Populating API {self.API_NAME}...", f"Found {len(siae_list)} Siae"])
 
@@ -83,6 +117,9 @@ class UpdateAPICommand(BaseCommand):
             Siae.objects.bulk_update(
                 siaes_to_update, self.FIELDS_TO_BULK_UPDATE, batch_size=settings.BATCH_SIZE_BULK_UPDATE
             )
+            # is_qpv is part of the API payload (see the API change feed)
+            if "is_qpv" in self.FIELDS_TO_BULK_UPDATE:
+                SiaeChange.objects.record([siae.id for siae in siaes_to_update])
 
             msg_success = [
                 f"----- Synchronisation API {self.API_NAME} -----",
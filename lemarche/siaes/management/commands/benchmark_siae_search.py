@@ -0,0 +1,76 @@
+import statistics
+from timeit import default_timer as timer
+
+from django.contrib.postgres.search import TrigramSimilarity
+from django.db.models import Q
+from django.db.models.functions import Greatest
+
+from lemarche.siaes.models import Siae
+from lemarche.utils.commands import BaseCommand
+
+
+class Command(BaseCommand):
+    """
+    Goal: compare the Siae full-text search (q) on the maintained search fields (Siae.objects.filter_full_text)
+    with the previous search (TrigramSimilarity computed on name & brand for every Siae), on real data
+
+    By default the queries are built from the names of the most recently updated Siae.
+
+    Usage:
+    python manage.py benchmark_siae_search
+    python manage.py benchmark_siae_search --limit 50
+    python manage.py benchmark_siae_search --query "ma boite" --query ethicofil
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument("--query", action="append", default=[], help="Recherche à tester (répétable)")
+        parser.add_argument("--limit", type=int, default=20, help="Nombre de recherches (si pas de --query)")
+
+    def handle(self, *args, **options):
+        self.stdout_messages_info("Benchmarking Siae search...")
+
+        query_list = options["query"]
+        if not query_list:
+            siae_name_list = Siae.objects.search_query_set().order_by("-updated_at").values_list("name", flat=True)
+            query_list = [name.split()[0] for name in siae_name_list[: options["limit"]] if name.split()]
+
+        if not query_list:
+            self.stdout_warning("No query found")
+            return
+
+        previous_duration_list, index_duration_list = [], []
+        result_count_list = []
+        for query in query_list:
+            start_time = timer()
+            previous_siae_id_list = list(
+                Siae.objects.search_query_set()
+                .annotate(similarity=Greatest(TrigramSimilarity("name", query), TrigramSimilarity("brand", query)))
+                .filter(Q(similarity__gt=0.2) | Q(siret__startswith=query))
+                .order_by("-similarity")
+                .values_list("id", flat=True)[:20]
+            )
+            previous_duration_list.append(timer() - start_time)
+
+            start_time = timer()
+            index_siae_id_list = list(
+                Siae.objects.search_query_set()
+                .filter_full_text(query)
+                .order_by("-similarity")
+                .values_list("id", flat=True)[:20]
+            )
+            index_duration_list.append(timer() - start_time)
+
+            result_count_list.append(
+                f"'{query}': {len(previous_siae_id_list)} / {len(index_siae_id_list)} results "
+                f"({len(set(previous_siae_id_list) & set(index_siae_id_list))} in common)"
+            )
+
+        msg_success = [
+            "----- Siae search benchmark -----",
+            f"Queries: {len(query_list)}",
+            "Previous: "
+            f"median {statistics.median(previous_duration_list):.3f}s / max {max(previous_duration_list):.3f}s",
+            f"Index: median {statistics.median(index_duration_list):.3f}s / max {max(index_duration_list):.3f}s",
+        ]
+        self.stdout_messages_success(msg_success)
+        self.stdout_messages_info(result_count_list)
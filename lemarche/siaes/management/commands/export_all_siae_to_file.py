@@ -7,7 +7,7 @@ import boto3
 from django.conf import settings
 from django.core.management.base import BaseCommand
 
-from lemarche.utils.export import export_siae_to_csv, export_siae_to_excel
+from lemarche.utils.export import export_siae_to_csv, export_siae_to_excel, export_siae_to_xlsx
 from lemarche.utils.s3 import API_CONNECTION_DICT
 from lemarche.www.siaes.forms import SiaeFilterForm
 
@@ -20,6 +20,7 @@ bucket = resource.Bucket(bucket_name)
 # Content-Type file mapping
 CONTENT_TYPE_MAPPING = {
     "xls": "application/ms-excel",
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
     "csv": "text/csv",
 }
 
@@ -33,11 +34,11 @@ def build_file_url(endpoint, bucket_name, file_key):
 
 class Command(BaseCommand):
     """
-    Export all Siae to a file (XLS or CSV)
+    Export all Siae to a file (XLSX, XLS or CSV)
 
     Steps:
     1. Use the SiaeFilterForm to get the list of all the Siae available for the user
-    2. Generate the file (.xls or .csv or both)
+    2. Generate the file (.xlsx, .xls or .csv, or all of them)
     3. Upload to S3
     4. Cleanup
 
@@ -51,9 +52,9 @@ class Command(BaseCommand):
         parser.add_argument(
             "--format",
             type=str,
-            choices=["xls", "csv", "all"],
+            choices=["xlsx", "xls", "csv", "all"],
             default="xls",
-            help="Options are 'xls' (default), 'csv' or 'all'",
+            help="Options are 'xls' (default), 'xlsx', 'csv' or 'all'",
         )
 
     def handle(self, *args, **options):
@@ -63,7 +64,7 @@ class Command(BaseCommand):
         self.stdout.write("Step 1: fetching Siae list")
         filter_form = SiaeFilterForm(data={})
         siae_list = filter_form.filter_queryset()
-        self.stdout.write(f"Found {len(siae_list)} Siae")
+        self.stdout.write(f"Found {siae_list.count()} Siae")
 
         if options["format"] in ["csv", "all"]:
             self.stdout.write("Step 2: generating the CSV file")
@@ -87,6 +88,16 @@ class Command(BaseCommand):
             self.stdout.write("Step 3: uploading the XLS file to S3")
             self.upload_file_to_s3(filename_with_extension)
 
+        if options["format"] in ["xlsx", "all"]:
+            self.stdout.write("Step 2: generating the XLSX file")
+            filename_with_extension = f"{FILENAME}.xlsx"
+            with open(filename_with_extension, "wb") as file:
+                export_siae_to_xlsx(file, siae_list)
+            self.stdout.write(f"Generated {filename_with_extension}")
+
+            self.stdout.write("Step 3: uploading the XLSX file to S3")
+            self.upload_file_to_s3(filename_with_extension)
+
         # Step 4: delete local file(s) & previous S3 file(s)
         files_to_remove = glob.glob(f"{FILENAME}.*")
         for file_path in files_to_remove:
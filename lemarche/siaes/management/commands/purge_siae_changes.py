@@ -0,0 +1,73 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Max, Min
+from django.utils import timezone
+
+from lemarche.siaes.models import SiaeChange, SiaeChangeCursor
+from lemarche.utils.commands import BaseCommand
+
+
+DELETE_BATCH_SIZE = 5000
+
+
+class Command(BaseCommand):
+    """
+    Retention policy of the SiaeChange log: the changes older than API_SIAE_CHANGES_RETENTION_DAYS
+    are deleted by batches (the API clients with an older cursor must reload everything)
+
+    The changes not yet read by an internal consumer (SiaeChangeCursor) are kept, whatever their age.
+
+    Note: run via a CRON every day
+    Usage:
+    poetry run python manage.py purge_siae_changes --dry-run
+    poetry run python manage.py purge_siae_changes
+    poetry run python manage.py purge_siae_changes --days 60
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--days",
+            type=int,
+            default=settings.API_SIAE_CHANGES_RETENTION_DAYS,
+            help="Supprimer les changements plus anciens que ce nombre de jours",
+        )
+        parser.add_argument("--dry-run", dest="dry_run", action="store_true", help="Dry run (no changes to the DB)")
+
+    def handle(self, *args, **options):
+        start_time = time.perf_counter()
+        created_before = timezone.now() - timedelta(days=options["days"])
+        siae_change_queryset = SiaeChange.objects.filter(created_at__lt=created_before)
+        # the changes not read by the internal consumers
+        min_cursor = SiaeChangeCursor.objects.aggregate(Min("last_change_id"))["last_change_id__min"]
+        if min_cursor is not None:
+            siae_change_queryset = siae_change_queryset.filter(id__lte=min_cursor)
+
+        self.stdout_info(f"Purging the siae changes created before {created_before:%Y-%m-%d}")
+        if options["dry_run"]:
+            self.stdout_info(f"Found {siae_change_queryset.count()} siae changes to delete (dry run)")
+            return
+
+        # the changes created during the purge are not deleted
+        max_id = siae_change_queryset.aggregate(Max("id"))["id__max"]
+        if max_id is None:
+            self.stdout_info("No siae change to delete")
+            return
+        siae_change_queryset = siae_change_queryset.filter(id__lte=max_id)
+
+        count_delete = 0
+        while True:
+            siae_change_id_list = list(siae_change_queryset.values_list("id", flat=True)[:DELETE_BATCH_SIZE])
+            if not siae_change_id_list:
+                break
+            count, _ = SiaeChange.objects.filter(id__in=siae_change_id_list).delete()
+            count_delete += count
+
+        self.stdout_messages_success(
+            [
+                "----- Siae changes purge -----",
+                f"Deleted {count_delete} siae changes (up to id {max_id})",
+                f"Duration: {time.perf_counter() - start_time:.2f}s",
+            ]
+        )
@@ -1,16 +1,17 @@
 import logging
 import os
 import re
+import time
+from collections import defaultdict
 
 from django.conf import settings
 from django.contrib.gis.geos import GEOSGeometry
 from django.core.management.base import CommandError
-from django.db.models import Q
 from django.utils import timezone
 from stdnum.fr import siret
 
 from lemarche.siaes import constants as siae_constants
-from lemarche.siaes.models import Siae
+from lemarche.siaes.models import Siae, SiaeChange
 from lemarche.utils.apis import api_emplois_inclusion, api_slack
 from lemarche.utils.commands import BaseCommand
 from lemarche.utils.constants import DEPARTMENT_TO_REGION
@@ -46,6 +47,11 @@ UPDATE_FIELDS = [
 
 UPDATE_FIELDS_IF_EMPTY = ["brand"]
 
+# c1_last_sync_date changes on every run: not part of the diff, stamped separately
+UPDATE_FIELDS_DIFF = [field for field in UPDATE_FIELDS if field != "c1_last_sync_date"]
+
+UPDATE_BATCH_SIZE = 1000
+
 C1_EXTRA_KEYS = ["convention_is_active", "convention_asp_id"]
 
 
@@ -85,17 +91,26 @@ class Command(BaseCommand):
     Steps:
     1. First we fetch all the siae from les-emplois
     2. Then we loop on each of them, to create or update it (depends if its c1_id already exists or not)
+       (bulk mode: the existing siaes are preloaded, and only the changed ones are written)
     3. Don't forget to delist the siae who were not updated or inactive
 
     Usage:
     - poetry run python manage.py sync_with_emplois_inclusion --dry-run
     - poetry run python manage.py sync_with_emplois_inclusion
+    - poetry run python manage.py sync_with_emplois_inclusion --cache-dir /tmp/emplois_inclusion (resumable)
     """
 
     def add_arguments(self, parser):
         parser.add_argument("--dry-run", dest="dry_run", action="store_true", help="Dry run, no writes")
-
-    def handle(self, dry_run=False, **options):
+        parser.add_argument(
+            "--cache-dir",
+            dest="cache_dir",
+            type=str,
+            default=None,
+            help="Dossier où garder les pages de l'API (pour reprendre une synchro interrompue)",
+        )
+
+    def handle(self, dry_run=False, cache_dir=None, **options):
         if not os.environ.get("API_EMPLOIS_INCLUSION_TOKEN"):
             raise CommandError("Missing API_EMPLOIS_INCLUSION_TOKEN in env")
 
@@ -107,7 +122,7 @@ class Command(BaseCommand):
 
         self.stdout_info("-" * 80)
         self.stdout_info("Step 1: fetching les-emplois data")
-        c1_list = self.c1_export()
+        c1_list = self.c1_export(cache_dir=cache_dir)
 
         self.stdout_info("-" * 80)
         self.stdout_info("Step 2: filter les-emplois data")
@@ -119,32 +134,39 @@ class Command(BaseCommand):
         siae_total_before = Siae.objects.all().count()
         siae_active_before = Siae.objects.filter(is_active=True).count()
 
-        self.c4_update(c1_list_filtered, dry_run)
+        start_time = time.perf_counter()
+        c4_update_stats = self.c4_update(c1_list_filtered, dry_run)
+        if not dry_run:
+            # the updates above bypass Siae.save(): maintain the search fields
+            Siae.objects.update_search_fields()
+            # the sync is done: the next run will fetch fresh pages
+            api_emplois_inclusion.clear_cache(cache_dir)
 
         # count after
         siae_total_after = Siae.objects.all().count()
         siae_active_after = Siae.objects.filter(is_active=True).count()
 
         self.stdout_info("Done ! Some stats...")
+        if dry_run:
+            self.stdout_info(f"Dry run: {c4_update_stats['created']} Siae would be created")
         created_count = siae_total_after - siae_total_before
-        updated_count = len(c1_list_filtered) - created_count
         msg_success = [
             "----- Synchronisation emplois/marché -----",
             f"Siae total: before {siae_total_before} / after {siae_total_after} / +{created_count}",
-            f"Siae updated: {updated_count}",
+            f"Siae updated: {c4_update_stats['updated']} / unchanged: {c4_update_stats['unchanged']}",
+            f"Siae skipped (brand already used): {c4_update_stats['brand_conflict']}",
             f"Siae active: before {siae_active_before} / after {siae_active_after}",
             f"Siae inactive: before {siae_total_before - siae_active_before} / after {siae_total_after - siae_active_after}",  # noqa
+            f"Duration: {time.perf_counter() - start_time:.2f}s",
         ]
         self.stdout_messages_success(msg_success)
         api_slack.send_message_to_channel("\n".join(msg_success), service_id=settings.SLACK_WEBHOOK_C4_SUPPORT_CHANNEL)
 
-    def c1_export(self):  # noqa C901
+    def c1_export(self, cache_dir=None):  # noqa C901
         try:
-            c1_list_temp = api_emplois_inclusion.get_siae_list()
-
-            # clean fields
+            # clean fields (as the pages are fetched)
             c1_list_cleaned = list()
-            for c1_siae in c1_list_temp:
+            for c1_siae in api_emplois_inclusion.get_siae_list(cache_dir=cache_dir):
                 c1_siae_cleaned = {
                     **c1_siae,
                     "siret_is_valid": siret.is_valid(c1_siae["siret"]),
@@ -217,24 +239,83 @@ class Command(BaseCommand):
 
     def c4_update(self, c1_list, dry_run):
         """
-        Loop on c1_list and figure out if each siae needs to be created OR already exists (update)
+        Figure out if each siae needs to be created OR already exists (update)
+
+        Bulk mode:
+        - the existing siaes are loaded once (by c1_id), as well as the names & brands already used
+        - only the siaes whose fields changed are written (chunked bulk_update),
+          then c1_last_sync_date is stamped with a single UPDATE
         """
-        progress = 0
-        for c1_siae in c1_list:
-            progress += 1
-            if (progress % 1000) == 0:
-                self.stdout_info(f"{progress}...")
-            # if force_siret and c1['siret'] != force_siret:
-            #     continue
-            try:
-                c4_siae = Siae.objects.get(c1_id=c1_siae["id"])
-                self.c4_update_siae(c1_siae, c4_siae, dry_run)
-            except Siae.DoesNotExist:
-                self.c4_create_siae(c1_siae, dry_run)
-
-    def c4_create_siae(self, c1_siae, dry_run):
+        stats = {"created": 0, "updated": 0, "unchanged": 0, "brand_conflict": 0}
+
+        c4_siae_by_c1_id, siae_ids_by_name_or_brand = self.c4_preload()
+        self.stdout_info(f"Found {len(c4_siae_by_c1_id)} Siae with a c1_id in le-marché")
+
+        c4_siae_to_update_list = list()
+        c4_siae_update_fields = set()
+        c4_siae_synced_id_list = list()
+        for index, c1_siae in enumerate(c1_list, start=1):
+            if (index % 1000) == 0:
+                self.stdout_info(f"{index}...")
+            c4_siae = c4_siae_by_c1_id.get(c1_siae["id"])
+            if c4_siae:
+                changed_fields = self.c4_update_siae(c1_siae, c4_siae, siae_ids_by_name_or_brand)
+                if changed_fields is None:
+                    stats["brand_conflict"] += 1
+                    continue
+                c4_siae_synced_id_list.append(c4_siae.id)
+                if changed_fields:
+                    c4_siae_to_update_list.append(c4_siae)
+                    c4_siae_update_fields.update(changed_fields)
+                    stats["updated"] += 1
+                else:
+                    stats["unchanged"] += 1
+            else:
+                if self.c4_create_siae(c1_siae, siae_ids_by_name_or_brand, dry_run):
+                    stats["created"] += 1
+                else:
+                    stats["brand_conflict"] += 1
+
+        if not dry_run:
+            self.c4_bulk_update(c4_siae_to_update_list, c4_siae_update_fields, c4_siae_synced_id_list)
+
+        return stats
+
+    def c4_preload(self):
+        """
+        - the existing siaes, by c1_id (only the fields needed for the diff)
+        - the ids of the siaes using each name or brand (for the brand uniqueness check)
+        """
+        c4_siae_by_c1_id = {
+            siae.c1_id: siae
+            for siae in Siae.objects.filter(c1_id__isnull=False)
+            .only("id", "c1_id", "name", *UPDATE_FIELDS_DIFF, *UPDATE_FIELDS_IF_EMPTY)
+            .order_by()
+        }
+        siae_ids_by_name_or_brand = defaultdict(set)
+        for siae_id, siae_name, siae_brand in Siae.objects.values_list("id", "name", "brand").order_by():
+            siae_ids_by_name_or_brand[siae_name].add(siae_id)
+            if siae_brand:
+                siae_ids_by_name_or_brand[siae_brand].add(siae_id)
+        return c4_siae_by_c1_id, siae_ids_by_name_or_brand
+
+    def c4_bulk_update(self, c4_siae_to_update_list, c4_siae_update_fields, c4_siae_synced_id_list):
+        """
+        Write the changed siaes (chunked bulk_update: avoid updated_at change), then stamp c1_last_sync_date
+        The changed siaes are logged for the API change feed (updated_at is not bumped)
+        """
+        Siae.objects.bulk_update(c4_siae_to_update_list, list(c4_siae_update_fields), batch_size=UPDATE_BATCH_SIZE)
+        SiaeChange.objects.record([siae.id for siae in c4_siae_to_update_list])
+        c1_last_sync_date = timezone.now()
+        for index in range(0, len(c4_siae_synced_id_list), UPDATE_BATCH_SIZE):
+            Siae.objects.filter(id__in=c4_siae_synced_id_list[index : index + UPDATE_BATCH_SIZE]).update(
+                c1_last_sync_date=c1_last_sync_date
+            )
+
+    def c4_create_siae(self, c1_siae, siae_ids_by_name_or_brand, dry_run) -> bool:
         """
         Here we create a new Siae with les-emplois data
+        Siae.save() is kept (few creations on each run): slug generation, history & post_save geocoding
         """
         self.stdout_info("Creating Siae...")
 
@@ -248,48 +329,50 @@ class Command(BaseCommand):
         c1_siae["contact_phone"] = c1_siae["phone"]
 
         # create object if brand is empty or not already used
-        if not dry_run:
-            if (
-                "brand" not in c1_siae
-                or c1_siae["brand"] == ""
-                or not Siae.objects.filter(Q(name=c1_siae["brand"]) | Q(brand=c1_siae["brand"])).exists()
-            ):
-                siae = Siae.objects.create(**c1_siae)
-
-                self.stdout_info(f"New Siae created / {siae.id} / {siae.name} / {siae.siret}")
-            else:
-                logger.error(
-                    f"Brand name is already used by another SIAE: '{c1_siae['brand']}' / name: '{c1_siae['name']}'"
-                )
+        if c1_siae.get("brand") and siae_ids_by_name_or_brand.get(c1_siae["brand"]):
+            logger.error(
+                f"Brand name is already used by another SIAE: '{c1_siae['brand']}' / name: '{c1_siae['name']}'"
+            )
+            return False
 
-    def c4_update_siae(self, c1_siae, c4_siae, dry_run):
+        if not dry_run:
+            siae = Siae.objects.create(**c1_siae)
+            siae_ids_by_name_or_brand[siae.name].add(siae.id)
+            if siae.brand:
+                siae_ids_by_name_or_brand[siae.brand].add(siae.id)
+            self.stdout_info(f"New Siae created / {siae.id} / {siae.name} / {siae.siret}")
+        return True
+
+    def c4_update_siae(self, c1_siae, c4_siae, siae_ids_by_name_or_brand) -> list | None:
         """
-        Here we update an existing Siae with a subset of les-emplois data
+        Here we update (in memory) an existing Siae with a subset of les-emplois data
+        Returns the list of the fields that changed (None if the brand is already used by another Siae)
         """
-        if not dry_run:
-            # keep only certain fields for update
-            c1_siae_filtered = dict()
-            for key in UPDATE_FIELDS:
-                if key in c1_siae:
-                    c1_siae_filtered[key] = c1_siae[key]
-
-            # update fields only if empty
-            for key in UPDATE_FIELDS_IF_EMPTY:
-                if key in c1_siae and not getattr(c4_siae, key, None):
-                    c1_siae_filtered[key] = c1_siae[key]
-
-            # update siae only if brand is empty or not already used
-            if (
-                "brand" not in c1_siae_filtered
-                or c1_siae_filtered["brand"] == ""
-                or not Siae.objects.exclude(c1_id=c4_siae.c1_id)
-                .filter(Q(name=c1_siae_filtered["brand"]) | Q(brand=c1_siae_filtered["brand"]))
-                .exists()
-            ):
-                Siae.objects.filter(c1_id=c4_siae.c1_id).update(**c1_siae_filtered)  # avoid updated_at change
-            else:
-                logger.error(
-                    f"Brand name is already used by another SIAE: '{c1_siae['brand']}' / name: '{c1_siae['name']}'"
-                )
-
-            # self.stdout_info(f"Siae updated / {c4_siae.id} / {c4_siae.siret}")
+        # keep only certain fields for update
+        c1_siae_filtered = dict()
+        for key in UPDATE_FIELDS_DIFF:
+            if key in c1_siae:
+                c1_siae_filtered[key] = c1_siae[key]
+
+        # update fields only if empty
+        for key in UPDATE_FIELDS_IF_EMPTY:
+            if key in c1_siae and not getattr(c4_siae, key, None):
+                c1_siae_filtered[key] = c1_siae[key]
+
+        # update siae only if brand is empty or not already used
+        if c1_siae_filtered.get("brand") and (
+            siae_ids_by_name_or_brand.get(c1_siae_filtered["brand"], set()) - {c4_siae.id}
+        ):
+            logger.error(
+                f"Brand name is already used by another SIAE: '{c1_siae['brand']}' / name: '{c1_siae['name']}'"
+            )
+            return None
+
+        changed_fields = list()
+        for key, value in c1_siae_filtered.items():
+            if getattr(c4_siae, key) != value:
+                setattr(c4_siae, key, value)
+                changed_fields.append(key)
+        if c1_siae_filtered.get("brand"):
+            siae_ids_by_name_or_brand[c1_siae_filtered["brand"]].add(c4_siae.id)
+        return changed_fields
@@ -1,14 +1,76 @@
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
+import requests
 from django.db.models import Q
 
 from lemarche.siaes.models import Siae
 from lemarche.utils.apis import api_slack
-from lemarche.utils.apis.api_entreprise import siae_update_entreprise, siae_update_etablissement, siae_update_exercice
+from lemarche.utils.apis.api_entreprise import (
+    API_ENTREPRISE_REASON,
+    entreprise_get_or_error,
+    entreprise_update_data,
+    etablissement_get_or_error,
+    etablissement_update_data,
+    exercice_get_or_error,
+    exercice_update_data,
+)
 from lemarche.utils.commands import BaseCommand
 
 
 SCOPE_ALLOWED_VALUES = ("all", "entreprise", "etablissement", "exercice")
+SCOPE_LIST = ("entreprise", "etablissement", "exercice")
+SCOPE_LAST_SYNC_DATE_FIELD = {scope: f"api_entreprise_{scope}_last_sync_date" for scope in SCOPE_LIST}
+
+BULK_UPDATE_BATCH_SIZE = 200
+
+thread_local = threading.local()
+
+
+def get_thread_client():
+    """
+    One requests.Session (connection pool) per worker thread
+    """
+    if not hasattr(thread_local, "client"):
+        thread_local.client = requests.Session()
+    return thread_local.client
+
+
+def fetch_siren(siae_list_with_scopes):
+    """
+    Runs in a worker thread: API calls only (no database access).
+    All the Siae share the same SIREN: the /entreprises response is fetched once for all of them.
+    The API quota is enforced by the shared rate limiter (see api_entreprise.rate_limiter).
+
+    siae_list_with_scopes: list of (siae_id, siret, scope_list)
+    Returns a list of (siae_id, scope, update_data, error)
+    """
+    client = get_thread_client()
+    results = list()
+    entreprise_response = None
+    for siae_id, siret, scope_list in siae_list_with_scopes:
+        for scope in scope_list:
+            try:
+                if scope == "entreprise":
+                    if entreprise_response is None:
+                        entreprise_response = entreprise_get_or_error(
+                            siret[:9], reason=API_ENTREPRISE_REASON, client=client
+                        )
+                    entreprise, error = entreprise_response
+                    update_data = entreprise_update_data(entreprise) if not error else None
+                elif scope == "etablissement":
+                    etablissement, error = etablissement_get_or_error(
+                        siret, reason=API_ENTREPRISE_REASON, client=client
+                    )
+                    update_data = etablissement_update_data(etablissement) if not error else None
+                else:
+                    exercice, error = exercice_get_or_error(siret, reason=API_ENTREPRISE_REASON, client=client)
+                    update_data = exercice_update_data(exercice) if not error else None
+            except Exception as e:
+                update_data, error = None, str(e)
+            results.append((siae_id, scope, update_data, error))
+    return results
 
 
 class Command(BaseCommand):
@@ -17,6 +79,11 @@ class Command(BaseCommand):
 
     Note: Only on Siae who have api_entreprise_*_last_sync_date as None
 
+    The Siae are grouped by SIREN, and each group is processed by a pool of workers
+    (the 3 scopes at once, the /entreprises response is shared between the sibling SIRETs).
+    The API quota is respected thanks to a shared token bucket.
+    The results are saved with bulk_update, by batches.
+
     TODO: filter only on Siae not updated since a certain date?
 
     Usage:
@@ -24,6 +91,7 @@ class Command(BaseCommand):
     - poetry run python manage.py update_api_entreprise_fields --scope etablissement
     - poetry run python manage.py update_api_entreprise_fields --siret 01234567891011
     - poetry run python manage.py update_api_entreprise_fields --limit 100
+    - poetry run python manage.py update_api_entreprise_fields --workers 8
     """
 
     def add_arguments(self, parser):
@@ -32,6 +100,7 @@ class Command(BaseCommand):
         )
         parser.add_argument("--siret", type=str, default=None, help="Lancer sur un Siret spécifique")
         parser.add_argument("--limit", type=int, default=None, help="Limiter le nombre de structures à processer")
+        parser.add_argument("--workers", type=int, default=4, help="Nombre d'appels API en parallèle")
 
     def handle(self, *args, **options):
         self.stdout_info("-" * 80)
@@ -39,6 +108,7 @@ class Command(BaseCommand):
 
         if options["scope"] not in SCOPE_ALLOWED_VALUES:
             raise Exception(f"scope not in {SCOPE_ALLOWED_VALUES}")
+        scope_list = SCOPE_LIST if options["scope"] == "all" else (options["scope"],)
 
         if options["siret"]:
             siae_queryset = Siae.objects.filter(siret=options["siret"])
@@ -49,127 +119,77 @@ class Command(BaseCommand):
                 | Q(api_entreprise_exercice_last_sync_date=None)
             ).order_by("id")
 
+        siae_queryset = siae_queryset.only("id", "siret", *Siae.FIELDS_FROM_API_ENTREPRISE)
         if options["limit"]:
             siae_queryset = siae_queryset[: options["limit"]]
 
-        # self.stdout_info(f"Found {siae_queryset.count()} Siae")
-
-        if options["scope"] in ("all", "entreprise"):
-            self.update_api_entreprise_entreprise_fields(siae_queryset)
-
-        if options["scope"] in ("all", "etablissement"):
-            self.update_api_entreprise_etablissement_fields(siae_queryset)
-
-        if options["scope"] in ("all", "exercice"):
-            self.update_api_entreprise_exercice_fields(siae_queryset)
-
-    # API Entreprise: entreprises
-    def update_api_entreprise_entreprise_fields(self, siae_queryset):
-        progress = 0
-        results = {"success": 0, "error": 0}
-        siae_queryset_entreprise = siae_queryset.filter(api_entreprise_entreprise_last_sync_date=None)
-        self.stdout_info("-" * 80)
-        self.stdout_info(f"Populating 'entreprise' for {siae_queryset_entreprise.count()} Siae...")
-
-        for siae in siae_queryset_entreprise:
-            try:
-                progress += 1
-                if (progress % 50) == 0:
-                    self.stdout_info(f"{progress}...")
-                # self.stdout_info("-" * 80)
-                # self.stdout_info(f"{siae.id} / {siae.name} / {siae.siret}")
-                response, message = siae_update_entreprise(siae)
-                if response:
-                    results["success"] += 1
-                else:
-                    self.stdout_error(str(message))
-                    results["error"] += 1
-                # small delay to avoid going above the API limitation
-                # "max. 250 requêtes/min/jeton cumulées sur tous les endpoints"
-                time.sleep(0.5)
-            except Exception as e:
-                self.stdout_error(str(e))
-                api_slack.send_message_to_channel("Erreur lors de la synchronisation API entreprises: entreprises")
-
-        msg_success = [
-            "----- Synchronisation API Entreprise (/entreprises) -----",
-            f"Done! Processed {siae_queryset_entreprise.count()} siae",
-            f"success count: {results['success']}/{siae_queryset_entreprise.count()}",
-            f"error count: {results['error']}/{siae_queryset_entreprise.count()} (voir les logs)",
-        ]
+        # Step 1: the scopes to sync for each Siae, grouped by SIREN
+        self.results = {scope: {"success": 0, "error": 0} for scope in scope_list}
+        siae_list_by_siren = self.group_by_siren(siae_queryset, scope_list)
+        self.stdout_info(f"Found {len(self.siae_by_id)} Siae ({len(siae_list_by_siren)} SIREN)")
+
+        # Step 2: call the API (workers), and save the results by batches
+        start_time = time.perf_counter()
+        self.siae_to_update_dict = dict()
+        self.siae_update_fields = set()
+        with ThreadPoolExecutor(max_workers=options["workers"]) as executor:
+            futures = [
+                executor.submit(fetch_siren, siae_list_with_scopes)
+                for siae_list_with_scopes in siae_list_by_siren.values()
+            ]
+            for index, future in enumerate(as_completed(futures), start=1):
+                self.process_results(future.result())
+                if (index % 50) == 0:
+                    self.stdout_info(f"{index} SIREN...")
+                if len(self.siae_to_update_dict) >= BULK_UPDATE_BATCH_SIZE:
+                    self.save_results()
+        self.save_results()
+        duration = time.perf_counter() - start_time
+
+        # Step 3: report
+        msg_success = ["----- Synchronisation API Entreprise -----", f"Done! Processed {len(self.siae_by_id)} siae"]
+        for scope, scope_results in self.results.items():
+            msg_success.append(
+                f"/{scope}s: success count: {scope_results['success']} / error count: {scope_results['error']} (voir les logs)"  # noqa
+            )
+        msg_success.append(f"Duration: {duration:.2f}s")
         self.stdout_messages_success(msg_success)
         api_slack.send_message_to_channel("\n".join(msg_success))
 
-    # API Entreprise: etablissements
-    def update_api_entreprise_etablissement_fields(self, siae_queryset):
-        progress = 0
-        results = {"success": 0, "error": 0}
-        siae_queryset_etablissement = siae_queryset.filter(api_entreprise_etablissement_last_sync_date=None)
-        self.stdout_info("-" * 80)
-        self.stdout_info(f"Populating 'etablissement' for {siae_queryset_etablissement.count()} Siae...")
-
-        for siae in siae_queryset_etablissement:
-            try:
-                progress += 1
-                if (progress % 50) == 0:
-                    self.stdout_info(f"{progress}...")
-                # self.stdout_info("-" * 80)
-                # self.stdout_info(f"{siae.id} / {siae.name} / {siae.siret}")
-                response, message = siae_update_etablissement(siae)
-                if response:
-                    results["success"] += 1
-                else:
-                    self.stdout_error(str(message))
-                    results["error"] += 1
-                # small delay to avoid going above the API limitation
-                # "max. 250 requêtes/min/jeton cumulées sur tous les endpoints"
-                time.sleep(0.5)
-            except Exception as e:
-                self.stdout_error(str(e))
-                api_slack.send_message_to_channel("Erreur lors de la synchronisation API entreprises: etablissements")
-
-        msg_success = [
-            "----- Synchronisation API Entreprise (/etablissements) -----",
-            f"Done! Processed {siae_queryset_etablissement.count()} siae",
-            f"success count: {results['success']}/{siae_queryset_etablissement.count()}",
-            f"error count: {results['error']}/{siae_queryset_etablissement.count()} (voir les logs)",
-        ]
-        self.stdout_messages_success(msg_success)
-        api_slack.send_message_to_channel("\n".join(msg_success))
-
-    # API Entreprise: exercices
-    def update_api_entreprise_exercice_fields(self, siae_queryset):
-        progress = 0
-        results = {"success": 0, "error": 0}
-        siae_queryset_exercice = siae_queryset.filter(api_entreprise_exercice_last_sync_date=None)
-        self.stdout_info("-" * 80)
-        self.stdout_info(f"Populating 'exercice' for {siae_queryset_exercice.count()} Siae...")
-
-        for siae in siae_queryset_exercice:
-            try:
-                progress += 1
-                if (progress % 50) == 0:
-                    self.stdout_info(f"{progress}...")
-                # self.stdout_info("-" * 80)
-                # self.stdout_info(f"{siae.id} / {siae.name} / {siae.siret}")
-                response, message = siae_update_exercice(siae)
-                if response:
-                    results["success"] += 1
-                else:
-                    self.stdout_error(str(message))
-                    results["error"] += 1
-                # small delay to avoid going above the API limitation
-                # "max. 250 requêtes/min/jeton cumulées sur tous les endpoints"
-                time.sleep(0.5)
-            except Exception as e:
-                self.stdout_error(str(e))
-                api_slack.send_message_to_channel("Erreur lors de la synchronisation API entreprises: exercices")
-
-        msg_success = [
-            "----- Synchronisation API Entreprise (/exercices) -----",
-            f"Done! Processed {siae_queryset_exercice.count()} siae",
-            f"success count: {results['success']}/{siae_queryset_exercice.count()}",
-            f"error count: {results['error']}/{siae_queryset_exercice.count()} (voir les logs)",
-        ]
-        self.stdout_messages_success(msg_success)
-        api_slack.send_message_to_channel("\n".join(msg_success))
+    def group_by_siren(self, siae_queryset, scope_list) -> dict:
+        """
+        Returns {siren: [(siae_id, siret, scopes to sync), ...]}
+        """
+        self.siae_by_id = dict()
+        siae_list_by_siren = dict()
+        for siae in siae_queryset:
+            siae_scope_list = [scope for scope in scope_list if not getattr(siae, SCOPE_LAST_SYNC_DATE_FIELD[scope])]
+            if not siae_scope_list:
+                continue
+            if not siae.siret:
+                self.stdout_error(f"SIAE {siae.id} without SIRET")
+                for scope in siae_scope_list:
+                    self.results[scope]["error"] += 1
+                continue
+            self.siae_by_id[siae.id] = siae
+            siae_list_by_siren.setdefault(siae.siret[:9], []).append((siae.id, siae.siret, siae_scope_list))
+        return siae_list_by_siren
+
+    def process_results(self, results):
+        for siae_id, scope, update_data, error in results:
+            if error:
+                self.stdout_error(str(error))
+                self.results[scope]["error"] += 1
+                continue
+            siae = self.siae_by_id[siae_id]
+            for field, value in update_data.items():
+                setattr(siae, field, value)
+            self.siae_to_update_dict[siae_id] = siae
+            self.siae_update_fields.update(update_data.keys())
+            self.results[scope]["success"] += 1
+
+    def save_results(self):
+        if self.siae_to_update_dict:
+            Siae.objects.bulk_update(self.siae_to_update_dict.values(), list(self.siae_update_fields))
+        self.siae_to_update_dict = dict()
+        self.siae_update_fields = set()
@@ -1,6 +1,7 @@
 from django.db.models import Q
 from django.utils import timezone
 
+from lemarche.perimeters.models import Qpv
 from lemarche.siaes.management.base_update_api import UpdateAPICommand
 from lemarche.utils.apis.api_qpv import IS_QPV_KEY, QPV_CODE_KEY, QPV_NAME_KEY, get_default_client, is_in_qpv
 
@@ -10,16 +11,20 @@ class Command(UpdateAPICommand):
     Populates API QPV
 
     Note: Only on Siae who have coords, filter only on Siae not updated by the API since a two months
+    Note: uses the local QPV layer if it was imported (see import_qpv_zrr), one API call per Siae otherwise
 
     Usage: poetry run python manage.py update_api_qpv_fields
     Usage: poetry run python manage.py update_api_qpv_fields --limit 10
     Usage: poetry run python manage.py update_api_qpv_fields --force
     Usage: poetry run python manage.py update_api_qpv_fields --limit 100 --no-force
+    Usage: poetry run python manage.py update_api_qpv_fields --api
     """
 
     API_NAME = "QPV"
     FIELDS_TO_BULK_UPDATE = ["is_qpv", "api_qpv_last_sync_date", "qpv_code", "qpv_name"]
     CLIENT = get_default_client()
+    LOCAL_MODEL = Qpv
+    TARGET_FIELD = "is_qpv"
 
     @staticmethod
     def get_filter_query(date_limit) -> Q:
@@ -29,6 +34,10 @@ class Command(UpdateAPICommand):
     def is_in_target(latitude, longitude, client):
         return is_in_qpv(latitude, longitude, client=client)
 
+    @staticmethod
+    def update_from_local_layer(siae_queryset) -> int:
+        return siae_queryset.update_qpv_fields()
+
     def update_siae(self, siae):
         # call api is in qpv
         result_is_in_qpv = self.is_in_target(siae.latitude, siae.longitude, client=self.CLIENT)
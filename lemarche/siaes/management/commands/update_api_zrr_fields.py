@@ -1,6 +1,7 @@
 from django.db.models import Q
 from django.utils import timezone
 
+from lemarche.perimeters.models import Zrr
 from lemarche.siaes.management.base_update_api import UpdateAPICommand
 from lemarche.utils.apis.api_zrr import IS_ZRR_KEY, ZRR_CODE_KEY, ZRR_NAME_KEY, get_default_client, is_in_zrr
 
@@ -10,16 +11,20 @@ class Command(UpdateAPICommand):
     Populates API ZRR
 
     Note: Only on Siae who have coords, filter only on Siae not updated by the API since a two months
+    Note: uses the local ZRR layer if it was imported (see import_qpv_zrr), one API call per Siae otherwise
 
     Usage: poetry run python manage.py update_api_zrr_fields
     Usage: poetry run python manage.py update_api_zrr_fields --limit 10
     Usage: poetry run python manage.py update_api_zrr_fields --force
     Usage: poetry run python manage.py update_api_zrr_fields --limit 100 --no-force
+    Usage: poetry run python manage.py update_api_zrr_fields --api
     """
 
     API_NAME = "ZRR"
     FIELDS_TO_BULK_UPDATE = ["is_zrr", "api_zrr_last_sync_date", "zrr_code", "zrr_name"]
     CLIENT = get_default_client()
+    LOCAL_MODEL = Zrr
+    TARGET_FIELD = "is_zrr"
 
     @staticmethod
     def get_filter_query(date_limit) -> Q:
@@ -29,6 +34,10 @@ class Command(UpdateAPICommand):
     def is_in_target(latitude, longitude, client):
         return is_in_zrr(latitude, longitude, client=client)
 
+    @staticmethod
+    def update_from_local_layer(siae_queryset) -> int:
+        return siae_queryset.update_zrr_fields()
+
     def update_siae(self, siae):
         # call api is in zrr
         result_is_in_zrr = self.is_in_target(siae.latitude, siae.longitude, client=self.CLIENT)
@@ -0,0 +1,42 @@
+from lemarche.siaes.models import SiaeActivity, SiaeActivityMatchIndex
+from lemarche.utils.commands import BaseCommand
+
+
+class Command(BaseCommand):
+    """
+    Goal: rebuild the SiaeActivityMatchIndex (used by the Tender-Siae matching)
+
+    Note: the index is kept up to date by the SiaeActivity signals. This command is a safety net.
+
+    Usage:
+    python manage.py update_siae_activity_match_index
+    python manage.py update_siae_activity_match_index --siae-id 1
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument("--siae-id", type=int, default=None, help="Indiquer l'ID d'une structure")
+
+    def handle(self, *args, **options):
+        self.stdout_messages_info("Updating SiaeActivity match index...")
+
+        # Step 1: build the queryset
+        siae_activity_queryset = SiaeActivity.objects.prefetch_related("sectors", "locations").all()
+        if options["siae_id"]:
+            siae_activity_queryset = siae_activity_queryset.filter(siae_id=options["siae_id"])
+        self.stdout_messages_info(f"Found {siae_activity_queryset.count()} siae activities")
+
+        # Step 2: loop on each SiaeActivity
+        progress = 0
+        for siae_activity in siae_activity_queryset:
+            SiaeActivityMatchIndex.refresh_for_activity(siae_activity)
+
+            progress += 1
+            if (progress % 500) == 0:
+                self.stdout_info(f"{progress}...")
+
+        msg_success = [
+            "----- SiaeActivity match index -----",
+            f"Done! Processed {progress} siae activities",
+            f"Index size: {SiaeActivityMatchIndex.objects.count()} rows",
+        ]
+        self.stdout_messages_success(msg_success)
@@ -0,0 +1,80 @@
+import time
+
+from lemarche.siaes.models import Siae, SiaeChange
+from lemarche.siaes.tasks import get_siae_coords_update_fields
+from lemarche.utils.apis import api_slack
+from lemarche.utils.apis.geocoding import API_CSV_BATCH_SIZE, get_geocoding_data_bulk
+from lemarche.utils.commands import BaseCommand
+
+
+class Command(BaseCommand):
+    """
+    Backfill the missing Siae coords in one pass:
+    the addresses are geocoded by batches (BAN CSV endpoint, with the geocoding cache),
+    then the Siae are updated with bulk_update (no post_save signal, same rules as the set_siae_coords task)
+
+    Usage:
+    python manage.py update_siae_coords
+    python manage.py update_siae_coords --limit 100 --dry-run
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument("--limit", type=int, default=None, help="Limiter le nombre de structures à processer")
+        parser.add_argument(
+            "--batch-size", type=int, default=API_CSV_BATCH_SIZE, help="Nombre d'adresses par appel à l'API"
+        )
+        parser.add_argument("--dry-run", dest="dry_run", action="store_true", help="Dry run, no writes")
+
+    def handle(self, *args, **options):
+        self.stdout_messages_info("Updating Siae coords...")
+
+        siae_queryset = (
+            Siae.objects.filter(coords__isnull=True)
+            .exclude(address="", city="")
+            .only("id", "name", "address", "city", "post_code")
+            .order_by("id")
+        )
+        if options["limit"]:
+            siae_queryset = siae_queryset[: options["limit"]]
+        siae_list = list(siae_queryset)
+        self.stdout_info(f"Found {len(siae_list)} Siae without coords")
+
+        start_time = time.perf_counter()
+        geocoding_data_list = get_geocoding_data_bulk(
+            [(f"{siae.address} {siae.city}", siae.post_code) for siae in siae_list], batch_size=options["batch_size"]
+        )
+
+        siae_to_update_list = list()
+        siae_post_code_changed_id_list = list()
+        update_fields = {"coords"}
+        for siae, geocoding_data in zip(siae_list, geocoding_data_list):
+            if not geocoding_data:
+                continue
+            siae_update_fields = get_siae_coords_update_fields(siae, geocoding_data)
+            if siae_update_fields:
+                for field, value in siae_update_fields.items():
+                    setattr(siae, field, value)
+                update_fields.update(siae_update_fields.keys())
+                siae_to_update_list.append(siae)
+                if "post_code" in siae_update_fields:
+                    siae_post_code_changed_id_list.append(siae.id)
+
+        if not options["dry_run"]:
+            Siae.objects.bulk_update(siae_to_update_list, list(update_fields), batch_size=1000)
+            # post_code is part of the API payload (see the API change feed)
+            SiaeChange.objects.record(siae_post_code_changed_id_list)
+            # QPV & ZRR flags from the local layers (if imported)
+            siae_updated_queryset = Siae.objects.filter(id__in=[siae.id for siae in siae_to_update_list])
+            siae_updated_queryset.update_qpv_fields()
+            siae_updated_queryset.update_zrr_fields()
+
+        msg_success = [
+            "----- Siae coords -----",
+            f"Done! Processed {len(siae_list)} siaes",
+            f"Geocoded: {len(siae_to_update_list)}" + (" (dry run)" if options["dry_run"] else ""),
+            f"Not found: {len(siae_list) - len(siae_to_update_list)}",
+            f"Duration: {time.perf_counter() - start_time:.2f}s",
+        ]
+        self.stdout_messages_success(msg_success)
+        if not options["dry_run"]:
+            api_slack.send_message_to_channel("\n".join(msg_success))
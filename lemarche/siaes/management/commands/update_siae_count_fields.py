@@ -1,13 +1,45 @@
-from lemarche.siaes import utils as siae_utils
-from lemarche.siaes.models import Siae
+import time
+
+from django.db.models import Count
+from django.db.models.functions import Coalesce, Left
+
+from lemarche.siaes import constants as siae_constants
+from lemarche.siaes.models import Siae, count_field
 from lemarche.utils.apis import api_slack
 from lemarche.utils.commands import BaseCommand
 
 
+BULK_UPDATE_BATCH_SIZE = 1000
+
+# each count field is computed with a single grouped aggregate (one relation per query: no join explosion)
+SIAE_COUNT_FIELD_EXPRESSIONS = {
+    # M2M
+    "user_count": Count("users", distinct=True),
+    "sector_count": Count("activities__sector_group", distinct=True),
+    "network_count": Count("networks", distinct=True),
+    "group_count": Count("groups", distinct=True),
+    # FK
+    "offer_count": Count("offers", distinct=True),
+    "client_reference_count": Count("client_references", distinct=True),
+    "label_count": Count("labels_old", distinct=True),
+    "image_count": Count("images", distinct=True),
+    # tenders
+    "tender_count": Count("tenders", distinct=True),
+    "tender_email_send_count": Coalesce(count_field("email_send_date", None), 0),
+    "tender_email_link_click_count": Coalesce(count_field("email_link_click_date", None), 0),
+    "tender_detail_display_count": Coalesce(count_field("detail_display_date", None), 0),
+    "tender_detail_contact_click_count": Coalesce(count_field("detail_contact_click_date", None), 0),
+}
+
+
 class Command(BaseCommand):
     """
     Goal: update the '_count' fields of each Siae
 
+    Set-based: each field is computed for all the Siae with a single grouped query,
+    and only the Siae whose value changed are written back (chunked bulk_update).
+    completion_rate is computed last, as it depends on the other count fields.
+
     Note: some of these fields are updated on each Siae save()
 
     Usage:
@@ -27,57 +59,92 @@ class Command(BaseCommand):
         self.stdout_messages_info("Updating Siae count fields...")
 
         # Step 1a: build the queryset
-        siae_queryset = (
-            Siae.objects.prefetch_many_to_many()
-            .prefetch_many_to_one()
-            .prefetch_related("users", "groups", "labels")
-            .with_tender_stats()
-            .all()
-        )
+        siae_queryset = Siae.objects.all()
         if options["id"]:
             siae_queryset = siae_queryset.filter(id=options["id"])
-        self.stdout_messages_info(f"Found {siae_queryset.count()} siaes")
+        siae_count = siae_queryset.count()
+        self.stdout_messages_info(f"Found {siae_count} siaes")
 
-        # Step 1b: init fields to update
+        # Step 1b: init fields to update (completion_rate last)
         update_fields = options["fields"] if options["fields"] else Siae.FIELDS_STATS_COUNT
+        update_fields = sorted(update_fields, key=lambda field: field == "completion_rate")
         self.stdout_messages_info(f"Fields to update: {update_fields}")
 
-        # Step 2: loop on each Siae
-        progress = 0
-        for index, siae in enumerate(siae_queryset):
-            # M2M
-            siae.user_count = siae.users.count()
-            siae.sector_count = siae.activities.values_list("sector_group").distinct().count()
-            siae.network_count = siae.networks.count()
-            siae.group_count = siae.groups.count()
-            # FK
-            siae.offer_count = siae.offers.count()
-            siae.client_reference_count = siae.client_references.count()
-            siae.label_count = siae.labels_old.count()
-            siae.image_count = siae.images.count()
-            # etablissement_count
-            if siae.is_active and siae.siren:
-                siae.etablissement_count = siae_utils.calculate_etablissement_count(siae)
-            # completion_rate
-            siae.completion_rate = siae.completion_rate_calculated
-            # tenders
-            siae.tender_count = siae.tender_count_annotated
-            siae.tender_email_send_count = siae.tender_email_send_count_annotated
-            siae.tender_email_link_click_count = siae.tender_email_link_click_count_annotated
-            siae.tender_detail_display_count = siae.tender_detail_display_count_annotated
-            siae.tender_detail_contact_click_count = siae.tender_detail_contact_click_count_annotated
-
-            # Step 3: update count fields
-            siae.save(update_fields=update_fields)
-
-            progress += 1
-            if (progress % 500) == 0:
-                self.stdout_info(f"{progress}...")
+        # Step 2: loop on each field
+        msg_field_list = list()
+        for field in update_fields:
+            start_time = time.perf_counter()
+            if field in SIAE_COUNT_FIELD_EXPRESSIONS:
+                updated_count = self.update_count_field(siae_queryset, field)
+            elif field == "etablissement_count":
+                updated_count = self.update_etablissement_count(siae_queryset)
+            elif field == "completion_rate":
+                updated_count = self.update_completion_rate(siae_queryset)
+            else:
+                self.stdout_warning(f"Unknown field: {field}")
+                continue
+            msg_field = f"{field}: {updated_count} siaes updated in {time.perf_counter() - start_time:.2f}s"
+            msg_field_list.append(msg_field)
+            self.stdout_info(msg_field)
 
         msg_success = [
             "----- Siae count fields -----",
-            f"Done! Processed {siae_queryset.count()} siaes",
+            f"Done! Processed {siae_count} siaes",
             f"Fields updated: {update_fields}",
+            *msg_field_list,
         ]
         self.stdout_messages_success(msg_success)
         api_slack.send_message_to_channel("\n".join(msg_success))
+
+    def bulk_update_changed(self, field, current_and_new_values) -> int:
+        """
+        current_and_new_values: iterable of (id, current_value, new_value)
+        Only the rows whose value changed are written.
+        """
+        siae_to_update_list = [
+            Siae(id=siae_id, **{field: new_value})
+            for (siae_id, current_value, new_value) in current_and_new_values
+            if current_value != new_value
+        ]
+        Siae.objects.bulk_update(siae_to_update_list, [field], batch_size=BULK_UPDATE_BATCH_SIZE)
+        return len(siae_to_update_list)
+
+    def update_count_field(self, siae_queryset, field) -> int:
+        values = (
+            siae_queryset.annotate(new_value=SIAE_COUNT_FIELD_EXPRESSIONS[field])
+            .values_list("id", field, "new_value")
+            .order_by()
+        )
+        return self.bulk_update_changed(field, values)
+
+    def update_etablissement_count(self, siae_queryset) -> int:
+        """
+        Number of active Siae sharing the same siren (only for active Siae with a siren)
+        """
+        etablissement_count_by_siren = dict(
+            Siae.objects.filter(is_active=True)
+            .annotate(siret_siren=Left("siret", 9))
+            .values("siret_siren")
+            .annotate(count=Count("id"))
+            .values_list("siret_siren", "count")
+            .order_by()
+        )
+        values = (
+            (siae_id, current_value, etablissement_count_by_siren.get(siret[:9], 0))
+            for (siae_id, siret, current_value) in siae_queryset.filter(is_active=True)
+            .exclude(siret="")
+            .values_list("id", "siret", "etablissement_count")
+            .iterator(chunk_size=BULK_UPDATE_BATCH_SIZE)
+        )
+        return self.bulk_update_changed("etablissement_count", values)
+
+    def update_completion_rate(self, siae_queryset) -> int:
+        """
+        Computed in Python (see Siae.completion_rate_calculated), from the (already updated) fields
+        """
+        completion_fields = list(siae_constants.SIAE_COMPLETION_SCORE_GRID.keys())
+        siae_iterator = siae_queryset.only("id", "completion_rate", *completion_fields).iterator(
+            chunk_size=BULK_UPDATE_BATCH_SIZE
+        )
+        values = ((siae.id, siae.completion_rate, siae.completion_rate_calculated) for siae in siae_iterator)
+        return self.bulk_update_changed("completion_rate", values)
@@ -13,7 +13,8 @@ class Command(BaseCommand):
     """
     Goal: update the 'super_badge' field of each Siae
 
-    Note: some of these fields are updated on each Siae save()
+    Set-based: the rule (see Siae.super_badge_calculated) is computed in SQL,
+    and only the Siae whose badge changes are updated (super_badge_last_updated is stamped)
 
     Usage:
     python manage.py update_siae_super_badge_field
@@ -61,21 +62,15 @@ class Command(BaseCommand):
             siae_queryset = siae_queryset.filter(id=options["id"])
         self.stdout_messages_info(f"Found {siae_queryset.count()} siaes")
 
-        # Step 2: loop on each Siae
-        progress = 0
-        for index, siae in enumerate(siae_queryset):
-            # Step 3: update super_badge field
-            siae.set_super_badge()
-
-            progress += 1
-            if (progress % 500) == 0:
-                self.stdout_info(f"{progress}...")
+        # Step 2: update the super_badge field (2 UPDATEs: badge gained / badge lost)
+        siae_gained_count, siae_lost_count = siae_queryset.update_super_badge()
 
         siae_with_super_badge_count_after = Siae.objects.filter(super_badge=True).count()
         msg_success = [
             "----- Siae super_badge field -----",
             f"Done! Processed {siae_queryset.count()} siaes",
             f"Siaes with badge: before {siae_with_super_badge_count_before} / after {siae_with_super_badge_count_after}",  # noqa
+            f"Siaes that gained the badge: {siae_gained_count} / lost the badge: {siae_lost_count}",
         ]
         self.stdout_messages_success(msg_success)
         api_slack.send_message_to_channel("\n".join(msg_success), service_id=settings.SLACK_WEBHOOK_C4_SUPPORT_CHANNEL)
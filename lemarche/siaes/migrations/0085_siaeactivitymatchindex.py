@@ -0,0 +1,89 @@
+# Generated by Django 5.1.6 on 2026-10-18 12:53
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def populate_siae_activity_match_index(apps, schema_editor):
+    SiaeActivity = apps.get_model("siaes", "SiaeActivity")
+    SiaeActivityMatchIndex = apps.get_model("siaes", "SiaeActivityMatchIndex")
+
+    index_list = []
+    for siae_activity in SiaeActivity.objects.prefetch_related("sectors", "locations").iterator(chunk_size=2000):
+        values_by_kind = {
+            "GEO_RANGE": [siae_activity.geo_range],
+            "PRESTA_TYPE": siae_activity.presta_type or [],
+            "SECTOR": [str(sector.id) for sector in siae_activity.sectors.all()],
+            "LOCATION": (
+                [location.insee_code for location in siae_activity.locations.all()]
+                if siae_activity.geo_range == "ZONES"
+                else []
+            ),
+        }
+        for kind, values in values_by_kind.items():
+            for value in values:
+                index_list.append(
+                    SiaeActivityMatchIndex(
+                        siae_activity_id=siae_activity.id, siae_id=siae_activity.siae_id, kind=kind, value=value
+                    )
+                )
+    SiaeActivityMatchIndex.objects.bulk_create(index_list, batch_size=5000)
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("siaes", "0084_remove_historicalsiae_presta_type_and_more"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="SiaeActivityMatchIndex",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                (
+                    "kind",
+                    models.CharField(
+                        choices=[
+                            ("SECTOR", "Activité"),
+                            ("PRESTA_TYPE", "Type de prestation"),
+                            ("LOCATION", "Localisation (code INSEE)"),
+                            ("GEO_RANGE", "Périmètre d'intervention"),
+                        ],
+                        max_length=20,
+                        verbose_name="Type de critère",
+                    ),
+                ),
+                ("value", models.CharField(blank=True, max_length=20, verbose_name="Valeur")),
+                (
+                    "siae",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="activity_match_index",
+                        to="siaes.siae",
+                        verbose_name="Structure",
+                    ),
+                ),
+                (
+                    "siae_activity",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="match_index",
+                        to="siaes.siaeactivity",
+                        verbose_name="Activité",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Index de recherche des activités",
+                "verbose_name_plural": "Index de recherche des activités",
+                "indexes": [
+                    models.Index(
+                        fields=["kind", "value"],
+                        include=("siae_activity", "siae"),
+                        name="siae_activity_match_kind_idx",
+                    )
+                ],
+            },
+        ),
+        migrations.RunPython(populate_siae_activity_match_index, reverse_code=migrations.RunPython.noop),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 5.1.6 on 2026-10-18 13:04
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.contrib.postgres.lookups import Unaccent
+from django.contrib.postgres.operations import UnaccentExtension
+from django.contrib.postgres.search import SearchVector
+from django.db import migrations, models
+from django.db.models import Value
+from django.db.models.functions import Concat, Lower
+
+
+def populate_siae_search_fields(apps, schema_editor):
+    Siae = apps.get_model("siaes", "Siae")
+    Siae.objects.update(
+        search_text=Lower(Unaccent(Concat("name", Value(" "), "brand", Value(" "), "siret"))),
+        search_vector=(
+            SearchVector(Lower(Unaccent("name")), weight="A", config="simple")
+            + SearchVector(Lower(Unaccent("brand")), weight="B", config="simple")
+            + SearchVector("siret", weight="C", config="simple")
+        ),
+    )
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("siaes", "0085_siaeactivitymatchindex"),
+    ]
+
+    operations = [
+        UnaccentExtension(),
+        migrations.AddField(
+            model_name="siae",
+            name="search_text",
+            field=models.TextField(blank=True, editable=False, verbose_name="Texte de recherche"),
+        ),
+        migrations.AddField(
+            model_name="siae",
+            name="search_vector",
+            field=django.contrib.postgres.search.SearchVectorField(
+                editable=False, null=True, verbose_name="Vecteur de recherche"
+            ),
+        ),
+        migrations.RunPython(populate_siae_search_fields, reverse_code=migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name="siae",
+            index=django.contrib.postgres.indexes.GinIndex(fields=["search_vector"], name="siae_search_vector_gin"),
+        ),
+        migrations.AddIndex(
+            model_name="siae",
+            index=django.contrib.postgres.indexes.GinIndex(
+                fields=["search_text"], name="siae_search_text_gin_trgm", opclasses=["gin_trgm_ops"]
+            ),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.1.6 on 2026-10-18 13:41
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("siaes", "0086_siae_search_fields"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="SiaeChange",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("siae_id", models.IntegerField(verbose_name="ID de la structure")),
+                (
+                    "kind",
+                    models.CharField(
+                        choices=[("UPDATE", "Création ou modification"), ("DELETE", "Suppression")],
+                        max_length=20,
+                        verbose_name="Type de changement",
+                    ),
+                ),
+                (
+                    "created_at",
+                    models.DateTimeField(default=django.utils.timezone.now, verbose_name="Date de création"),
+                ),
+            ],
+            options={
+                "verbose_name": "Changement de structure",
+                "verbose_name_plural": "Changements de structures",
+                "ordering": ["id"],
+            },
+        ),
+    ]
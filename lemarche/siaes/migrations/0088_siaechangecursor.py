@@ -0,0 +1,25 @@
+# Generated by Django 5.1.6 on 2026-10-18 14:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("siaes", "0087_siaechange"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="SiaeChangeCursor",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("name", models.CharField(max_length=255, unique=True, verbose_name="Nom")),
+                ("last_change_id", models.BigIntegerField(default=0, verbose_name="ID du dernier changement traité")),
+                ("updated_at", models.DateTimeField(auto_now=True, verbose_name="Date de modification")),
+            ],
+            options={
+                "verbose_name": "Curseur des changements de structures",
+                "verbose_name_plural": "Curseurs des changements de structures",
+            },
+        ),
+    ]
@@ -0,0 +1,16 @@
+# Generated by Django 5.1.6 on 2026-10-18 14:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("siaes", "0088_siaechangecursor"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="siaechange",
+            index=models.Index(fields=["siae_id", "id"], name="siae_change_siae_id_idx"),
+        ),
+    ]
@@ -6,7 +6,15 @@ from django.contrib.contenttypes.fields import GenericRelation
 from django.contrib.gis.db import models as gis_models
 from django.contrib.gis.db.models.functions import Distance
 from django.contrib.gis.measure import D
-from django.contrib.postgres.search import TrigramSimilarity  # SearchVector
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.lookups import Unaccent
+from django.contrib.postgres.search import (
+    SearchQuery,
+    SearchRank,
+    SearchVector,
+    SearchVectorField,
+    TrigramWordSimilarity,
+)
 from django.core.exceptions import ValidationError
 from django.db import IntegrityError, models, transaction
 from django.db.models import (
@@ -14,6 +22,7 @@ from django.db.models import (
     Case,
     CharField,
     Count,
+    Exists,
     F,
     IntegerField,
     OuterRef,
@@ -21,9 +30,11 @@ from django.db.models import (
     Q,
     Subquery,
     Sum,
+    Value,
     When,
 )
-from django.db.models.functions import Greatest, Round
+from django.db.models.functions import Coalesce, Concat, Greatest, Lower, Round
+from django.db.models.lookups import GreaterThanOrEqual
 from django.db.models.signals import m2m_changed, post_delete, post_save
 from django.dispatch import receiver
 from django.urls import reverse
@@ -33,12 +44,14 @@ from django.utils.text import slugify
 from phonenumber_field.modelfields import PhoneNumberField
 from simple_history.models import HistoricalRecords
 
-from lemarche.perimeters.models import Perimeter
+from lemarche.perimeters.models import Perimeter, PerimeterAncestry, Qpv, Zrr
 from lemarche.sectors.models import Sector
 from lemarche.siaes import constants as siae_constants
 from lemarche.siaes.tasks import set_siae_coords
-from lemarche.stats.models import Tracker
+from lemarche.stats.models import SiaeViewDailyStat
+from lemarche.users import constants as user_constants
 from lemarche.users.models import User
+from lemarche.utils.apis.api_zrr import DISTANCE_TO_VALIDATE_ZRR
 from lemarche.utils.constants import DEPARTMENTS_PRETTY, RECALCULATED_FIELD_HELP_TEXT, REGIONS_PRETTY
 from lemarche.utils.data import choice_array_to_values, phone_number_display, round_by_base
 from lemarche.utils.fields import ChoiceArrayField
@@ -193,6 +206,15 @@ class SiaeGroup(models.Model):
         return phone_number_display(self.contact_phone)
 
 
+# search fields (see SiaeQuerySet.update_search_fields)
+SIAE_SEARCH_TEXT_EXPRESSION = Lower(Unaccent(Concat("name", Value(" "), "brand", Value(" "), "siret")))
+SIAE_SEARCH_VECTOR_EXPRESSION = (
+    SearchVector(Lower(Unaccent("name")), weight="A", config="simple")
+    + SearchVector(Lower(Unaccent("brand")), weight="B", config="simple")
+    + SearchVector("siret", weight="C", config="simple")
+)
+
+
 class SiaeQuerySet(models.QuerySet):
     def is_live(self):
         return self.filter(is_active=True).filter(is_delisted=False)
@@ -219,16 +241,121 @@ class SiaeQuerySet(models.QuerySet):
         return self.filter(siret__startswith=siret)
 
     def filter_full_text(self, full_text_string):
-        # Simple method 1: SearchVectors
-        #     return self.annotate(
-        #         search=SearchVector("name", config="french") + SearchVector("brand", config="french")
-        #     ).filter(Q(search=full_text_string) | Q(siret__startswith=full_text_string))
-        # Simple method 2: TrigramSimilarity
+        """
+        Search on the maintained search fields (see update_search_fields), both backed by a GIN index:
+        - search_vector: exact words (name > brand > siret)
+        - search_text: trigram word similarity (partial words, typos). Threshold: pg_trgm.word_similarity_threshold
+        The "similarity" annotation is used to order the results.
+        """
+        search_string = Lower(Unaccent(Value(full_text_string)))
+        search_query = SearchQuery(search_string, config="simple")
+        return self.annotate(
+            similarity=TrigramWordSimilarity(search_string, "search_text")
+            + SearchRank(F("search_vector"), search_query)
+        ).filter(
+            Q(search_vector=search_query)
+            | Q(search_text__trigram_word_similar=search_string)
+            | Q(siret__startswith=full_text_string)
+        )
+
+    def update_search_fields(self):
+        """
+        Maintain the search fields (search_text & search_vector) from the name, brand & siret.
+        Set-based: a single UPDATE, and only on the rows whose search_text is out of date.
+        """
+        return (
+            self.alias(search_text_new=SIAE_SEARCH_TEXT_EXPRESSION)
+            .exclude(search_text=F("search_text_new"))
+            .update(search_text=SIAE_SEARCH_TEXT_EXPRESSION, search_vector=SIAE_SEARCH_VECTOR_EXPRESSION)
+        )
+
+    def update_qpv_fields(self):
+        """
+        QPV fields computed with the local reference layer (see the import_qpv_zrr command):
+        a single UPDATE, with a spatial join on the QPV polygons (GiST index)
+        Does nothing if the layer is not imported
+        """
+        if not Qpv.objects.exists():
+            return 0
+        qpv_queryset = Qpv.objects.filter(geometry__covers=OuterRef("coords"))
+        # is_qpv is part of the API payload: log the Siae whose flag changes
+        changed_siae_id_list = list(
+            self.filter(coords__isnull=False)
+            .annotate(new_is_qpv=Exists(qpv_queryset))
+            .exclude(is_qpv=F("new_is_qpv"))
+            .values_list("id", flat=True)
+        )
+        count = self.filter(coords__isnull=False).update(
+            is_qpv=Exists(qpv_queryset),
+            qpv_code=Coalesce(Subquery(qpv_queryset.values("code")[:1]), Value("")),
+            qpv_name=Coalesce(Subquery(qpv_queryset.values("name")[:1]), Value("")),
+            api_qpv_last_sync_date=timezone.now(),
+        )
+        SiaeChange.objects.record(changed_siae_id_list)
+        return count
+
+    def update_zrr_fields(self):
+        """
+        Same as update_qpv_fields(), with the ZRR communes (within 1km, like the ZRR API)
+        """
+        if not Zrr.objects.exists():
+            return 0
+        zrr_queryset = Zrr.objects.filter(geometry__dwithin=(OuterRef("coords"), D(m=DISTANCE_TO_VALIDATE_ZRR)))
+        return self.filter(coords__isnull=False).update(
+            is_zrr=Exists(zrr_queryset),
+            zrr_code=Coalesce(Subquery(zrr_queryset.values("insee_code")[:1]), Value("")),
+            zrr_name=Coalesce(Subquery(zrr_queryset.values("name")[:1]), Value("")),
+            api_zrr_last_sync_date=timezone.now(),
+        )
+
+    def with_super_badge_annotated(self):
+        """
+        Same rule as Siae.super_badge_calculated, in SQL
+        round(100 * a / b) >= 40 <=> 200 * a >= 79 * b (integer arithmetic, same rounding on the .5)
+        """
         return self.annotate(
-            similarity=Greatest(
-                TrigramSimilarity("name", full_text_string), TrigramSimilarity("brand", full_text_string)
+            super_badge_annotated=Case(
+                When(
+                    Q(user_count__gte=1)
+                    & Q(completion_rate__gte=80)
+                    & Q(tender_email_send_count__gte=1)
+                    & (
+                        Q(
+                            GreaterThanOrEqual(
+                                F("tender_email_link_click_count") * 200, F("tender_email_send_count") * 79
+                            )
+                        )
+                        | Q(
+                            GreaterThanOrEqual(
+                                F("tender_detail_contact_click_count") * 200, F("tender_email_send_count") * 39
+                            )
+                        )
+                    ),
+                    then=True,
+                ),
+                default=False,
+                output_field=BooleanField(),
             )
-        ).filter(Q(similarity__gt=0.2) | Q(siret__startswith=full_text_string))
+        )
+
+    def update_super_badge(self):
+        """
+        Set-based: two UPDATEs (badge gained / badge lost), only on the rows whose badge changes
+        Returns the number of siaes that gained & lost the badge
+        """
+        qs = self.with_super_badge_annotated()
+        now = timezone.now()
+        gained_count = (
+            qs.filter(super_badge_annotated=True)
+            .exclude(super_badge=True)
+            .update(super_badge=True, super_badge_last_updated=now)
+        )
+        lost_count = (
+            qs.filter(super_badge_annotated=False)
+            .exclude(super_badge=False)
+            .update(super_badge=False, super_badge_last_updated=now)
+        )
+        return gained_count, lost_count
 
     def filter_networks(self, networks):
         return self.filter(networks__in=networks)
@@ -365,6 +492,31 @@ class SiaeQuerySet(models.QuerySet):
 
         return qs.distinct()
 
+    def filter_with_tender_through_activity_match_index(self, tender, siae_activity_id_list=None):
+        """
+        Same matching as filter_with_tender_through_activities(), but through the SiaeActivityMatchIndex:
+        no correlated subquery nor distinct, only semi-joins on indexed rows (in a single query).
+
+        Args:
+            tender (Tender): Tender used to make the matching
+            siae_activity_id_list (list): only match these activities (default: all)
+        """
+        if siae_activity_id_list is None:
+            siae_activity_queryset = SiaeActivityMatchIndex.objects.siae_activity_queryset_with_tender(tender)
+        else:
+            siae_activity_queryset = SiaeActivityMatchIndex.objects.filter(
+                siae_activity_id__in=siae_activity_id_list
+            ).siae_activity_queryset_with_tender(
+                tender, siae_activity_queryset=SiaeActivity.objects.filter(id__in=siae_activity_id_list)
+            )
+        qs = self.tender_matching_query_set().filter(id__in=siae_activity_queryset.values("siae_id"))
+
+        # filter by siae_kind
+        if len(tender.siae_kind):
+            qs = qs.filter(kind__in=tender.siae_kind)
+
+        return qs
+
     def filter_with_tender_tendersiae_status(self, tender, tendersiae_status=None):
         qs = self.is_live().has_contact_email()  # .filter(tendersiae__tender=tender)
         # tender status
@@ -551,6 +703,31 @@ class Siae(models.Model):
         "employees_permanent_count",
         "ca",
     ]
+    # the search fields (search_text & search_vector) are computed from these fields
+    SEARCH_SOURCE_FIELDS = ["name", "brand", "siret"]
+    # the fields read by the consumers of the SiaeChange log (the API & the tender matching)
+    CHANGE_LOG_FIELDS = [
+        "name",
+        "brand",
+        "slug",
+        "siret",
+        "nature",
+        "kind",
+        "contact_website",
+        "contact_email",
+        "contact_phone",
+        "contact_social_website",
+        "logo_url",
+        "address",
+        "city",
+        "post_code",
+        "department",
+        "region",
+        "coords",
+        "is_qpv",
+        "is_active",
+        "is_delisted",
+    ]
 
     DEPARTMENT_CHOICES = DEPARTMENTS_PRETTY.items()
     REGION_CHOICES = REGIONS_PRETTY.items()
@@ -799,7 +976,11 @@ class Siae(models.Model):
     extra_data = models.JSONField(verbose_name="Données complémentaires", editable=False, default=dict)
     import_raw_object = models.JSONField(verbose_name="Donnée JSON brute", editable=False, null=True)
 
-    history = HistoricalRecords()
+    # search fields: see SiaeQuerySet.update_search_fields
+    search_text = models.TextField(verbose_name="Texte de recherche", blank=True, editable=False)
+    search_vector = SearchVectorField(verbose_name="Vecteur de recherche", null=True, editable=False)
+
+    history = HistoricalRecords(excluded_fields=["search_text", "search_vector"])
 
     created_at = models.DateTimeField(verbose_name="Date de création", default=timezone.now)
     updated_at = models.DateTimeField(verbose_name="Date de mise à jour", auto_now=True)
@@ -810,6 +991,10 @@ class Siae(models.Model):
         verbose_name = "Structure"
         verbose_name_plural = "Structures"
         ordering = ["name"]
+        indexes = [
+            GinIndex(fields=["search_vector"], name="siae_search_vector_gin"),
+            GinIndex(fields=["search_text"], name="siae_search_text_gin_trgm", opclasses=["gin_trgm_ops"]),
+        ]
 
     def __str__(self):
         return self.name
@@ -821,6 +1006,20 @@ class Siae(models.Model):
         super().__init__(*args, **kwargs)
         for field_name in self.TRACK_UPDATE_FIELDS:
             setattr(self, f"__previous_{field_name}", getattr(self, field_name))
+        self.set_previous_search_source_fields()
+
+    def set_previous_search_source_fields(self):
+        # read from __dict__: a deferred field is not loaded (it can't have changed)
+        for field_name in self.SEARCH_SOURCE_FIELDS:
+            setattr(self, f"__previous_{field_name}", self.__dict__.get(field_name))
+
+    def search_source_fields_changed(self, update_fields=None) -> bool:
+        if update_fields is not None and not set(self.SEARCH_SOURCE_FIELDS) & set(update_fields):
+            return False
+        return any(
+            self.__dict__.get(field_name) != getattr(self, f"__previous_{field_name}")
+            for field_name in self.SEARCH_SOURCE_FIELDS
+        )
 
     def set_slug(self, with_uuid=False):
         """
@@ -877,10 +1076,12 @@ class Siae(models.Model):
         - update the object stats
         - update the object content_fill_dates
         - generate the slug field
+        - update the search fields (if the name, brand or siret changed)
         """
         self.set_last_updated_fields()
         self.set_related_counts()
         self.set_content_fill_dates()
+        update_search_fields = self._state.adding or self.search_source_fields_changed(kwargs.get("update_fields"))
         try:
             self.set_slug()
             with transaction.atomic():
@@ -893,6 +1094,10 @@ class Siae(models.Model):
                 super().save(*args, **kwargs)
             else:
                 raise e
+        # maintain the search fields (filter+update: no recursion)
+        if update_search_fields:
+            Siae.objects.filter(id=self.id).update_search_fields()
+            self.set_previous_search_source_fields()
 
     @property
     def is_live(self) -> bool:
@@ -1094,7 +1299,14 @@ class Siae(models.Model):
 
     def sector_groups_list_string(self, display_max=3):
         # Retrieve sectors from activities instead of directly from the sectors field
-        sectors_name_list = list(set(self.activities.values_list("sector_group__name", flat=True)))
+        # (use the prefetched activities if available, to avoid a query per Siae in batch sends)
+        if "activities" in getattr(self, "_prefetched_objects_cache", {}):
+            sectors_name_set = {
+                activity.sector_group.name if activity.sector_group else None for activity in self.activities.all()
+            }
+        else:
+            sectors_name_set = set(self.activities.values_list("sector_group__name", flat=True))
+        sectors_name_list = list(sectors_name_set)
         if display_max and len(sectors_name_list) > display_max:
             sectors_name_list = sectors_name_list[:display_max]
             sectors_name_list.append("…")
@@ -1104,25 +1316,34 @@ class Siae(models.Model):
         return self.sector_groups_list_string(display_max=None)
 
     @cached_property
-    def stat_view_count_last_3_months(self):
+    def stat_view_counts_last_3_months(self) -> dict:
+        """
+        Read from the daily rollup (see the update_siae_view_daily_stats command): a single query
+        """
         try:
-            return Tracker.objects.siae_views_last_3_months(self.slug).count()
+            return (
+                SiaeViewDailyStat.objects.filter(siae_id=self.id)
+                .last_3_months()
+                .aggregate(
+                    total=Coalesce(Sum("view_count"), 0),
+                    buyer=Coalesce(Sum("view_count", filter=Q(user_kind=user_constants.KIND_BUYER)), 0),
+                    partner=Coalesce(Sum("view_count", filter=Q(user_kind=user_constants.KIND_PARTNER)), 0),
+                )
+            )
         except:  # noqa
-            return "-"
+            return {"total": "-", "buyer": "-", "partner": "-"}
 
-    @cached_property
+    @property
+    def stat_view_count_last_3_months(self):
+        return self.stat_view_counts_last_3_months["total"]
+
+    @property
     def stat_buyer_view_count_last_3_months(self):
-        try:
-            return Tracker.objects.siae_buyer_views_last_3_months(self.slug).count()
-        except:  # noqa
-            return "-"
+        return self.stat_view_counts_last_3_months["buyer"]
 
-    @cached_property
+    @property
     def stat_partner_view_count_last_3_months(self):
-        try:
-            return Tracker.objects.siae_partner_views_last_3_months(self.slug).count()
-        except:  # noqa
-            return "-"
+        return self.stat_view_counts_last_3_months["partner"]
 
     def siae_user_requests_pending_count(self):
         # TODO: optimize + filter on assignee
@@ -1135,8 +1356,22 @@ class Siae(models.Model):
         return get_object_admin_url(self)
 
     def get_sectors(self):
+        # use the prefetched activities & sectors if available (API list: no query per Siae)
+        if "activities" in getattr(self, "_prefetched_objects_cache", {}):
+            sectors = {sector for activity in self.activities.all() for sector in activity.sectors.all()}
+            return sorted(sectors, key=lambda sector: sector.name)
         return Sector.objects.filter(siae_activities__siae=self)
 
+    def get_presta_types(self) -> list:
+        # use the prefetched activities if available (API list: no query per Siae)
+        if "activities" in getattr(self, "_prefetched_objects_cache", {}):
+            presta_type_lists = [activity.presta_type for activity in self.activities.all()]
+        else:
+            presta_type_lists = self.activities.values_list("presta_type", flat=True)
+        return sorted(
+            {presta_type for presta_type_list in presta_type_lists for presta_type in presta_type_list or []}
+        )
+
     def set_super_badge(self):
         update_fields_list = ["super_badge"]
         siae_super_badge_current_value = self.super_badge
@@ -1294,31 +1529,35 @@ class SiaeActivityQuerySet(models.QuerySet):
         Method to filter the Siaes Activities depending on the perimeter filter.
         Depending on the type of Perimeter that were chosen, different cases arise:
 
-        - If the Perimeter is a city, we filter the Siae Activities with the following conditions:
-            - The Siae Activity has a geo_range equal to GEO_RANGE_ZONES and the city is in the locations
+        - The Siae Activity has a geo_range equal to GEO_RANGE_ZONES and one of its locations is the Perimeter,
+          or includes it (the department or the region of a city, the region of a department):
+          one join on the PerimeterAncestry closure table (instead of one condition per perimeter & ancestor)
+        - If the Perimeter is a city, we also filter the Siae Activities with the following conditions:
             - The Siae Activity has a geo_range equal to GEO_RANGE_CUSTOM and the distance between the Siae
               address and the city is less than the geo_range_custom_distance
-            - The Siae Activity has a geo_range equal to GEO_RANGE_ZONES and the department of the city is
-              in the locations
-            - The Siae Activity has a geo_range equal to GEO_RANGE_ZONES and the region of the city is in
-              the locations
-        - If the Perimeter is a department, we filter the Siae Activities with the following conditions:
-            - The Siae Activity has a geo_range equal to GEO_RANGE_ZONES and the department is in the locations
-            - The Siae Activity has a geo_range equal to GEO_RANGE_ZONES and the region of the department is in
-              the locations
-        - If the Perimeter is a region, we filter the Siae Activities with the following conditions:
-            - The Siae Activity has a geo_range equal to GEO_RANGE_ZONES and the region is in the locations
+            - The Siae address is in the city (post_codes)
+        - If the Perimeter is a department: the Siae address is in the department
+        - If the Perimeter is a region: the Siae address is in the region
 
         If include_country_area is True, we also filter the Siae Activities
         with the geo_range equal to GEO_RANGE_COUNTRY
         """
-
         # Initialize an empty Q object to accumulate conditions
         conditions = Q()
-        for perimeter in perimeters:
-            # Match siae activity with geo range zone and same perimeter
-            conditions |= Q(Q(geo_range=siae_constants.GEO_RANGE_ZONES) & Q(locations=perimeter))
+        perimeter_list = list(perimeters)
+        if perimeter_list:
+            # Match siae activity with geo range zone and a location that is (or includes) one of the perimeters
+            siae_activity_location_queryset = SiaeActivity.locations.through.objects.filter(
+                perimeter_id__in=PerimeterAncestry.objects.ancestor_id_subquery(
+                    [perimeter.id for perimeter in perimeter_list]
+                )
+            )
+            conditions |= Q(geo_range=siae_constants.GEO_RANGE_ZONES) & Q(
+                id__in=siae_activity_location_queryset.values("siaeactivity_id")
+            )
 
+        post_codes, departments, regions = set(), set(), set()
+        for perimeter in perimeter_list:
             match perimeter.kind:
                 case Perimeter.KIND_CITY:
                     # Match siae activity with geo range custom and siae city is in area
@@ -1326,38 +1565,19 @@ class SiaeActivityQuerySet(models.QuerySet):
                         Q(geo_range=siae_constants.GEO_RANGE_CUSTOM)
                         & Q(geo_range_custom_distance__gte=Distance("siae__coords", perimeter.coords) / 1000)
                     )
-
-                    # Match the department that includes this city
-                    conditions |= Q(
-                        Q(geo_range=siae_constants.GEO_RANGE_ZONES)
-                        & Q(locations__kind=Perimeter.KIND_DEPARTMENT)
-                        & Q(locations__insee_code=perimeter.department_code)
-                    )
-
-                    # Match the region that includes this city
-                    conditions |= Q(
-                        Q(geo_range=siae_constants.GEO_RANGE_ZONES)
-                        & Q(locations__kind=Perimeter.KIND_REGION)
-                        & Q(locations__insee_code=f"R{perimeter.region_code}")
-                    )
-
-                    # Try to match directly the siae city
-                    conditions |= Q(siae__post_code__in=perimeter.post_codes)
-
+                    post_codes.update(perimeter.post_codes)
                 case Perimeter.KIND_DEPARTMENT:
-                    # Match the region that includes this department
-                    conditions |= Q(
-                        Q(geo_range=siae_constants.GEO_RANGE_ZONES)
-                        & Q(locations__kind=Perimeter.KIND_REGION)
-                        & Q(locations__insee_code=f"R{perimeter.region_code}")
-                    )
-
-                    # Try to match directly the siae department
-                    conditions |= Q(siae__department=perimeter.insee_code)
-
+                    departments.add(perimeter.insee_code)
                 case Perimeter.KIND_REGION:
-                    # Try to match directly the siae region
-                    conditions |= Q(siae__region=perimeter.name)
+                    regions.add(perimeter.name)
+
+        # Try to match directly the siae city, department or region
+        if post_codes:
+            conditions |= Q(siae__post_code__in=post_codes)
+        if departments:
+            conditions |= Q(siae__department__in=departments)
+        if regions:
+            conditions |= Q(siae__region__in=regions)
 
         if include_country_area:
             conditions = Q(geo_range=siae_constants.GEO_RANGE_COUNTRY) | conditions
@@ -1482,6 +1702,190 @@ class SiaeActivity(models.Model):
         return "non disponible"
 
 
+class SiaeActivityMatchIndexQuerySet(models.QuerySet):
+    def siae_activity_id_set(self, kind, values):
+        """
+        Return the set of (siae_activity_id, siae_id) tuples matching one of the values for this kind.
+        """
+        return set(self.filter(kind=kind, value__in=values).values_list("siae_activity_id", "siae_id"))
+
+    def activity_id_subquery(self, kind, values):
+        """
+        Subquery of the siae_activity_id matching one of the values for this kind (the intersections are done in SQL)
+        """
+        return self.filter(kind=kind, value__in=values).values("siae_activity_id")
+
+    def siae_activity_perimeters_q(self, perimeters):
+        """
+        Set-based equivalent of SiaeActivityQuerySet.geo_range_in_perimeter_list(), as a condition on SiaeActivity:
+        - the "zones" part is answered by the index (locations are stored with their insee_code)
+        - the Siae address part (post_code, department, region) is read directly on the Siae
+        - the "custom distance" part needs the coords: only GEO_RANGE_CUSTOM activities are evaluated
+        """
+        location_values, post_codes, departments, regions = set(), set(), set(), set()
+        custom_distance_conditions = Q()
+        for perimeter in perimeters:
+            location_values.add(perimeter.insee_code)
+            match perimeter.kind:
+                case Perimeter.KIND_CITY:
+                    location_values.update([perimeter.department_code, f"R{perimeter.region_code}"])
+                    post_codes.update(perimeter.post_codes)
+                    if perimeter.coords:
+                        custom_distance_conditions |= Q(
+                            geo_range_custom_distance__gte=Distance("siae__coords", perimeter.coords) / 1000
+                        )
+                case Perimeter.KIND_DEPARTMENT:
+                    location_values.add(f"R{perimeter.region_code}")
+                    departments.add(perimeter.insee_code)
+                case Perimeter.KIND_REGION:
+                    regions.add(perimeter.name)
+
+        conditions = Q(id__in=self.activity_id_subquery(SiaeActivityMatchIndex.KIND_LOCATION, location_values))
+        if post_codes or departments or regions:
+            conditions |= (
+                Q(siae__post_code__in=post_codes) | Q(siae__department__in=departments) | Q(siae__region__in=regions)
+            )
+        if custom_distance_conditions:
+            conditions |= Q(geo_range=siae_constants.GEO_RANGE_CUSTOM) & custom_distance_conditions
+        return conditions
+
+    def siae_activity_id_set_with_perimeters(self, perimeters, siae_activity_queryset=None):
+        """
+        Return the set of (siae_activity_id, siae_id) tuples matching the perimeters (see siae_activity_perimeters_q)
+
+        siae_activity_queryset: restrict the activities (default: all)
+        """
+        if siae_activity_queryset is None:
+            siae_activity_queryset = SiaeActivity.objects.all()
+        return set(
+            siae_activity_queryset.filter(self.siae_activity_perimeters_q(perimeters)).values_list("id", "siae_id")
+        )
+
+    def siae_activity_queryset_with_tender(self, tender, siae_activity_queryset=None):
+        """
+        Set-based equivalent of SiaeActivityQuerySet.filter_with_tender(): each criteria is a subquery on the index,
+        and the intersection is done by the database (a single query, nothing is loaded in Python).
+
+        To match only some activities: filter the index on them, and pass them as siae_activity_queryset
+        (for the criteria read directly on the SiaeActivity)
+        """
+        if siae_activity_queryset is None:
+            siae_activity_queryset = SiaeActivity.objects.all()
+
+        # every indexed activity (each one has a GEO_RANGE row)
+        qs = siae_activity_queryset.filter(
+            id__in=self.filter(kind=SiaeActivityMatchIndex.KIND_GEO_RANGE).values("siae_activity_id")
+        )
+
+        # filter by presta_type
+        if len(tender.presta_type):
+            qs = qs.filter(
+                id__in=self.activity_id_subquery(SiaeActivityMatchIndex.KIND_PRESTA_TYPE, tender.presta_type)
+            )
+
+        # filter by sectors
+        tender_sector_ids = [str(sector_id) for sector_id in tender.sectors.values_list("id", flat=True)]
+        if len(tender_sector_ids):
+            qs = qs.filter(id__in=self.activity_id_subquery(SiaeActivityMatchIndex.KIND_SECTOR, tender_sector_ids))
+
+        # filter by perimeters
+        country_conditions = Q(
+            id__in=self.activity_id_subquery(SiaeActivityMatchIndex.KIND_GEO_RANGE, [siae_constants.GEO_RANGE_COUNTRY])
+        )
+        if tender.is_country_area:  # for all country
+            qs = qs.filter(country_conditions)
+        elif (
+            tender.location
+            and tender.location.kind == Perimeter.KIND_CITY
+            and tender.distance_location
+            and tender.distance_location > 0
+        ):
+            qs = qs.siae_within(tender.location.coords, tender.distance_location, tender.include_country_area)
+        else:
+            tender_perimeters = list(tender.perimeters.all())
+            if len(tender_perimeters):
+                perimeters_conditions = self.siae_activity_perimeters_q(tender_perimeters)
+                if tender.include_country_area:  # perimeters and all country
+                    qs = qs.filter(perimeters_conditions | country_conditions)
+                else:  # only perimeters
+                    qs = qs.filter(perimeters_conditions & ~country_conditions)
+            elif tender.include_country_area:
+                qs = qs.filter(country_conditions)
+
+        return qs
+
+    def siae_activity_id_set_with_tender(self, tender, siae_activity_queryset=None):
+        """
+        The (siae_activity_id, siae_id) tuples matching the tender (see siae_activity_queryset_with_tender)
+        """
+        return set(
+            self.siae_activity_queryset_with_tender(tender, siae_activity_queryset).values_list("id", "siae_id")
+        )
+
+
+class SiaeActivityMatchIndex(models.Model):
+    """
+    Denormalized copy of the SiaeActivity matching criteria (presta_type, sectors, locations, geo_range).
+    One row per (activity, criteria kind, value): the tender matching becomes a set intersection.
+    Kept up to date by the SiaeActivity signals (see siae_activity_match_index_changed)
+    """
+
+    KIND_SECTOR = "SECTOR"
+    KIND_PRESTA_TYPE = "PRESTA_TYPE"
+    KIND_LOCATION = "LOCATION"
+    KIND_GEO_RANGE = "GEO_RANGE"
+    KIND_CHOICES = (
+        (KIND_SECTOR, "Activité"),
+        (KIND_PRESTA_TYPE, "Type de prestation"),
+        (KIND_LOCATION, "Localisation (code INSEE)"),
+        (KIND_GEO_RANGE, "Périmètre d'intervention"),
+    )
+
+    siae_activity = models.ForeignKey(
+        "siaes.SiaeActivity", verbose_name="Activité", related_name="match_index", on_delete=models.CASCADE
+    )
+    siae = models.ForeignKey(
+        "siaes.Siae", verbose_name="Structure", related_name="activity_match_index", on_delete=models.CASCADE
+    )
+    kind = models.CharField(verbose_name="Type de critère", max_length=20, choices=KIND_CHOICES)
+    value = models.CharField(verbose_name="Valeur", max_length=20, blank=True)
+
+    objects = models.Manager.from_queryset(SiaeActivityMatchIndexQuerySet)()
+
+    class Meta:
+        verbose_name = "Index de recherche des activités"
+        verbose_name_plural = "Index de recherche des activités"
+        indexes = [
+            # covering index: the matching only reads (siae_activity_id, siae_id)
+            models.Index(
+                fields=["kind", "value"], include=["siae_activity", "siae"], name="siae_activity_match_kind_idx"
+            ),
+        ]
+
+    @classmethod
+    def build_for_activity(cls, siae_activity):
+        values_by_kind = {
+            cls.KIND_GEO_RANGE: [siae_activity.geo_range],
+            cls.KIND_PRESTA_TYPE: siae_activity.presta_type or [],
+            cls.KIND_SECTOR: [str(sector.id) for sector in siae_activity.sectors.all()],
+            cls.KIND_LOCATION: [],
+        }
+        # locations are only used with GEO_RANGE_ZONES (see geo_range_in_perimeter_list)
+        if siae_activity.geo_range == siae_constants.GEO_RANGE_ZONES:
+            values_by_kind[cls.KIND_LOCATION] = [location.insee_code for location in siae_activity.locations.all()]
+        return [
+            cls(siae_activity=siae_activity, siae_id=siae_activity.siae_id, kind=kind, value=value)
+            for kind, values in values_by_kind.items()
+            for value in values
+        ]
+
+    @classmethod
+    def refresh_for_activity(cls, siae_activity):
+        with transaction.atomic():
+            cls.objects.filter(siae_activity=siae_activity).delete()
+            cls.objects.bulk_create(cls.build_for_activity(siae_activity))
+
+
 class SiaeOffer(models.Model):
     name = models.CharField(verbose_name="Nom", max_length=255)
     description = models.TextField(verbose_name="Description", blank=True)
@@ -1508,6 +1912,39 @@ def siae_activity_post_save(sender, instance, **kwargs):
     instance.siae.save()
 
 
+@receiver(post_save, sender=SiaeActivity)
+def siae_activity_match_index_post_save(sender, instance, **kwargs):
+    """Refresh the activity match index (presta_type & geo_range)."""
+    SiaeActivityMatchIndex.refresh_for_activity(instance)
+
+
+@receiver(m2m_changed, sender=SiaeActivity.sectors.through)
+@receiver(m2m_changed, sender=SiaeActivity.locations.through)
+def siae_activity_match_index_changed(sender, instance, action, **kwargs):
+    """
+    Refresh the activity match index (sectors & locations).
+    Will be called if we do `siae_activity.sectors.add(sector)` or `sector.siae_activities.add(siae_activity)`
+    """
+    if action in ("post_add", "post_remove", "post_clear"):
+        if isinstance(instance, SiaeActivity):
+            siae_activity_list = [instance]
+        elif kwargs["pk_set"]:
+            siae_activity_list = SiaeActivity.objects.filter(id__in=kwargs["pk_set"])
+        else:
+            # reverse clear (e.g. `sector.siae_activities.clear()`): find the activities through the index
+            if sender == SiaeActivity.sectors.through:
+                index_filter = Q(kind=SiaeActivityMatchIndex.KIND_SECTOR, value=str(instance.id))
+            else:
+                index_filter = Q(kind=SiaeActivityMatchIndex.KIND_LOCATION, value=instance.insee_code)
+            siae_activity_list = SiaeActivity.objects.filter(
+                id__in=SiaeActivityMatchIndex.objects.filter(index_filter).values("siae_activity_id")
+            )
+        for siae_activity in siae_activity_list:
+            SiaeActivityMatchIndex.refresh_for_activity(siae_activity)
+        # the sectors are part of the API payload
+        SiaeChange.objects.record([siae_activity.siae_id for siae_activity in siae_activity_list])
+
+
 class SiaeClientReference(models.Model):
     name = models.CharField(verbose_name="Nom", max_length=255, blank=True)
     description = models.TextField(verbose_name="Description", blank=True)
@@ -1587,3 +2024,100 @@ class SiaeImage(models.Model):
     # def __str__(self):
     #     if self.name:
     #         return self.name
+
+
+class SiaeChangeQuerySet(models.QuerySet):
+    def record(self, siae_id_list, kind=None):
+        """
+        Append a change for each Siae (the bulk updates bypass the post_save signal: they must call it explicitly)
+        """
+        now = timezone.now()
+        kind = kind or SiaeChange.KIND_UPDATE
+        return self.bulk_create(
+            [SiaeChange(siae_id=siae_id, kind=kind, created_at=now) for siae_id in set(siae_id_list)],
+            batch_size=1000,
+        )
+
+    def since(self, cursor):
+        """
+        The changes after the cursor (the id of the last change read), oldest first.
+        The most recent changes are skipped for a few seconds: the ids of concurrent transactions
+        may be committed out of order (a change could appear *before* an already read cursor)
+        """
+        return self.filter(
+            id__gt=cursor, created_at__lte=timezone.now() - timedelta(seconds=settings.API_SIAE_CHANGES_DELAY)
+        ).order_by("id")
+
+
+class SiaeChange(models.Model):
+    """
+    Append-only log of the Siae mutations (used by the API change feed: /api/siae/changes/)
+    Filled by the Siae (& related objects) signals, and by the commands & tasks that update the Siae in bulk.
+    """
+
+    KIND_UPDATE = "UPDATE"
+    KIND_DELETE = "DELETE"
+    KIND_CHOICES = (
+        (KIND_UPDATE, "Création ou modification"),
+        (KIND_DELETE, "Suppression"),
+    )
+
+    # not a ForeignKey: the deletions are logged too
+    siae_id = models.IntegerField(verbose_name="ID de la structure")
+    kind = models.CharField(verbose_name="Type de changement", max_length=20, choices=KIND_CHOICES)
+
+    created_at = models.DateTimeField(verbose_name="Date de création", default=timezone.now)
+
+    objects = models.Manager.from_queryset(SiaeChangeQuerySet)()
+
+    class Meta:
+        verbose_name = "Changement de structure"
+        verbose_name_plural = "Changements de structures"
+        ordering = ["id"]
+        indexes = [
+            # the latest change of a list of Siae (see the API ETag)
+            models.Index(fields=["siae_id", "id"], name="siae_change_siae_id_idx"),
+        ]
+
+
+class SiaeChangeCursor(models.Model):
+    """
+    The last SiaeChange processed by an internal consumer of the log (high-water mark),
+    e.g. the match_updated_siae_activities_with_live_tenders command
+    """
+
+    name = models.CharField(verbose_name="Nom", max_length=255, unique=True)
+    last_change_id = models.BigIntegerField(verbose_name="ID du dernier changement traité", default=0)
+
+    updated_at = models.DateTimeField(verbose_name="Date de modification", auto_now=True)
+
+    class Meta:
+        verbose_name = "Curseur des changements de structures"
+        verbose_name_plural = "Curseurs des changements de structures"
+
+
+@receiver(post_save, sender=Siae)
+def siae_change_post_save(sender, instance, update_fields=None, **kwargs):
+    # e.g. the counters saves: not a change for the consumers of the log
+    if update_fields is not None and not update_fields & set(Siae.CHANGE_LOG_FIELDS):
+        return
+    SiaeChange.objects.record([instance.id])
+
+
+@receiver(post_delete, sender=Siae)
+def siae_change_post_delete(sender, instance, **kwargs):
+    SiaeChange.objects.record([instance.id], kind=SiaeChange.KIND_DELETE)
+
+
+@receiver(post_save, sender=SiaeOffer)
+@receiver(post_delete, sender=SiaeOffer)
+@receiver(post_save, sender=SiaeClientReference)
+@receiver(post_delete, sender=SiaeClientReference)
+@receiver(post_save, sender=SiaeLabelOld)
+@receiver(post_delete, sender=SiaeLabelOld)
+def siae_change_related_object_changed(sender, instance, **kwargs):
+    """
+    The offers, client references & labels are part of the API payload
+    (the activities & networks changes already save the Siae)
+    """
+    SiaeChange.objects.record([instance.siae_id])
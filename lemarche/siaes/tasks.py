@@ -8,32 +8,43 @@ from lemarche.utils.emails import whitelist_recipient_list
 from lemarche.utils.urls import get_domain_url, get_object_share_url
 
 
+def get_siae_coords_update_fields(siae, geocoding_data) -> dict | None:
+    """
+    The fields to update from the geocoding result (None if nothing to update)
+    """
+    if siae.post_code != geocoding_data["post_code"]:
+        if not siae.post_code or (siae.post_code[:2] == geocoding_data["post_code"][:2]):
+            # update post_code as well
+            return {"coords": geocoding_data["coords"], "post_code": geocoding_data["post_code"]}
+        print(f"Geocoding found a different place,{siae.name},{siae.post_code},{geocoding_data['post_code']}")  # noqa
+        return None
+    return {"coords": geocoding_data["coords"]}
+
+
 @task()
 def set_siae_coords(model, siae):
     """
     Why do we use filter+update here? To avoid calling Siae.post_save signal again (recursion)
     """
+    from lemarche.siaes.models import SiaeChange  # circular import (models -> tasks)
+
     geocoding_data = get_geocoding_data(siae.address + " " + siae.city, post_code=siae.post_code)
     if geocoding_data:
-        if siae.post_code != geocoding_data["post_code"]:
-            if not siae.post_code or (siae.post_code[:2] == geocoding_data["post_code"][:2]):
-                # update post_code as well
-                model.objects.filter(id=siae.id).update(
-                    coords=geocoding_data["coords"], post_code=geocoding_data["post_code"]
-                )
-            else:
-                print(
-                    f"Geocoding found a different place,{siae.name},{siae.post_code},{geocoding_data['post_code']}"  # noqa
-                )
-        else:
-            # s.coords = geocoding_data["coords"]
-            model.objects.filter(id=siae.id).update(coords=geocoding_data["coords"])
+        update_fields = get_siae_coords_update_fields(siae, geocoding_data)
+        if update_fields:
+            model.objects.filter(id=siae.id).update(**update_fields)
+            # post_code is part of the API payload (see the API change feed)
+            if "post_code" in update_fields:
+                SiaeChange.objects.record([siae.id])
+        # QPV & ZRR flags from the local layers (if imported)
+        model.objects.filter(id=siae.id).update_qpv_fields()
+        model.objects.filter(id=siae.id).update_zrr_fields()
     else:
         print(f"Geocoding not found,{siae.name},{siae.post_code}")
 
 
 def send_completion_reminder_email_to_siae(siae):
-    email_template = TemplateTransactional.objects.get(code="SIAE_COMPLETION_REMINDER")
+    email_template = TemplateTransactional.objects.get_by_code("SIAE_COMPLETION_REMINDER")
     siae_user_emails = list(siae.users.values_list("email", flat=True))
     recipient_list = whitelist_recipient_list(siae_user_emails)
     if len(recipient_list):
@@ -1,15 +1,18 @@
 import logging
 import os
+from datetime import timedelta
+from io import StringIO
 from unittest.mock import patch
 
 import factory
 from django.core.management import call_command
 from django.db.models import signals
-from django.test import TransactionTestCase
+from django.test import TestCase, TransactionTestCase
+from django.utils import timezone
 
 from lemarche.siaes import constants as siae_constants
 from lemarche.siaes.factories import SiaeActivityFactory, SiaeFactory
-from lemarche.siaes.models import Siae
+from lemarche.siaes.models import Siae, SiaeChange, SiaeChangeCursor
 from lemarche.users.factories import UserFactory
 
 
@@ -124,6 +127,56 @@ class SyncWithEmploisInclusionCommandTest(TransactionTestCase):
         updated_siae.refresh_from_db()
         self.assertEqual(updated_siae.brand, "Updated Name")  # Brand name can only be updated once
 
+    @patch("lemarche.utils.apis.api_emplois_inclusion.get_siae_list")
+    def test_sync_with_emplois_inclusion_dry_run_and_unchanged_siae(self, mock_get_siae_list):
+        existing_siae = SiaeFactory(c1_id=123, siret="12345678901234", kind=siae_constants.KIND_EI, city="Tours")
+        mock_get_siae_list.return_value = [
+            {
+                "id": 123,
+                "siret": "12345678901234",
+                "naf": "8899B",
+                "kind": "EI",
+                "name": "New SIAE",
+                "brand": "",
+                "phone": "",
+                "email": "",
+                "website": "",
+                "description": "",
+                "address_line_1": "2 rue Test",
+                "address_line_2": "",
+                "post_code": "69001",
+                "city": "Lyon",
+                "department": "69",
+                "source": "ASP",
+                "latitude": 0,
+                "longitude": 0,
+                "convention_is_active": True,
+                "convention_asp_id": 0,
+                "admin_name": "",
+                "admin_email": "",
+            }
+        ]
+        os.environ["API_EMPLOIS_INCLUSION_TOKEN"] = "test"
+
+        # dry run: no writes
+        call_command("sync_with_emplois_inclusion", dry_run=True)
+        existing_siae.refresh_from_db()
+        self.assertEqual(existing_siae.city, "Tours")
+        self.assertIsNone(existing_siae.c1_last_sync_date)
+
+        call_command("sync_with_emplois_inclusion")
+        existing_siae.refresh_from_db()
+        self.assertEqual(existing_siae.city, "Lyon")
+        self.assertIsNotNone(existing_siae.c1_last_sync_date)
+        updated_at = existing_siae.updated_at
+        c1_last_sync_date = existing_siae.c1_last_sync_date
+
+        # same data: only c1_last_sync_date is stamped
+        call_command("sync_with_emplois_inclusion")
+        existing_siae.refresh_from_db()
+        self.assertEqual(existing_siae.updated_at, updated_at)
+        self.assertGreater(existing_siae.c1_last_sync_date, c1_last_sync_date)
+
     @patch("lemarche.utils.apis.api_emplois_inclusion.get_siae_list")
     def test_sync_with_emplois_inclusion_with_duplicate_brand_name_on_create(self, mock_get_siae_list):
         # Create existing SIAE with the same brand name
@@ -375,3 +428,78 @@ class SiaeUpdateCountFieldsCommandTest(TransactionTestCase):
         siae_not_updated.refresh_from_db()
         self.assertEqual(siae_not_updated.user_count, 0)
         self.assertEqual(siae_not_updated.sector_count, 0)
+
+    @factory.django.mute_signals(signals.post_save, signals.m2m_changed)
+    def test_update_count_fields_with_fields(self):
+        """
+        Only the given fields are updated (completion_rate last, with the updated counts)
+        """
+        siae_1 = SiaeFactory(siret="12345678900011", is_active=True)
+        SiaeFactory(siret="12345678900029", is_active=True)
+        SiaeFactory(siret="12345678900037", is_active=False)
+        for _ in range(2):
+            siae_1.users.add(UserFactory())
+        SiaeActivityFactory.create_batch(2, siae=siae_1)
+
+        call_command(
+            "update_siae_count_fields",
+            fields=["completion_rate", "etablissement_count", "sector_count"],
+        )
+        siae_1.refresh_from_db()
+        self.assertEqual(siae_1.etablissement_count, 2)
+        self.assertEqual(siae_1.sector_count, 2)
+        self.assertEqual(siae_1.user_count, 0)  # not in fields
+        self.assertEqual(siae_1.completion_rate, siae_1.completion_rate_calculated)
+        self.assertGreater(siae_1.completion_rate, 0)
+
+
+class SiaeUpdateApiEntrepriseFieldsCommandTest(TransactionTestCase):
+    @patch("lemarche.siaes.management.commands.update_api_entreprise_fields.exercice_get_or_error")
+    @patch("lemarche.siaes.management.commands.update_api_entreprise_fields.etablissement_get_or_error")
+    @patch("lemarche.siaes.management.commands.update_api_entreprise_fields.entreprise_get_or_error")
+    def test_update_api_entreprise_fields(self, mock_entreprise, mock_etablissement, mock_exercice):
+        mock_entreprise.return_value = ({"forme_juridique": "SARL", "forme_juridique_code": "5499"}, None)
+        mock_etablissement.return_value = (None, "SIRET non reconnu.")
+        mock_exercice.return_value = ({"ca": 1000, "date_fin_exercice": "2016-12-31T00:00:00+01:00"}, None)
+        siae_1 = SiaeFactory(siret="12345678900011")
+        siae_2 = SiaeFactory(siret="12345678900029")
+
+        call_command("update_api_entreprise_fields", stdout=StringIO())
+
+        # the /entreprises response is shared between the siaes of the same siren
+        self.assertEqual(mock_entreprise.call_count, 1)
+        self.assertEqual(mock_etablissement.call_count, 2)
+        self.assertEqual(mock_exercice.call_count, 2)
+        for siae in [siae_1, siae_2]:
+            siae.refresh_from_db()
+            self.assertEqual(siae.api_entreprise_forme_juridique, "SARL")
+            self.assertIsNotNone(siae.api_entreprise_entreprise_last_sync_date)
+            self.assertIsNone(siae.api_entreprise_etablissement_last_sync_date)
+            self.assertEqual(siae.api_entreprise_ca, 1000)
+            self.assertIsNotNone(siae.api_entreprise_exercice_last_sync_date)
+
+
+class PurgeSiaeChangesCommandTest(TestCase):
+    def setUp(self):
+        siae = SiaeFactory()
+        SiaeChange.objects.all().delete()
+        old_date = timezone.now() - timedelta(days=40)
+        self.old_change_1 = SiaeChange.objects.record([siae.id])[0]
+        self.old_change_2 = SiaeChange.objects.record([siae.id])[0]
+        SiaeChange.objects.filter(id__in=[self.old_change_1.id, self.old_change_2.id]).update(created_at=old_date)
+        self.recent_change = SiaeChange.objects.record([siae.id])[0]
+
+    def test_purge_siae_changes(self):
+        call_command("purge_siae_changes", stdout=StringIO())
+        self.assertEqual(list(SiaeChange.objects.values_list("id", flat=True)), [self.recent_change.id])
+
+    def test_purge_siae_changes_dry_run(self):
+        call_command("purge_siae_changes", dry_run=True, stdout=StringIO())
+        self.assertEqual(SiaeChange.objects.count(), 3)
+
+    def test_purge_siae_changes_keeps_the_changes_not_read_by_a_cursor(self):
+        SiaeChangeCursor.objects.create(name="consumer", last_change_id=self.old_change_1.id)
+        call_command("purge_siae_changes", stdout=StringIO())
+        self.assertEqual(
+            list(SiaeChange.objects.values_list("id", flat=True)), [self.old_change_2.id, self.recent_change.id]
+        )
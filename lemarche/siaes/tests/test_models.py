@@ -1,3 +1,7 @@
+from datetime import timedelta
+from unittest.mock import patch
+
+from django.contrib.gis.geos import MultiPolygon, Point, Polygon
 from django.core.exceptions import ValidationError
 from django.test import TestCase
 from django.utils import timezone
@@ -5,7 +9,8 @@ from django.utils import timezone
 from lemarche.labels.factories import LabelFactory
 from lemarche.networks.factories import NetworkFactory
 from lemarche.perimeters.factories import PerimeterFactory
-from lemarche.perimeters.models import Perimeter
+from lemarche.perimeters.models import Perimeter, Qpv, Zrr
+from lemarche.sectors.factories import SectorFactory
 from lemarche.siaes import constants as siae_constants, utils as siae_utils
 from lemarche.siaes.factories import (
     SiaeActivityFactory,
@@ -16,7 +21,9 @@ from lemarche.siaes.factories import (
     SiaeLabelOldFactory,
     SiaeOfferFactory,
 )
-from lemarche.siaes.models import Siae, SiaeGroup, SiaeLabel, SiaeUser
+from lemarche.siaes.models import Siae, SiaeActivityMatchIndex, SiaeGroup, SiaeLabel, SiaeUser
+from lemarche.stats.models import SiaeViewDailyStat
+from lemarche.users import constants as user_constants
 from lemarche.users.factories import UserFactory
 from lemarche.utils.history import HISTORY_TYPE_CREATE, HISTORY_TYPE_UPDATE
 
@@ -212,6 +219,33 @@ class SiaeModelTest(TestCase):
             self.assertTrue(siae.super_badge_calculated)
 
 
+class SiaeModelStatViewCountTest(TestCase):
+    databases = {"default", "stats"}
+
+    def test_stat_view_counts_last_3_months(self):
+        siae = SiaeFactory()
+        today = timezone.localdate()
+        for day, user_kind, view_count in [
+            (today, user_constants.KIND_BUYER, 3),
+            (today - timedelta(days=10), user_constants.KIND_BUYER, 2),
+            (today, user_constants.KIND_PARTNER, 4),
+            (today, "", 1),
+            # too old
+            (today - timedelta(days=100), user_constants.KIND_BUYER, 50),
+        ]:
+            SiaeViewDailyStat.objects.create(siae_id=siae.id, day=day, user_kind=user_kind, view_count=view_count)
+        # other siae
+        SiaeViewDailyStat.objects.create(siae_id=siae.id + 1, day=today, user_kind="", view_count=20)
+        self.assertEqual(siae.stat_view_counts_last_3_months, {"total": 10, "buyer": 5, "partner": 4})
+        self.assertEqual(siae.stat_view_count_last_3_months, 10)
+        self.assertEqual(siae.stat_buyer_view_count_last_3_months, 5)
+        self.assertEqual(siae.stat_partner_view_count_last_3_months, 4)
+
+    def test_stat_view_counts_last_3_months_without_views(self):
+        siae = SiaeFactory()
+        self.assertEqual(siae.stat_view_counts_last_3_months, {"total": 0, "buyer": 0, "partner": 0})
+
+
 class SiaeModelSaveTest(TestCase):
     def setUp(self):
         pass
@@ -234,6 +268,32 @@ class SiaeModelSaveTest(TestCase):
         self.assertTrue(siae_doublon_11.slug.startswith("structure-doublon-sans-departement--"))  # uuid4 at the end
         self.assertTrue(len(siae_doublon_10.slug) < len(siae_doublon_11.slug))
 
+    def test_update_search_fields_on_save(self):
+        siae = SiaeFactory(name="Une Activité", brand="ÉthicoFil", siret="12312312312312")
+        siae.refresh_from_db()
+        self.assertEqual(siae.search_text, "une activite ethicofil 12312312312312")
+        self.assertIsNotNone(siae.search_vector)
+        siae.brand = "Autre"
+        siae.save()
+        siae.refresh_from_db()
+        self.assertEqual(siae.search_text, "une activite autre 12312312312312")
+
+    def test_update_search_fields_only_when_the_source_fields_change(self):
+        siae = SiaeFactory(name="Une Activité", brand="ÉthicoFil", siret="12312312312312")
+        with patch("lemarche.siaes.models.SiaeQuerySet.update_search_fields") as mock_update_search_fields:
+            siae.description = "Une description"
+            siae.save()
+            siae.user_count = 2
+            siae.save(update_fields=["user_count"])
+            # the name is not saved
+            siae.name = "Autre nom"
+            siae.save(update_fields=["user_count"])
+            mock_update_search_fields.assert_not_called()
+            siae.save(update_fields=["name"])
+            self.assertEqual(mock_update_search_fields.call_count, 1)
+            siae.save()
+            self.assertEqual(mock_update_search_fields.call_count, 1)
+
     def test_update_related_offer_count_on_save(self):
         siae = SiaeFactory()
         self.assertEqual(siae.offer_count, 0)
@@ -451,6 +511,15 @@ class SiaeModelQuerysetTest(TestCase):
         self.assertEqual(Siae.objects.is_live().count(), 1)
         self.assertEqual(Siae.objects.is_not_live().count(), 3)
 
+    def test_update_search_fields_queryset(self):
+        siae = SiaeFactory(name="Ma boite")
+        Siae.objects.filter(id=siae.id).update(name="Ma nouvelle boite")  # bypasses save()
+        self.assertEqual(Siae.objects.filter_full_text("nouvelle").count(), 0)
+        self.assertEqual(Siae.objects.update_search_fields(), 1)
+        self.assertEqual(Siae.objects.filter_full_text("nouvelle").count(), 1)
+        # already up to date
+        self.assertEqual(Siae.objects.update_search_fields(), 0)
+
     def test_has_user_queryset(self):
         SiaeFactory()
         siae = SiaeFactory()
@@ -530,6 +599,28 @@ class SiaeModelQuerysetTest(TestCase):
         self.assertEqual(siae_queryset.get(id=siae_8.id).employees_insertion_count_with_c2_etp_annotated, 125)
         self.assertEqual(siae_queryset.get(id=siae_8.id).employees_count_annotated, 125 + 88)
 
+    def test_update_super_badge_queryset(self):
+        badge_kwargs = dict(user_count=1, completion_rate=80, tender_email_send_count=10)
+        siae_gained = SiaeFactory(**badge_kwargs, tender_email_link_click_count=4)
+        siae_kept = SiaeFactory(
+            **badge_kwargs, tender_detail_contact_click_count=2, super_badge=True, super_badge_last_updated=None
+        )
+        siae_lost = SiaeFactory(**badge_kwargs, tender_email_link_click_count=3, super_badge=True)
+        siae_none = SiaeFactory(user_count=0)
+        for siae in Siae.objects.with_super_badge_annotated():
+            self.assertEqual(siae.super_badge_annotated, siae.super_badge_calculated)
+
+        self.assertEqual(Siae.objects.update_super_badge(), (1, 2))
+        for siae in [siae_gained, siae_kept, siae_lost, siae_none]:
+            siae.refresh_from_db()
+        self.assertTrue(siae_gained.super_badge)
+        self.assertIsNotNone(siae_gained.super_badge_last_updated)
+        self.assertTrue(siae_kept.super_badge)
+        self.assertIsNone(siae_kept.super_badge_last_updated)
+        self.assertFalse(siae_lost.super_badge)
+        self.assertFalse(siae_none.super_badge)
+        self.assertEqual(Siae.objects.update_super_badge(), (0, 0))
+
 
 class SiaeModelPerimeterQuerysetTest(TestCase):
     @classmethod
@@ -576,6 +667,46 @@ class SiaeModelPerimeterQuerysetTest(TestCase):
         )
 
 
+class SiaeModelQpvZrrQuerysetTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        square = Polygon(((5.70, 45.17), (5.75, 45.17), (5.75, 45.20), (5.70, 45.20), (5.70, 45.17)), srid=4326)
+        cls.qpv = Qpv.objects.create(code="QN03801M", name="Villeneuve", geometry=MultiPolygon(square, srid=4326))
+        cls.zrr = Zrr.objects.create(insee_code="38185", name="Grenoble", geometry=MultiPolygon(square, srid=4326))
+        cls.siae_inside = SiaeFactory()
+        cls.siae_near = SiaeFactory()
+        cls.siae_outside = SiaeFactory(is_qpv=True, qpv_code="OLD", is_zrr=True)
+        cls.siae_without_coords = SiaeFactory()
+        Siae.objects.filter(id=cls.siae_inside.id).update(coords=Point(5.7301, 45.1825, srid=4326))
+        # ~400m east of the square
+        Siae.objects.filter(id=cls.siae_near.id).update(coords=Point(5.755, 45.1825, srid=4326))
+        Siae.objects.filter(id=cls.siae_outside.id).update(coords=Point(5.8862, 45.1106, srid=4326))
+
+    def test_update_qpv_fields(self):
+        self.assertEqual(Siae.objects.update_qpv_fields(), 3)
+        self.siae_inside.refresh_from_db()
+        self.assertTrue(self.siae_inside.is_qpv)
+        self.assertEqual(self.siae_inside.qpv_code, "QN03801M")
+        self.assertEqual(self.siae_inside.qpv_name, "Villeneuve")
+        self.assertIsNotNone(self.siae_inside.api_qpv_last_sync_date)
+        for siae in [self.siae_near, self.siae_outside]:
+            siae.refresh_from_db()
+            self.assertFalse(siae.is_qpv)
+            self.assertEqual(siae.qpv_code, "")
+        self.siae_without_coords.refresh_from_db()
+        self.assertIsNone(self.siae_without_coords.api_qpv_last_sync_date)
+
+    def test_update_zrr_fields(self):
+        self.assertEqual(Siae.objects.update_zrr_fields(), 3)
+        for siae in [self.siae_inside, self.siae_near]:
+            siae.refresh_from_db()
+            self.assertTrue(siae.is_zrr)
+            self.assertEqual(siae.zrr_code, "38185")
+            self.assertEqual(siae.zrr_name, "Grenoble")
+        self.siae_outside.refresh_from_db()
+        self.assertFalse(self.siae_outside.is_zrr)
+
+
 class SiaeHistoryTest(TestCase):
     @classmethod
     def setUpTestData(cls):
@@ -646,3 +777,72 @@ class SiaeActivitiesTest(TestCase):
         self.siae.name = "test_siae"
         self.siae.save()
         self.assertTrue(self.siae.updated_at == self.siae.latest_activity_at)
+
+
+class SiaeActivityMatchIndexTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.siae = SiaeFactory()
+        cls.sector_1 = SectorFactory()
+        cls.sector_2 = SectorFactory()
+        cls.perimeter = PerimeterFactory(**PERIMETER_GRENOBLE)
+
+    def get_index_values(self, siae_activity, kind):
+        return set(
+            SiaeActivityMatchIndex.objects.filter(siae_activity=siae_activity, kind=kind).values_list(
+                "value", flat=True
+            )
+        )
+
+    def test_index_is_built_on_save(self):
+        siae_activity = SiaeActivityFactory(
+            siae=self.siae,
+            presta_type=[siae_constants.PRESTA_PREST, siae_constants.PRESTA_BUILD],
+            with_country_perimeter=True,
+        )
+        self.assertEqual(
+            self.get_index_values(siae_activity, SiaeActivityMatchIndex.KIND_GEO_RANGE),
+            {siae_constants.GEO_RANGE_COUNTRY},
+        )
+        self.assertEqual(
+            self.get_index_values(siae_activity, SiaeActivityMatchIndex.KIND_PRESTA_TYPE),
+            {siae_constants.PRESTA_PREST, siae_constants.PRESTA_BUILD},
+        )
+        siae_activity.presta_type = [siae_constants.PRESTA_DISP]
+        siae_activity.save()
+        self.assertEqual(
+            self.get_index_values(siae_activity, SiaeActivityMatchIndex.KIND_PRESTA_TYPE), {siae_constants.PRESTA_DISP}
+        )
+
+    def test_index_is_updated_on_m2m_changes(self):
+        siae_activity = SiaeActivityFactory(siae=self.siae, with_zones_perimeter=True)
+        siae_activity.sectors.add(self.sector_1, self.sector_2)
+        siae_activity.locations.add(self.perimeter)
+        self.assertEqual(
+            self.get_index_values(siae_activity, SiaeActivityMatchIndex.KIND_SECTOR),
+            {str(self.sector_1.id), str(self.sector_2.id)},
+        )
+        self.assertEqual(self.get_index_values(siae_activity, SiaeActivityMatchIndex.KIND_LOCATION), {"38185"})
+        siae_activity.sectors.remove(self.sector_1)
+        self.assertEqual(
+            self.get_index_values(siae_activity, SiaeActivityMatchIndex.KIND_SECTOR), {str(self.sector_2.id)}
+        )
+        # reverse side
+        self.sector_2.siae_activities.clear()
+        self.assertEqual(self.get_index_values(siae_activity, SiaeActivityMatchIndex.KIND_SECTOR), set())
+        self.perimeter.siae_activities.remove(siae_activity)
+        self.assertEqual(self.get_index_values(siae_activity, SiaeActivityMatchIndex.KIND_LOCATION), set())
+
+    def test_locations_are_indexed_only_for_zones_geo_range(self):
+        siae_activity = SiaeActivityFactory(siae=self.siae, with_country_perimeter=True)
+        siae_activity.locations.add(self.perimeter)
+        self.assertEqual(self.get_index_values(siae_activity, SiaeActivityMatchIndex.KIND_LOCATION), set())
+        siae_activity.geo_range = siae_constants.GEO_RANGE_ZONES
+        siae_activity.save()
+        self.assertEqual(self.get_index_values(siae_activity, SiaeActivityMatchIndex.KIND_LOCATION), {"38185"})
+
+    def test_index_is_deleted_with_activity(self):
+        siae_activity = SiaeActivityFactory(siae=self.siae)
+        self.assertTrue(SiaeActivityMatchIndex.objects.filter(siae_activity=siae_activity).exists())
+        siae_activity.delete()
+        self.assertFalse(SiaeActivityMatchIndex.objects.filter(siae_activity_id=siae_activity.id).exists())
@@ -0,0 +1,115 @@
+import csv
+import time
+from datetime import date, timedelta
+
+import boto3
+from django.conf import settings
+from django.db.models import Count
+
+from lemarche.stats.models import Tracker
+from lemarche.users.models import User
+from lemarche.utils.commands import BaseCommand
+from lemarche.utils.s3 import API_CONNECTION_DICT, S3MultipartUpload
+
+
+TRACKER_ITERATOR_CHUNK_SIZE = 2000
+
+SEARCH_META_LIST_FIELDS = ["sectors", "perimeter_name", "kind", "presta_type", "territory", "networks"]
+USER_FIELDS = ["first_name", "last_name", "kind", "email", "phone", "company_name", "siae_count", "created_at"]
+
+EXPORT_FIELDNAMES = [
+    *[f"search_{field}" for field in SEARCH_META_LIST_FIELDS],
+    "search_results_count",
+    "search_page",
+    *[f"user_{field}" for field in USER_FIELDS],
+    "cmp",
+    "timestamp",
+    "stats_id",
+]
+
+
+def build_file_url(endpoint, bucket_name, file_key):
+    return f"{endpoint}/{bucket_name}/{file_key}"
+
+
+class ExportTrackerCommand(BaseCommand):
+    """
+    Base class for the export of Tracker events (with the user details) to a CSV file on S3
+
+    The export is a streaming pipeline:
+    - the Tracker events are read with a server-side cursor (iterator)
+    - the users are joined with a dict (id -> user), loaded once
+    - the CSV rows are uploaded to S3 by parts as they are written (multipart upload, nothing on disk)
+    """
+
+    TRACKER_ACTION: str = None
+    FILENAME_PREFIX: str = None
+    EVENT_NAME: str = None
+
+    def add_arguments(self, parser):
+        parser.add_argument("--start_date", type=str, default="2022-01-01")
+
+    def handle(self, *args, **options):
+        start_time = time.perf_counter()
+        filename = f"{self.FILENAME_PREFIX}_{date.today()}"
+        filename_previous = f"{self.FILENAME_PREFIX}_{date.today() - timedelta(days=1)}"
+
+        self.stdout_info("-" * 80)
+        self.stdout_info("Step 1: fetching users")
+        user_dict = self.fetch_user_dict()
+        self.stdout_info(f"Found {len(user_dict)} users")
+
+        self.stdout_info("-" * 80)
+        self.stdout_info(f"Step 2: export {self.EVENT_NAME} list to csv (streamed to S3)")
+        s3_file_key = f"{settings.STAT_EXPORT_FOLDER_NAME}/{filename}.csv"
+        with S3MultipartUpload(settings.S3_STORAGE_BUCKET_NAME, s3_file_key, content_type="text/csv") as file:
+            writer = csv.DictWriter(file, fieldnames=EXPORT_FIELDNAMES)
+            writer.writeheader()
+            item_count = 0
+            for item in self.fetch_tracker_iterator(options["start_date"]):
+                writer.writerow(self.enrich_item(item, user_dict))
+                item_count += 1
+        s3_file_url = build_file_url(API_CONNECTION_DICT["endpoint_url"], settings.S3_STORAGE_BUCKET_NAME, s3_file_key)
+        self.stdout_success(f"Exported {item_count} items in {time.perf_counter() - start_time:.2f}s")
+        self.stdout_success(f"S3 file url: {s3_file_url}")
+
+        self.stdout_info("-" * 80)
+        self.stdout_info("Step 3: cleanup")
+        self.cleanup(filename_previous)
+
+    def fetch_user_dict(self) -> dict:
+        user_queryset = (
+            User.objects.annotate(siae_count=Count("siaes", distinct=True))
+            .values("id", *USER_FIELDS)
+            .order_by()
+            .iterator(chunk_size=TRACKER_ITERATOR_CHUNK_SIZE)
+        )
+        return {user["id"]: user for user in user_queryset}
+
+    def fetch_tracker_iterator(self, start_date):
+        return (
+            Tracker.objects.filter(env="prod", action=self.TRACKER_ACTION, date_created__gte=start_date)
+            .order_by("date_created")
+            .values("data", "date_created", "id_internal")
+            .iterator(chunk_size=TRACKER_ITERATOR_CHUNK_SIZE)
+        )
+
+    def enrich_item(self, item, user_dict) -> dict:
+        tracker_meta_data = item["data"].get("meta")
+        user = user_dict.get(tracker_meta_data.get("user_id"), {})
+        return {
+            # search
+            **{f"search_{field}": ", ".join(tracker_meta_data.get(field, [])) for field in SEARCH_META_LIST_FIELDS},
+            "search_results_count": tracker_meta_data.get("results_count", None),
+            "search_page": ", ".join(tracker_meta_data.get("page", [])),
+            # user
+            **{f"user_{field}": user.get(field, "") for field in USER_FIELDS},
+            # other
+            "cmp": tracker_meta_data.get("cmp", ""),
+            "timestamp": item["date_created"],
+            "stats_id": item["id_internal"],
+        }
+
+    def cleanup(self, filename_previous):
+        bucket = boto3.resource("s3", **API_CONNECTION_DICT).Bucket(settings.S3_STORAGE_BUCKET_NAME)
+        bucket.objects.filter(Prefix=f"{settings.STAT_EXPORT_FOLDER_NAME}/{filename_previous}").delete()
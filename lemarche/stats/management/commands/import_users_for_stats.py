@@ -1,5 +1,10 @@
-import argparse
+import csv
+import io
+import time
 
+from django.core.management.base import CommandError
+from django.db import connections, router, transaction
+from django.db.models import Max
 from django.db.utils import IntegrityError
 
 from lemarche.stats.models import StatsUser
@@ -7,56 +12,167 @@ from lemarche.users.models import User
 from lemarche.utils.commands import BaseCommand
 
 
+UPSERT_BATCH_SIZE = 2000
+DELETE_BATCH_SIZE = 5000
+
+
+class CsvRowFile:
+    """
+    Read-only file-like object: the CSV lines of the rows, generated as they are read (by COPY),
+    so that the whole file is never kept in memory
+    """
+
+    def __init__(self, row_iterator):
+        self.row_iterator = row_iterator
+        self.row_count = 0
+        self.buffer = ""
+        self.line = io.StringIO()
+        self.writer = csv.writer(self.line)
+
+    def read_line(self):
+        row = next(self.row_iterator)
+        self.line.seek(0)
+        self.line.truncate()
+        self.writer.writerow([r"\N" if value is None else value for value in row])
+        self.row_count += 1
+        return self.line.getvalue()
+
+    def read(self, size=-1):
+        try:
+            while size < 0 or len(self.buffer) < size:
+                self.buffer += self.read_line()
+        except StopIteration:
+            pass
+        if size < 0:
+            size = len(self.buffer)
+        chunk, self.buffer = self.buffer[:size], self.buffer[size:]
+        return chunk
+
+
 class Command(BaseCommand):
     """
-    Import users from the app db to the stats db.
-    Before the insert we clean the table of users in stats db
+    Replicate the users of the app db to the stats db (StatsUser)
+
+    Incremental (default):
+    - only the users updated since the last replication (high-water mark: the max of StatsUser.updated_at)
+      are upserted (INSERT ... ON CONFLICT DO UPDATE), by large batches
+    - the users deleted in the app db are deleted from the stats db
+    Note: User.updated_at is only set on save(), the users updated with queryset.update() need a --full
+
+    If a batch of upserts fails (e.g. an email moved from one user to another), its users are upserted one by one,
+    and the run stops at the first user that still fails: the high-water mark never passes a user not replicated.
+
+    Full (--full): all the users are streamed (COPY) into a temporary table, then the StatsUser table
+    is emptied (TRUNCATE) and filled from it, in a single transaction: the table is never seen empty or partial,
+    and the views that depend on it are kept (the table is not dropped)
 
     Usage:
     poetry run python manage.py import_users_for_stats
-    poetry run python manage.py import_users_for_stats --clean
-    poetry run python manage.py import_users_for_stats --no-clean
+    poetry run python manage.py import_users_for_stats --full
     """
 
     def add_arguments(self, parser):
         parser.add_argument(
-            "-C",
-            "--clean",
-            action=argparse.BooleanOptionalAction,
-            default=True,
-            help="Effacer la table des utilisateurs la db de stat",
+            "--full", action="store_true", help="Recharger toute la table des utilisateurs de la db de stat"
         )
 
     def handle(self, *args, **options):
-        if options["clean"]:
-            self.stdout_success("-" * 80)
-            self.stdout_info("Step 0: clean user table in the stats db")
-            count_delete = self.clean_stats_users()
-            self.stdout_success(f"Deleted {count_delete} from the stats db")
-
-        self.stdout_info("Step 1: fetching download list of users")
-        users_list = self.fetch_users_list()
-        self.stdout_success(f"Found {len(users_list)} items")
-
-        self.stdout_info("Step 2: upload user list to stats db")
-        stats_users = self.upload_users_to_db_stats(users_list)
-        if stats_users:
-            self.stdout_success(f"Insert {len(stats_users)} items")
-
-        self.stdout_success("-" * 80)
-
-    def fetch_users_list(self):
-        users = User.objects.all()
-        list_stats_attrs = [field.name for field in StatsUser._meta.fields]
-        return users.values(*list_stats_attrs)
-
-    def upload_users_to_db_stats(self, users_list):
-        stats_users_list = [StatsUser(**params) for params in users_list]
+        start_time = time.perf_counter()
+        self.stats_fields = [field.name for field in StatsUser._meta.fields]
+
+        if options["full"]:
+            self.stdout_info("Full reload of the user table in the stats db")
+            count_copy = self.full_reload()
+            msg_list = [f"Copied {count_copy} users"]
+        else:
+            self.stdout_info("Step 1: upsert the users updated since the last replication")
+            count_upsert = self.upsert_updated_users()
+            self.stdout_info("Step 2: delete the users removed from the app db")
+            count_delete = self.delete_removed_users()
+            msg_list = [f"Upserted {count_upsert} users", f"Deleted {count_delete} users"]
+
+        self.stdout_messages_success(
+            [
+                "----- Stats users -----",
+                *msg_list,
+                f"Duration: {time.perf_counter() - start_time:.2f}s",
+            ]
+        )
+
+    def upsert_updated_users(self) -> int:
+        high_water_mark = StatsUser.objects.aggregate(Max("updated_at"))["updated_at__max"]
+        user_queryset = User.objects.all()
+        if high_water_mark:
+            # gte: the users updated at the same time as the last replicated one may not all have been replicated
+            user_queryset = user_queryset.filter(updated_at__gte=high_water_mark)
+        user_iterator = user_queryset.values(*self.stats_fields).order_by("updated_at").iterator(UPSERT_BATCH_SIZE)
+
+        count_upsert = 0
+        stats_user_batch = list()
+        for user in user_iterator:
+            stats_user_batch.append(StatsUser(**user))
+            if len(stats_user_batch) >= UPSERT_BATCH_SIZE:
+                count_upsert += self.upsert_stats_users(stats_user_batch)
+                stats_user_batch = list()
+        count_upsert += self.upsert_stats_users(stats_user_batch)
+        return count_upsert
+
+    def upsert_stats_users(self, stats_user_batch) -> int:
+        if not stats_user_batch:
+            return 0
         try:
-            return StatsUser.objects.bulk_create(stats_users_list, batch_size=50)
+            self.bulk_upsert(stats_user_batch)
         except IntegrityError as e:
-            self.stdout_error(str(e))
+            self.stdout_warning(f"Batch upsert failed, retrying user by user: {e}")
+            for stats_user in stats_user_batch:
+                try:
+                    self.bulk_upsert([stats_user])
+                except IntegrityError as e:
+                    # stop here: the next users would move the high-water mark past this one
+                    raise CommandError(f"User {stats_user.id} could not be replicated (run with --full): {e}")
+        return len(stats_user_batch)
+
+    def bulk_upsert(self, stats_user_list):
+        with transaction.atomic(using=router.db_for_write(StatsUser)):
+            StatsUser.objects.bulk_create(
+                stats_user_list,
+                update_conflicts=True,
+                unique_fields=["id"],
+                update_fields=[field for field in self.stats_fields if field != "id"],
+            )
 
-    def clean_stats_users(self):
-        count_delete, _ = StatsUser.objects.all().delete()
+    def delete_removed_users(self) -> int:
+        user_id_set = set(User.objects.values_list("id", flat=True))
+        removed_id_list = [
+            stats_user_id
+            for stats_user_id in StatsUser.objects.values_list("id", flat=True).iterator(DELETE_BATCH_SIZE)
+            if stats_user_id not in user_id_set
+        ]
+        count_delete = 0
+        for index in range(0, len(removed_id_list), DELETE_BATCH_SIZE):
+            count, _ = StatsUser.objects.filter(id__in=removed_id_list[index : index + DELETE_BATCH_SIZE]).delete()
+            count_delete += count
         return count_delete
+
+    def full_reload(self) -> int:
+        table_name = StatsUser._meta.db_table
+        shadow_table_name = f"{table_name}_new"
+        column_list = ", ".join(StatsUser._meta.get_field(field).column for field in self.stats_fields)
+
+        # CSV lines of all the users, streamed to COPY
+        csv_file = CsvRowFile(User.objects.values_list(*self.stats_fields).iterator(UPSERT_BATCH_SIZE))
+
+        using = router.db_for_write(StatsUser)
+        with transaction.atomic(using=using), connections[using].cursor() as cursor:
+            cursor.execute(f"DROP TABLE IF EXISTS {shadow_table_name}")
+            cursor.execute(
+                f"CREATE TEMPORARY TABLE {shadow_table_name} (LIKE {table_name} INCLUDING DEFAULTS) ON COMMIT DROP"
+            )
+            cursor.copy_expert(
+                f"COPY {shadow_table_name} ({column_list}) FROM STDIN WITH (FORMAT csv, NULL '\\N')", csv_file
+            )
+            # replace the content of the table: TRUNCATE locks it until the commit (the readers wait, then see
+            # the new users), and unlike a DROP/RENAME swap, the views that depend on the table still work
+            cursor.execute(f"TRUNCATE {table_name}")
+            cursor.execute(f"INSERT INTO {table_name} ({column_list}) SELECT {column_list} FROM {shadow_table_name}")
+        return csv_file.row_count
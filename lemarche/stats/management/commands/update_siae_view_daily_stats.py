@@ -0,0 +1,86 @@
+from datetime import datetime, time, timedelta
+
+from django.db.models import Count
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from lemarche.siaes.models import Siae
+from lemarche.stats.models import SiaeViewDailyStat, Tracker
+from lemarche.utils.commands import BaseCommand
+
+
+SIAE_DETAIL_PAGE_REGEX = r"^/prestataires/[^/]+/$"
+
+
+class Command(BaseCommand):
+    """
+    Goal: fill the SiaeViewDailyStat rollup from the Tracker events (Siae detail page views)
+
+    Incremental: starts from the last day already rolled up (recomputed, as it may have been partial),
+    or from 90 days ago if the rollup is empty.
+
+    Usage:
+    python manage.py update_siae_view_daily_stats
+    python manage.py update_siae_view_daily_stats --days 30
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int, default=None, help="Recalculer les X derniers jours")
+
+    def handle(self, *args, **options):
+        self.stdout_messages_info("Updating Siae view daily stats...")
+
+        # Step 1: the days to (re)compute
+        today = timezone.now().date()
+        if options["days"]:
+            start_day = today - timedelta(days=options["days"])
+        else:
+            last_day = SiaeViewDailyStat.objects.order_by("-day").values_list("day", flat=True).first()
+            start_day = last_day or (today - timedelta(days=90))
+        self.stdout_messages_info(f"From {start_day}")
+
+        # Step 2: aggregate the Tracker events by page, day & user_kind
+        tracker_stats = (
+            Tracker.objects.env_prod()
+            .filter(
+                action="load",
+                page__regex=SIAE_DETAIL_PAGE_REGEX,
+                date_created__gte=timezone.make_aware(datetime.combine(start_day, time.min)),
+            )
+            .annotate(day=TruncDate("date_created"))
+            .values("page", "day", "user_kind")
+            .annotate(view_count=Count("id_internal"))
+            .order_by()
+        )
+
+        # Step 3: map the pages (slugs) to the Siae ids (the Siae are in the other database)
+        tracker_stats = list(tracker_stats)
+        siae_slug_list = {tracker_stat["page"].split("/")[2] for tracker_stat in tracker_stats}
+        siae_id_by_slug = dict(Siae.objects.filter(slug__in=siae_slug_list).values_list("slug", "id"))
+
+        siae_view_daily_stats = dict()
+        for tracker_stat in tracker_stats:
+            siae_id = siae_id_by_slug.get(tracker_stat["page"].split("/")[2])
+            if siae_id:
+                key = (siae_id, tracker_stat["day"], tracker_stat["user_kind"] or "")
+                siae_view_daily_stats[key] = siae_view_daily_stats.get(key, 0) + tracker_stat["view_count"]
+
+        # Step 4: upsert
+        SiaeViewDailyStat.objects.bulk_create(
+            [
+                SiaeViewDailyStat(siae_id=siae_id, day=day, user_kind=user_kind, view_count=view_count)
+                for (siae_id, day, user_kind), view_count in siae_view_daily_stats.items()
+            ],
+            batch_size=1000,
+            update_conflicts=True,
+            unique_fields=["siae_id", "day", "user_kind"],
+            update_fields=["view_count"],
+        )
+
+        msg_success = [
+            "----- Siae view daily stats -----",
+            f"From {start_day}",
+            f"Pages found: {len(siae_slug_list)} / Siae found: {len(siae_id_by_slug)}",
+            f"Rows upserted: {len(siae_view_daily_stats)}",
+        ]
+        self.stdout_messages_success(msg_success)
@@ -0,0 +1,44 @@
+# Generated by Django 5.1.6 on 2026-10-18 13:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("stats", "0010_alter_tracker_siae_kind"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="SiaeViewDailyStat",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("siae_id", models.IntegerField(verbose_name="ID de la structure")),
+                ("day", models.DateField(verbose_name="Jour")),
+                (
+                    "user_kind",
+                    models.CharField(
+                        blank=True,
+                        choices=[
+                            ("SIAE", "Structure"),
+                            ("BUYER", "Acheteur"),
+                            ("PARTNER", "Partenaire"),
+                            ("INDIVIDUAL", "Particulier"),
+                            ("ADMIN", "Administrateur"),
+                        ],
+                        max_length=20,
+                        verbose_name="Type d'utilisateur",
+                    ),
+                ),
+                ("view_count", models.PositiveIntegerField(default=0, verbose_name="Nombre de vues")),
+            ],
+            options={
+                "db_table": "stats_siae_view_daily",
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("siae_id", "day", "user_kind"), name="stats_siae_view_daily_unique"
+                    )
+                ],
+            },
+        ),
+    ]
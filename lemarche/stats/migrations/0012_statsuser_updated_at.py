@@ -0,0 +1,17 @@
+# Generated by Django 5.1.6 on 2026-10-18 13:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("stats", "0011_siaeviewdailystat"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="statsuser",
+            name="updated_at",
+            field=models.DateTimeField(blank=True, null=True, verbose_name="Date de mise à jour"),
+        ),
+    ]
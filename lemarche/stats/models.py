@@ -54,6 +54,33 @@ class Tracker(models.Model):
         db_table = "trackers"
 
 
+class SiaeViewDailyStatQuerySet(models.QuerySet):
+    def last_3_months(self):
+        return self.filter(day__gte=(timezone.now() - timedelta(days=90)).date())
+
+
+class SiaeViewDailyStat(models.Model):
+    """
+    Daily rollup of the Siae detail page views (Tracker "load" events, prod env, without admins)
+    Filled by the update_siae_view_daily_stats command
+    """
+
+    siae_id = models.IntegerField(verbose_name="ID de la structure")
+    day = models.DateField(verbose_name="Jour")
+    user_kind = models.CharField(
+        verbose_name="Type d'utilisateur", max_length=20, choices=user_constants.KIND_CHOICES_WITH_ADMIN, blank=True
+    )
+    view_count = models.PositiveIntegerField(verbose_name="Nombre de vues", default=0)
+
+    objects = models.Manager.from_queryset(SiaeViewDailyStatQuerySet)()
+
+    class Meta:
+        db_table = "stats_siae_view_daily"
+        constraints = [
+            models.UniqueConstraint(fields=["siae_id", "day", "user_kind"], name="stats_siae_view_daily_unique"),
+        ]
+
+
 class StatsUser(models.Model):
     id = models.PositiveIntegerField(
         primary_key=True, auto_created=False, verbose_name="ID app leMarche", db_index=True
@@ -66,6 +93,8 @@ class StatsUser(models.Model):
     company_name = models.CharField(verbose_name="Nom de l'entreprise", max_length=255, blank=True)
     position = models.CharField(verbose_name="Poste", max_length=255, blank=True)
     partner_kind = models.CharField(verbose_name="Type de partenaire", max_length=20, blank=True)
+    # User.updated_at: high-water mark of the incremental replication (see import_users_for_stats)
+    updated_at = models.DateTimeField(verbose_name="Date de mise à jour", blank=True, null=True)
 
     class Meta:
         # avoid "stats_stats_user"
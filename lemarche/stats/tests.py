@@ -0,0 +1,239 @@
+import csv
+import re
+from datetime import timedelta
+from io import StringIO
+from unittest.mock import patch
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import SimpleTestCase, TestCase
+from django.utils import timezone
+
+from lemarche.siaes.factories import SiaeFactory
+from lemarche.stats.management.base_export_tracker import EXPORT_FIELDNAMES
+from lemarche.stats.management.commands.import_users_for_stats import CsvRowFile
+from lemarche.stats.management.commands.update_siae_view_daily_stats import SIAE_DETAIL_PAGE_REGEX
+from lemarche.stats.models import SiaeViewDailyStat, StatsUser, Tracker
+from lemarche.users import constants as user_constants
+from lemarche.users.factories import UserFactory
+from lemarche.users.models import User
+from lemarche.utils.tests_s3 import FakeS3Client
+
+
+class CsvRowFileTest(SimpleTestCase):
+    def test_read_by_chunks(self):
+        csv_file = CsvRowFile(iter([(1, "a,b", None), (2, "c", "d")]))
+        chunk_list = list()
+        while chunk := csv_file.read(5):
+            chunk_list.append(chunk)
+        self.assertTrue(all(len(chunk) <= 5 for chunk in chunk_list))
+        self.assertEqual("".join(chunk_list), '1,"a,b",\\N\r\n2,c,d\r\n')
+        self.assertEqual(csv_file.row_count, 2)
+
+
+class ImportUsersForStatsCommandTest(TestCase):
+    databases = {"default", "stats"}
+
+    def import_users(self, **kwargs):
+        call_command("import_users_for_stats", stdout=StringIO(), **kwargs)
+
+    def test_incremental_upsert_and_delete(self):
+        user_1, user_2 = UserFactory(), UserFactory()
+        self.import_users()
+        self.assertEqual(set(StatsUser.objects.values_list("id", flat=True)), {user_1.id, user_2.id})
+
+        # save() moves updated_at past the high-water mark
+        user_1.first_name = "Nouveau prénom"
+        user_1.save()
+        user_3 = UserFactory()
+        self.import_users()
+        self.assertEqual(StatsUser.objects.get(id=user_1.id).first_name, "Nouveau prénom")
+        self.assertTrue(StatsUser.objects.filter(id=user_3.id).exists())
+
+        # removed ids
+        user_3.delete()
+        self.import_users()
+        self.assertEqual(set(StatsUser.objects.values_list("id", flat=True)), {user_1.id, user_2.id})
+
+    def test_high_water_mark(self):
+        user = UserFactory()
+        self.import_users()
+        StatsUser.objects.filter(id=user.id).update(first_name="Modifié dans la db de stats")
+        # the users updated before the high-water mark are not upserted again
+        User.objects.filter(id=user.id).update(updated_at=user.updated_at - timedelta(days=1))
+        other_user = UserFactory()
+        self.import_users()
+        self.assertTrue(StatsUser.objects.filter(id=other_user.id).exists())
+        self.assertEqual(StatsUser.objects.get(id=user.id).first_name, "Modifié dans la db de stats")
+
+    def test_failing_batch_stops_at_the_failing_user(self):
+        user = UserFactory(email="deplace@example.com")
+        # the email already belongs to another (stale) user of the stats db
+        StatsUser.objects.create(id=user.id + 1000, email="deplace@example.com", first_name="", last_name="")
+        other_user = UserFactory()
+        User.objects.filter(id=other_user.id).update(updated_at=user.updated_at - timedelta(days=1))
+        with self.assertRaises(CommandError):
+            self.import_users()
+        # the users before the failing one are replicated, not the failing one
+        self.assertTrue(StatsUser.objects.filter(id=other_user.id).exists())
+        self.assertFalse(StatsUser.objects.filter(id=user.id).exists())
+
+    def test_full(self):
+        user_1, user_2 = UserFactory(), UserFactory()
+        StatsUser.objects.create(id=user_1.id + user_2.id, email="supprime@example.com", first_name="", last_name="")
+        User.objects.filter(id=user_2.id).update(last_name="Nouveau nom")
+        self.import_users(full=True)
+        self.assertEqual(set(StatsUser.objects.values_list("id", flat=True)), {user_1.id, user_2.id})
+        self.assertEqual(StatsUser.objects.get(id=user_2.id).last_name, "Nouveau nom")
+        self.assertEqual(StatsUser.objects.get(id=user_1.id).email, user_1.email)
+        # can be run again
+        self.import_users(full=True)
+        self.assertEqual(StatsUser.objects.count(), 2)
+
+
+class SiaeDetailPageRegexTest(SimpleTestCase):
+    def test_siae_detail_page_regex(self):
+        for page in ["/prestataires/ma-boite-38/", "/prestataires/1/"]:
+            self.assertRegex(page, SIAE_DETAIL_PAGE_REGEX)
+        for page in [
+            "/prestataires/",
+            "/prestataires/ma-boite-38",
+            "/prestataires/ma-boite-38/contact/",
+            "/fr/prestataires/ma-boite-38/",
+            "/prestataires/?kind=EI",
+        ]:
+            self.assertIsNone(re.search(SIAE_DETAIL_PAGE_REGEX, page))
+
+
+class UpdateSiaeViewDailyStatsCommandTest(TestCase):
+    databases = {"default", "stats"}
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.siae = SiaeFactory()
+        cls.siae_2 = SiaeFactory()
+
+    def create_tracker(self, page, days_ago=0, **kwargs):
+        kwargs = {"action": "load", "env": "prod", "user_kind": user_constants.KIND_BUYER, **kwargs}
+        return Tracker.objects.create(
+            version=1,
+            date_created=timezone.now() - timedelta(days=days_ago),
+            source="test",
+            page=page,
+            data={},
+            **kwargs,
+        )
+
+    def update_siae_view_daily_stats(self, **kwargs):
+        call_command("update_siae_view_daily_stats", stdout=StringIO(), **kwargs)
+
+    def test_views_are_rolled_up_by_siae_day_and_user_kind(self):
+        today = timezone.localdate()
+        page = f"/prestataires/{self.siae.slug}/"
+        self.create_tracker(page)
+        self.create_tracker(page)
+        self.create_tracker(page, user_kind=user_constants.KIND_PARTNER)
+        self.create_tracker(page, user_kind="")
+        self.create_tracker(page, days_ago=2)
+        self.create_tracker(f"/prestataires/{self.siae_2.slug}/")
+        # ignored
+        self.create_tracker(page, action="click")
+        self.create_tracker(page, env="dev")
+        self.create_tracker(page, isadmin=True)
+        self.create_tracker(f"/prestataires/{self.siae.slug}/contact/")
+        self.create_tracker("/prestataires/slug-inconnu/")
+        self.update_siae_view_daily_stats()
+        self.assertEqual(
+            set(SiaeViewDailyStat.objects.values_list("siae_id", "day", "user_kind", "view_count")),
+            {
+                (self.siae.id, today, user_constants.KIND_BUYER, 2),
+                (self.siae.id, today, user_constants.KIND_PARTNER, 1),
+                (self.siae.id, today, "", 1),
+                (self.siae.id, today - timedelta(days=2), user_constants.KIND_BUYER, 1),
+                (self.siae_2.id, today, user_constants.KIND_BUYER, 1),
+            },
+        )
+
+    def test_incremental_start_day_and_upsert(self):
+        today = timezone.localdate()
+        page = f"/prestataires/{self.siae.slug}/"
+        self.create_tracker(page, days_ago=3)
+        self.create_tracker(page)
+        self.update_siae_view_daily_stats()
+        self.assertEqual(SiaeViewDailyStat.objects.count(), 2)
+        # the last day rolled up is recomputed, the previous days are not
+        SiaeViewDailyStat.objects.filter(day=today - timedelta(days=3)).update(view_count=10)
+        self.create_tracker(page)
+        self.update_siae_view_daily_stats()
+        self.assertEqual(SiaeViewDailyStat.objects.count(), 2)
+        self.assertEqual(SiaeViewDailyStat.objects.get(day=today).view_count, 2)
+        self.assertEqual(SiaeViewDailyStat.objects.get(day=today - timedelta(days=3)).view_count, 10)
+        # --days recomputes the older days
+        self.update_siae_view_daily_stats(days=5)
+        self.assertEqual(SiaeViewDailyStat.objects.get(day=today - timedelta(days=3)).view_count, 1)
+
+    def test_empty_rollup_starts_90_days_ago(self):
+        page = f"/prestataires/{self.siae.slug}/"
+        self.create_tracker(page, days_ago=80)
+        self.create_tracker(page, days_ago=100)
+        self.update_siae_view_daily_stats()
+        self.assertEqual(SiaeViewDailyStat.objects.count(), 1)
+        self.assertGreater(SiaeViewDailyStat.objects.get().day, timezone.localdate() - timedelta(days=90))
+
+
+class ExportUserSearchListCommandTest(TestCase):
+    databases = {"default", "stats"}
+
+    def create_tracker(self, action="directory_search", env="prod", meta=None):
+        return Tracker.objects.create(
+            version=1,
+            date_created=timezone.now(),
+            env=env,
+            source="test",
+            page="/prestataires/",
+            action=action,
+            data={"meta": meta or {}},
+        )
+
+    @patch("lemarche.stats.management.base_export_tracker.boto3.resource")
+    def test_export_user_search_list(self, mock_boto3_resource):
+        user = UserFactory(first_name="Prénom", company_name="Entreprise")
+        SiaeFactory(users=[user])
+        tracker = self.create_tracker(
+            meta={
+                "user_id": user.id,
+                "sectors": ["espaces-verts", "nettoyage"],
+                "perimeter_name": ["Grenoble (38)"],
+                "results_count": 12,
+                "page": ["2"],
+                "cmp": "newsletter",
+            }
+        )
+        # anonymous
+        anonymous_tracker = self.create_tracker(meta={"kind": ["EI"]})
+        # not exported
+        self.create_tracker(env="dev")
+        self.create_tracker(action="directory_csv")
+
+        client = FakeS3Client()
+        with patch("lemarche.utils.s3.boto3.client", return_value=client):
+            call_command("export_user_search_list", stdout=StringIO())
+
+        self.assertIsNotNone(client.completed)
+        row_list = list(csv.DictReader(b"".join(client.part_list).decode("utf-8").splitlines()))
+        self.assertEqual(list(row_list[0].keys()), EXPORT_FIELDNAMES)
+        self.assertEqual(
+            [row["stats_id"] for row in row_list], [str(tracker.id_internal), str(anonymous_tracker.id_internal)]
+        )
+        self.assertEqual(row_list[0]["search_sectors"], "espaces-verts, nettoyage")
+        self.assertEqual(row_list[0]["search_perimeter_name"], "Grenoble (38)")
+        self.assertEqual(row_list[0]["search_results_count"], "12")
+        self.assertEqual(row_list[0]["search_page"], "2")
+        self.assertEqual(row_list[0]["user_first_name"], "Prénom")
+        self.assertEqual(row_list[0]["user_company_name"], "Entreprise")
+        self.assertEqual(row_list[0]["user_siae_count"], "1")
+        self.assertEqual(row_list[0]["cmp"], "newsletter")
+        self.assertEqual(row_list[1]["search_kind"], "EI")
+        self.assertEqual(row_list[1]["user_email"], "")
+        # the previous export is deleted
+        mock_boto3_resource.return_value.Bucket.return_value.objects.filter.return_value.delete.assert_called_once()
@@ -13,7 +13,7 @@ from django.utils.html import format_html
 from django_admin_filters import MultiChoice
 from django_better_admin_arrayfield.admin.mixins import DynamicArrayMixin
 
-from lemarche.conversations.models import TemplateTransactionalSendLog
+from lemarche.conversations.models import TemplateTransactionalSendCounter, TemplateTransactionalSendLog
 from lemarche.notes.models import Note
 from lemarche.perimeters.admin import PerimeterRegionFilter
 from lemarche.perimeters.models import Perimeter
@@ -804,7 +804,10 @@ class TenderAdmin(FieldsetsInlineMixin, admin.ModelAdmin):
 
     def parent_transactional_send_logs_count_with_link(self, obj):
         url = reverse("admin:conversations_templatetransactionalsendlog_changelist") + f"?tender__id__exact={obj.id}"
-        return format_html(f'<a href="{url}">{obj.parent_transactional_send_logs.count()}</a>')
+        send_count = TemplateTransactionalSendCounter.objects.get_count(
+            obj, TemplateTransactionalSendCounter.ROLE_PARENT
+        )
+        return format_html(f'<a href="{url}">{send_count}</a>')
 
     parent_transactional_send_logs_count_with_link.short_description = TemplateTransactionalSendLog._meta.verbose_name
 
@@ -1076,7 +1079,10 @@ class TenderSiaeAdmin(admin.ModelAdmin):
         url = (
             reverse("admin:conversations_templatetransactionalsendlog_changelist") + f"?tendersiae__id__exact={obj.id}"
         )
-        return format_html(f'<a href="{url}">{obj.parent_transactional_send_logs.count()}</a>')
+        send_count = TemplateTransactionalSendCounter.objects.get_count(
+            obj, TemplateTransactionalSendCounter.ROLE_PARENT
+        )
+        return format_html(f'<a href="{url}">{send_count}</a>')
 
     parent_transactional_send_logs_count_with_link.short_description = TemplateTransactionalSendLog._meta.verbose_name
 
@@ -0,0 +1,68 @@
+import statistics
+from timeit import default_timer as timer
+
+from lemarche.siaes.models import Siae
+from lemarche.tenders.models import Tender
+from lemarche.utils.commands import BaseCommand
+
+
+class Command(BaseCommand):
+    """
+    Goal: compare the Tender-Siae matching through the SiaeActivityMatchIndex with the ORM matching
+    (Siae.objects.filter_with_tender_through_activities), on real data
+
+    Read-only: the TenderSiae are not modified.
+
+    Usage:
+    python manage.py benchmark_tender_matching
+    python manage.py benchmark_tender_matching --limit 50
+    python manage.py benchmark_tender_matching --id 1
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument("--id", type=int, default=None, help="Indiquer l'ID d'un besoin")
+        parser.add_argument("--limit", type=int, default=20, help="Nombre de besoins (les plus récents)")
+
+    def handle(self, *args, **options):
+        self.stdout_messages_info("Benchmarking Tender matching...")
+
+        tender_queryset = Tender.objects.sent().select_related("location").order_by("-first_sent_at")
+        if options["id"]:
+            tender_queryset = tender_queryset.filter(id=options["id"])
+        tender_queryset = tender_queryset[: options["limit"]]
+
+        orm_duration_list, index_duration_list = [], []
+        mismatch_list = []
+        for tender in tender_queryset:
+            start_time = timer()
+            orm_siae_id_set = set(
+                Siae.objects.filter_with_tender_through_activities(tender).values_list("id", flat=True)
+            )
+            orm_duration_list.append(timer() - start_time)
+
+            start_time = timer()
+            index_siae_id_set = set(
+                Siae.objects.filter_with_tender_through_activity_match_index(tender).values_list("id", flat=True)
+            )
+            index_duration_list.append(timer() - start_time)
+
+            if orm_siae_id_set != index_siae_id_set:
+                mismatch_list.append(
+                    f"Tender {tender.id}: {len(orm_siae_id_set - index_siae_id_set)} missing, "
+                    f"{len(index_siae_id_set - orm_siae_id_set)} extra"
+                )
+
+        if not orm_duration_list:
+            self.stdout_warning("No tender found")
+            return
+
+        msg_success = [
+            "----- Tender matching benchmark -----",
+            f"Tenders: {len(orm_duration_list)}",
+            f"ORM: median {statistics.median(orm_duration_list):.3f}s / max {max(orm_duration_list):.3f}s",
+            f"Index: median {statistics.median(index_duration_list):.3f}s / max {max(index_duration_list):.3f}s",
+            f"Mismatches: {len(mismatch_list)}",
+        ]
+        self.stdout_messages_success(msg_success)
+        for mismatch in mismatch_list:
+            self.stdout_error(mismatch)
@@ -0,0 +1,65 @@
+import time
+
+from lemarche.siaes.models import SiaeActivity, SiaeChange, SiaeChangeCursor
+from lemarche.tenders.models import Tender
+from lemarche.utils.commands import BaseCommand
+
+
+class Command(BaseCommand):
+    """
+    Reverse matching: the SiaeActivity created or updated recently are matched against the live Tenders
+    (sent & not outdated), and the new Siae found are linked to them (the validated_sent_batch will contact them)
+
+    The recent activities are found through the SiaeChange log (an activity change saves its Siae,
+    the sectors & locations changes are logged too). Each run reads the changes after the last change
+    processed by the previous run (SiaeChangeCursor), so the changes made between two runs
+    (nights, week-ends) are never missed. The Siae already linked to a Tender are skipped.
+
+    Note: run via a CRON, a few minutes before send_validated_tenders
+    "55 7-14 * * 1-5" = Every hour from 7:55am through 2:55pm, Monday through Friday
+
+    Usage:
+    python manage.py match_updated_siae_activities_with_live_tenders
+    python manage.py match_updated_siae_activities_with_live_tenders --since 0 (replay the whole log)
+    """
+
+    CURSOR_NAME = "match_updated_siae_activities_with_live_tenders"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--since", type=int, default=None, help="ID du changement à partir duquel repartir (défaut : le curseur)"
+        )
+
+    def handle(self, *args, **options):
+        start_time = time.perf_counter()
+        self.stdout_messages_info("Matching the updated Siae activities with the live tenders...")
+
+        cursor, _ = SiaeChangeCursor.objects.get_or_create(name=self.CURSOR_NAME)
+        since = cursor.last_change_id if options["since"] is None else options["since"]
+
+        change_list = list(SiaeChange.objects.since(since).values_list("id", "siae_id", "kind"))
+        updated_siae_id_set = {siae_id for (_, siae_id, kind) in change_list if kind == SiaeChange.KIND_UPDATE}
+        siae_activity_id_list = list(
+            SiaeActivity.objects.filter(siae_id__in=updated_siae_id_set).values_list("id", flat=True)
+        )
+        tender_queryset = Tender.objects.is_live()
+        self.stdout_info(
+            f"Found {len(change_list)} changes since {since}: {len(siae_activity_id_list)} updated activities, "
+            f"{tender_queryset.count()} tenders"
+        )
+
+        tendersiae_count = tender_queryset.add_siae_found_list_for_siae_activities(siae_activity_id_list)
+
+        # only once the changes are processed: a failed run is retried by the next one
+        if change_list:
+            cursor.last_change_id = change_list[-1][0]
+            cursor.save()
+
+        self.stdout_messages_success(
+            [
+                "----- Reverse matching -----",
+                f"Done! {tendersiae_count} new Tender-Siae links",
+                f"Cursor: {cursor.last_change_id}",
+                f"Duration: {time.perf_counter() - start_time:.2f}s",
+            ]
+        )
@@ -1,7 +1,12 @@
-from django.core.management.base import BaseCommand
+import time
 
 from lemarche.tenders.models import Tender
-from lemarche.www.tenders.tasks import send_validated_sent_batch_tender, send_validated_tender
+from lemarche.utils.commands import BaseCommand
+from lemarche.www.tenders.tasks import (
+    send_validated_sent_batch_tender,
+    send_validated_tender,
+    send_validated_tender_task,
+)
 
 
 class Command(BaseCommand):
@@ -14,16 +19,33 @@ class Command(BaseCommand):
     - why 8am and not 9am? because the server has UTC time
     - why 3pm and not 5pm? because UTC + will run until 15h55 included
 
-    Usage: python manage.py send_validated_tenders
+    --dispatch: each tender is enqueued as an independent huey task (with a lock per tender),
+    so that the huey workers can send them concurrently
+
+    Usage:
+    python manage.py send_validated_tenders
+    python manage.py send_validated_tenders --dispatch
     """
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--dispatch", dest="dispatch", action="store_true", help="Envoyer chaque besoin dans une tâche huey"
+        )
+
     def handle(self, *args, **options):
+        start_time = time.perf_counter()
+        tender_count = 0
+
         # First send newly validated tenders
         validated_tenders_to_send = Tender.objects.validated_but_not_sent().is_not_outdated()
         if validated_tenders_to_send.count():
             self.stdout.write(f"Found {validated_tenders_to_send.count()} validated tender(s) to send")
             for tender in validated_tenders_to_send:
-                send_validated_tender(tender)
+                if options["dispatch"]:
+                    send_validated_tender_task(tender.id)
+                else:
+                    send_validated_tender(tender)
+                tender_count += 1
 
         # Then look at already sent tenders (batch mode)
         validated_sent_tenders_batch_to_send = Tender.objects.validated_sent_batch().is_not_outdated()
@@ -32,4 +54,19 @@ class Command(BaseCommand):
                 f"Found {validated_sent_tenders_batch_to_send.count()} validated sent tender(s) to batch"
             )
             for tender in validated_sent_tenders_batch_to_send:
-                send_validated_sent_batch_tender(tender)
+                if options["dispatch"]:
+                    send_validated_tender_task(tender.id, batch=True)
+                else:
+                    send_validated_sent_batch_tender(tender)
+                tender_count += 1
+
+        if tender_count:
+            duration = time.perf_counter() - start_time
+            # --dispatch: only the enqueue is measured here, the tenders are sent by the huey workers
+            msg_action, msg_rate = ("enqueued", "Enqueue rate") if options["dispatch"] else ("sent", "Send rate")
+            self.stdout_messages_success(
+                [
+                    f"{tender_count} tender(s) {msg_action} in {duration:.2f}s",
+                    f"{msg_rate}: {tender_count / duration:.2f} tender(s)/s",
+                ]
+            )
@@ -103,6 +103,37 @@ class TenderQuerySet(models.QuerySet):
     def is_live(self):
         return self.sent().is_not_outdated()
 
+    def add_siae_found_list_for_siae_activities(self, siae_activity_id_list) -> int:
+        """
+        Reverse matching: only these (new or updated) SiaeActivity are matched against the Tenders,
+        the Siae found are linked to the Tenders (in bulk), the Siae already linked are left untouched.
+        Returns the number of TenderSiae created
+        """
+        if not siae_activity_id_list:
+            return 0
+        siae_found_id_set_by_tender_id = dict()
+        for tender in self.select_related("location").prefetch_related("perimeters"):
+            siae_found_id_set_by_tender_id[tender.id] = set(
+                Siae.objects.filter_with_tender_through_activity_match_index(
+                    tender, siae_activity_id_list
+                ).values_list("id", flat=True)
+            )
+
+        existing_tender_siae_id_set = set(
+            TenderSiae.objects.filter(
+                tender_id__in=siae_found_id_set_by_tender_id.keys(),
+                siae_id__in=set().union(*siae_found_id_set_by_tender_id.values()),
+            ).values_list("tender_id", "siae_id")
+        )
+        tendersiae_list = [
+            TenderSiae(tender_id=tender_id, siae_id=siae_id)
+            for tender_id, siae_found_id_set in siae_found_id_set_by_tender_id.items()
+            for siae_id in siae_found_id_set
+            if (tender_id, siae_id) not in existing_tender_siae_id_set
+        ]
+        TenderSiae.objects.bulk_create(tendersiae_list, batch_size=1000)
+        return len(tendersiae_list)
+
     def has_amount(self):
         return self.filter(Q(amount__isnull=False) | Q(amount_exact__isnull=False)).annotate(
             has_amount_exact=Case(
@@ -768,8 +799,9 @@ class Tender(models.Model):
     def set_siae_found_list(self):
         """
         Where the Tender-Siae matching magic happens!
+        (through the SiaeActivityMatchIndex, see Siae.objects.filter_with_tender_through_activities for the reference)
         """
-        siae_found_list = Siae.objects.filter_with_tender_through_activities(self)
+        siae_found_list = Siae.objects.filter_with_tender_through_activity_match_index(self)
         self.siaes.set(siae_found_list, clear=False)
 
     def save(self, *args, **kwargs):
@@ -3,12 +3,15 @@ from io import StringIO
 from unittest.mock import patch
 
 from django.core.management import call_command
-from django.test import TestCase
+from django.test import TestCase, override_settings
 from django.utils import timezone
+from huey.contrib.djhuey import lock_task
 
+from lemarche.perimeters.factories import PerimeterFactory
 from lemarche.sectors.factories import SectorFactory
 from lemarche.siaes import constants as siae_constants
 from lemarche.siaes.factories import SiaeActivityFactory, SiaeFactory
+from lemarche.siaes.models import SiaeChange, SiaeChangeCursor
 from lemarche.tenders import constants as tender_constants
 from lemarche.tenders.factories import TenderFactory
 from lemarche.tenders.models import TenderSiae
@@ -221,3 +224,81 @@ class UpdateTenderStatusToRejectedCommandTest(TestCase):
         self.assertEqual(tender_recent.status, tender_constants.STATUS_DRAFT)
         self.assertEqual(tender_expired.status, tender_constants.STATUS_REJECTED)
         self.assertEqual(tender_with_no_modification_request.status, tender_constants.STATUS_DRAFT)
+
+
+class SendValidatedTendersCommandTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.tender = TenderFactory(
+            status=tender_constants.STATUS_VALIDATED,
+            validated_at=timezone.now(),
+            deadline_date=timezone.now().date() + timedelta(days=10),
+        )
+
+    # the command module binds send_validated_tender at import: patch it there
+    @patch("lemarche.tenders.management.commands.send_validated_tenders.send_validated_tender")
+    def test_send_validated_tenders(self, mock_send_validated_tender):
+        out = StringIO()
+        call_command("send_validated_tenders", stdout=out)
+        mock_send_validated_tender.assert_called_once()
+        self.assertIn("1 tender(s) sent", out.getvalue())
+        self.assertIn("Send rate", out.getvalue())
+
+    # with --dispatch, send_validated_tender is called by the huey task (immediate mode), in the tasks module
+    @patch("lemarche.tenders.management.commands.send_validated_tenders.send_validated_tender")
+    @patch("lemarche.www.tenders.tasks.send_validated_tender")
+    def test_send_validated_tenders_dispatch(self, mock_send_validated_tender, mock_command_send_validated_tender):
+        out = StringIO()
+        call_command("send_validated_tenders", dispatch=True, stdout=out)
+        mock_command_send_validated_tender.assert_not_called()
+        mock_send_validated_tender.assert_called_once()
+        self.assertEqual(mock_send_validated_tender.call_args.args[0].id, self.tender.id)
+        self.assertIn("1 tender(s) enqueued", out.getvalue())
+        self.assertIn("Enqueue rate", out.getvalue())
+
+    @patch("lemarche.www.tenders.tasks.send_validated_tender")
+    def test_send_validated_tenders_dispatch_locked(self, mock_send_validated_tender):
+        # the tender is already being sent by another worker
+        with lock_task(f"send-tender-{self.tender.id}"):
+            call_command("send_validated_tenders", dispatch=True, stdout=StringIO())
+        mock_send_validated_tender.assert_not_called()
+
+
+# the changes are read without the delay of the API change feed
+@override_settings(API_SIAE_CHANGES_DELAY=0)
+class MatchUpdatedSiaeActivitiesWithLiveTendersCommandTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.sector = SectorFactory()
+        cls.perimeter_paris = PerimeterFactory(department_code="75", post_codes=["75019", "75018"])
+        cls.tender = TenderFactory(presta_type=[], sectors=[cls.sector], perimeters=[cls.perimeter_paris])
+
+    def test_new_siae_activity_is_matched_with_live_tender(self):
+        siae = SiaeFactory(is_active=True, kind=siae_constants.KIND_ESAT, department="75", post_code="75018")
+        siae_activity = SiaeActivityFactory(
+            siae=siae, presta_type=[siae_constants.PRESTA_BUILD], geo_range=siae_constants.GEO_RANGE_ZONES
+        )
+        siae_activity.sectors.add(self.sector)
+        self.assertFalse(self.tender.siaes.exists())
+
+        call_command("match_updated_siae_activities_with_live_tenders", stdout=StringIO())
+        self.assertEqual(list(self.tender.siaes.all()), [siae])
+        self.assertEqual(TenderSiae.objects.get(tender=self.tender, siae=siae).email_send_date, None)
+
+    def test_changes_are_read_from_the_cursor(self):
+        siae = SiaeFactory(is_active=True, kind=siae_constants.KIND_ESAT, department="75", post_code="75018")
+        call_command("match_updated_siae_activities_with_live_tenders", stdout=StringIO())
+        cursor = SiaeChangeCursor.objects.get(name="match_updated_siae_activities_with_live_tenders")
+        self.assertEqual(cursor.last_change_id, SiaeChange.objects.last().id)
+        self.assertFalse(self.tender.siaes.exists())
+
+        # an old change (e.g. during the night), after the cursor: still matched
+        siae_activity = SiaeActivityFactory(
+            siae=siae, presta_type=[siae_constants.PRESTA_BUILD], geo_range=siae_constants.GEO_RANGE_ZONES
+        )
+        siae_activity.sectors.add(self.sector)
+        SiaeChange.objects.filter(id__gt=cursor.last_change_id).update(created_at=timezone.now() - timedelta(days=3))
+        call_command("match_updated_siae_activities_with_live_tenders", stdout=StringIO())
+        self.assertEqual(list(self.tender.siaes.all()), [siae])
+        cursor.refresh_from_db()
+        self.assertEqual(cursor.last_change_id, SiaeChange.objects.last().id)
@@ -1,4 +1,6 @@
+from datetime import date, timedelta
 from timeit import default_timer as timer
+from unittest.mock import patch
 
 from django.contrib.gis.geos import Point
 from django.test import TestCase
@@ -8,8 +10,9 @@ from lemarche.perimeters.models import Perimeter
 from lemarche.sectors.factories import SectorFactory
 from lemarche.siaes import constants as siae_constants
 from lemarche.siaes.factories import SiaeActivityFactory, SiaeFactory
-from lemarche.siaes.models import Siae, SiaeActivity
+from lemarche.siaes.models import Siae, SiaeActivity, SiaeQuerySet
 from lemarche.tenders.factories import TenderFactory
+from lemarche.tenders.models import Tender
 
 
 class TenderMatchingActivitiesTest(TestCase):
@@ -402,3 +405,86 @@ class TenderMatchingActivitiesTest(TestCase):
         end_time = timer()
         duration = end_time - start_time
         self.assertLess(duration, 0.5, f"Performance issue: took {duration:.4f} seconds")
+
+
+class TenderMatchingActivityMatchIndexTest(TenderMatchingActivitiesTest):
+    """
+    Same tests, but the matching goes through the SiaeActivityMatchIndex
+    """
+
+    def setUp(self):
+        self.patcher = patch.object(
+            SiaeQuerySet,
+            "filter_with_tender_through_activities",
+            SiaeQuerySet.filter_with_tender_through_activity_match_index,
+        )
+        self.patcher.start()
+        self.addCleanup(self.patcher.stop)
+
+    def test_performance(self):
+        # create 100 siaes with 10 activities each
+        for i in range(100):
+            siae = SiaeFactory(is_active=True, coords=Point(48.86385199985207, 2.337071483848432))
+            for j in range(10):
+                siae_activity = SiaeActivityFactory(
+                    siae=siae,
+                    sector_group=self.sectors[j % 10].group,
+                    presta_type=[siae_constants.PRESTA_PREST, siae_constants.PRESTA_BUILD],
+                    with_zones_perimeter=True,
+                )
+                siae_activity.locations.set([self.perimeter_paris])
+                siae_activity.sectors.add(self.sectors[j % 10])
+
+        tender = TenderFactory(sectors=self.sectors, perimeters=self.perimeters)
+
+        start_time = timer()
+        siae_found_list = list(Siae.objects.filter_with_tender_through_activity_match_index(tender))
+        index_duration = timer() - start_time
+
+        self.patcher.stop()
+        start_time = timer()
+        siae_found_list_orm = list(Siae.objects.filter_with_tender_through_activities(tender))
+        orm_duration = timer() - start_time
+
+        self.assertEqual(len(siae_found_list), 100 + 3)
+        self.assertEqual(set(siae_found_list), set(siae_found_list_orm))
+        self.assertLess(
+            index_duration, 0.5, f"Performance issue: took {index_duration:.4f} seconds (ORM: {orm_duration:.4f})"
+        )
+
+
+class TenderReverseMatchingTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.sector = SectorFactory()
+        cls.other_sector = SectorFactory()
+        cls.perimeter_paris = PerimeterFactory(department_code="75", post_codes=["75019", "75018"])
+        cls.tender = TenderFactory(presta_type=[], sectors=[cls.sector], perimeters=[cls.perimeter_paris])
+        cls.tender_outdated = TenderFactory(
+            presta_type=[],
+            sectors=[cls.sector],
+            perimeters=[cls.perimeter_paris],
+            deadline_date=date.today() - timedelta(days=1),
+        )
+
+    def create_siae_with_activity(self, sector):
+        siae = SiaeFactory(is_active=True, kind=siae_constants.KIND_ESAT, department="75", post_code="75018")
+        siae_activity = SiaeActivityFactory(
+            siae=siae,
+            sector_group=sector.group,
+            presta_type=[siae_constants.PRESTA_BUILD],
+            geo_range=siae_constants.GEO_RANGE_ZONES,
+        )
+        siae_activity.sectors.add(sector)
+        return siae, siae_activity
+
+    def test_add_siae_found_list_for_siae_activities(self):
+        siae, siae_activity = self.create_siae_with_activity(self.sector)
+        _, other_siae_activity = self.create_siae_with_activity(self.other_sector)
+        siae_activity_id_list = [siae_activity.id, other_siae_activity.id]
+        self.assertEqual(Tender.objects.is_live().add_siae_found_list_for_siae_activities(siae_activity_id_list), 1)
+        self.assertEqual(list(self.tender.siaes.all()), [siae])
+        self.assertFalse(self.tender_outdated.siaes.exists())
+        # the Siae already linked are left untouched
+        self.assertEqual(Tender.objects.is_live().add_siae_found_list_for_siae_activities(siae_activity_id_list), 0)
+        self.assertEqual(self.tender.tendersiae_set.count(), 1)
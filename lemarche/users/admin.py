@@ -13,7 +13,7 @@ from django.template.response import TemplateResponse
 from django.urls import path, reverse
 from django.utils.html import format_html
 
-from lemarche.conversations.models import TemplateTransactionalSendLog
+from lemarche.conversations.models import TemplateTransactionalSendCounter, TemplateTransactionalSendLog
 from lemarche.notes.models import Note
 from lemarche.siaes.models import Siae, SiaeUser
 from lemarche.users.forms import UserChangeForm, UserCreationForm
@@ -455,7 +455,10 @@ class UserAdmin(FieldsetsInlineMixin, UserAdmin):
 
     def recipient_transactional_send_logs_count_with_link(self, obj):
         url = reverse("admin:conversations_templatetransactionalsendlog_changelist") + f"?user__id__exact={obj.id}"
-        return format_html(f'<a href="{url}">{obj.recipient_transactional_send_logs.count()}</a>')
+        send_count = TemplateTransactionalSendCounter.objects.get_count(
+            obj, TemplateTransactionalSendCounter.ROLE_RECIPIENT
+        )
+        return format_html(f'<a href="{url}">{send_count}</a>')
 
     recipient_transactional_send_logs_count_with_link.short_description = (
         TemplateTransactionalSendLog._meta.verbose_name
@@ -0,0 +1,21 @@
+from django.core.management import call_command
+from django.db import migrations
+
+
+def create_cache_table(apps, schema_editor):
+    # creates the tables of every DatabaseCache in settings.CACHES (already created tables are skipped)
+    call_command("createcachetable", database=schema_editor.connection.alias)
+
+
+class Migration(migrations.Migration):
+    """
+    Create the caching table of the geocoding cache (settings.CACHES["geocoding"]), see 0014_create_cache_table
+    """
+
+    dependencies = [
+        ("users", "0045_user_is_onboarded"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_cache_table, migrations.RunPython.noop),
+    ]
@@ -1,3 +1,4 @@
+import functools
 import json
 import logging
 import time
@@ -17,6 +18,11 @@ logger = logging.getLogger(__name__)
 
 ENV_NOT_ALLOWED = ("dev", "test")
 
+# Brevo: at most 2000 recipients per send_transac_email request (one recipient per message version)
+MESSAGE_VERSIONS_BATCH_SIZE = 1000
+# a rejected batch is split in two at most this many times (enough to isolate a version among 1000)
+MESSAGE_VERSIONS_MAX_SPLIT_DEPTH = 12
+
 
 def get_config():
     config = sib_api_v3_sdk.Configuration()
@@ -29,6 +35,15 @@ def get_api_client():
     return sib_api_v3_sdk.ApiClient(config)
 
 
+@functools.cache
+def get_transactional_emails_api():
+    """
+    Shared by all the transactional sends of the process:
+    its ApiClient keeps a pool of HTTPS connections (urllib3), no new handshake per email
+    """
+    return sib_api_v3_sdk.TransactionalEmailsApi(get_api_client())
+
+
 def create_contact(user, list_id: int, tender=None):
     """
     Brevo docs
@@ -367,8 +382,7 @@ def send_transactional_email_with_template(
     from_email=settings.DEFAULT_FROM_EMAIL,
     from_name=settings.DEFAULT_FROM_NAME,
 ):
-    api_client = get_api_client()
-    api_instance = sib_api_v3_sdk.TransactionalEmailsApi(api_client)
+    api_instance = get_transactional_emails_api()
     data = {
         "sender": {"email": from_email, "name": from_name},
         "to": [{"email": recipient_email, "name": recipient_name}],
@@ -390,3 +404,103 @@ def send_transactional_email_with_template(
             print(f"Exception when calling SMTPApi->send_transac_email: {e}")
     else:
         logger.info("Brevo: email not sent (DEV or TEST environment detected)")
+
+
+def send_message_versions(
+    data: dict, message_version_list: list, depth=0, is_request_valid=False, has_failed_alone=False
+) -> list:
+    """
+    Send the message versions in one send_transac_email request.
+    Brevo rejects the whole request (400) if one version is invalid (e.g. a wrong email), or if the request itself
+    is invalid (template, sender, subject...):
+    - first, a single version is sent alone: if it is accepted, the request itself is valid,
+      and the other versions are split in two, until the faulty versions are isolated
+      (at most MESSAGE_VERSIONS_MAX_SPLIT_DEPTH times)
+    - if it is rejected too, the other versions are still sent (the version may only have a wrong email);
+      only if a second version is rejected alone, the request itself is considered invalid,
+      and the remaining versions are not retried (a few requests instead of ~2N)
+    The other errors (e.g. a timeout) only fail the versions of this request.
+
+    Returns one result per message version (same order): {"message_id": ...} or {"error": ...}
+    """
+    try:
+        send_smtp_email = sib_api_v3_sdk.SendSmtpEmail(**data, message_versions=message_version_list)
+        response = get_transactional_emails_api().send_transac_email(send_smtp_email)
+    except ApiException as e:
+        error_result_list = [{"error": f"{e.status} {e.reason}: {e.body}"}] * len(message_version_list)
+        if e.status != 400 or len(message_version_list) == 1 or depth >= MESSAGE_VERSIONS_MAX_SPLIT_DEPTH:
+            return error_result_list
+        if not is_request_valid:
+            first_result_list = send_message_versions(data, message_version_list[:1], depth + 1)
+            if "error" not in first_result_list[0]:
+                return first_result_list + send_message_versions(
+                    data, message_version_list[1:], depth + 1, is_request_valid=True
+                )
+            if has_failed_alone:
+                return first_result_list + error_result_list[1:]
+            return first_result_list + send_message_versions(
+                data, message_version_list[1:], depth + 1, has_failed_alone=True
+            )
+        middle = len(message_version_list) // 2
+        return send_message_versions(
+            data, message_version_list[:middle], depth + 1, is_request_valid=True
+        ) + send_message_versions(data, message_version_list[middle:], depth + 1, is_request_valid=True)
+    except Exception as e:
+        # e.g. a timeout (urllib3): the versions of the other requests are not affected
+        return [{"error": f"{e.__class__.__name__}: {e}"}] * len(message_version_list)
+
+    message_id_list = response.message_ids or [response.message_id]
+    if len(message_id_list) != len(message_version_list):
+        # the emails are accepted: the results of the other batches must not be lost
+        logger.error(
+            f"Brevo returned {len(message_id_list)} message ids for {len(message_version_list)} message versions"
+        )
+        message_id_list = (message_id_list + [None] * len(message_version_list))[: len(message_version_list)]
+    return [{"message_id": message_id} for message_id in message_id_list]
+
+
+@task()
+def send_transactional_email_batch_with_template(
+    template_id: int,
+    recipient_list: list,
+    subject=None,
+    from_email=settings.DEFAULT_FROM_EMAIL,
+    from_name=settings.DEFAULT_FROM_NAME,
+):
+    """
+    Same as send_transactional_email_with_template, for several recipients of the same template:
+    one request per MESSAGE_VERSIONS_BATCH_SIZE recipients (Brevo "messageVersions"), over the shared client
+
+    recipient_list: dicts with the recipient_email, recipient_name & variables of each recipient
+    Returns one result per recipient (see send_message_versions), the errors are logged
+    """
+    data = {
+        "sender": {"email": from_email, "name": from_name},
+        "template_id": template_id,
+    }
+    # if subject empty, defaults to Brevo's template subject
+    if subject:
+        data["subject"] = EMAIL_SUBJECT_PREFIX + subject
+
+    if settings.BITOUBI_ENV in ENV_NOT_ALLOWED:
+        logger.info("Brevo: emails not sent (DEV or TEST environment detected)")
+        return []
+
+    result_list = list()
+    for index in range(0, len(recipient_list), MESSAGE_VERSIONS_BATCH_SIZE):
+        message_version_list = [
+            {
+                "to": [{"email": recipient["recipient_email"], "name": recipient["recipient_name"]}],
+                "params": recipient["variables"],
+            }
+            for recipient in recipient_list[index : index + MESSAGE_VERSIONS_BATCH_SIZE]
+        ]
+        result_list += send_message_versions(data, message_version_list)
+
+    error_count = 0
+    for recipient, result in zip(recipient_list, result_list):
+        if "error" in result:
+            error_count += 1
+            logger.error(f"Brevo: transactional email to {recipient['recipient_email']} not sent: {result['error']}")
+    logger.info(f"Brevo: send transactional email batch with template ({len(recipient_list)}, {error_count} errors)")
+    return result_list
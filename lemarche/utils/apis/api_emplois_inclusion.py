@@ -1,4 +1,6 @@
+import json
 import logging
+import os
 import time
 
 import requests
@@ -11,25 +13,152 @@ logger = logging.getLogger(__name__)
 # Doc : https://emplois.inclusion.beta.gouv.fr/api/v1/redoc/#tag/marche/operation/marche_list
 API_ENDPOINT = f"{settings.API_EMPLOIS_INCLUSION_URL}/marche"
 API_HEADERS = {"Authorization": f"Token {settings.API_EMPLOIS_INCLUSION_TOKEN}"}
+API_PAGE_SIZE = 1000
+API_TIMEOUT = 60
+API_MAX_RETRIES = 5
+API_RETRY_STATUS_CODES = [429, 500, 502, 503, 504]
+# the pages in the cache_dir (see get_siae_list) are reused for a day at most, to resume a failed run
+API_CACHE_MAX_AGE = 60 * 60 * 24
+API_CACHE_INFO_FILENAME = "cache_info.json"
 
 
-def get_siae_list():
-    siae_list = list()
-    pagination = 1
+def get_default_client():
+    client = requests.Session()
+    client.headers.update(API_HEADERS)
+    return client
+
+
+class AdaptiveRateLimiter:
+    """
+    Wait between two requests:
+    - at least `min_interval` seconds
+    - driven by the API response: "Retry-After" header (on 429/503), or "X-RateLimit-Remaining" at 0
+      (wait until "X-RateLimit-Reset")
+    - doubled on each throttled response, and slowly back to `min_interval` on success
+    """
+
+    def __init__(self, min_interval=1, max_interval=60):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.interval = min_interval
+        self.next_request_at = 0
+
+    def wait(self):
+        delay = self.next_request_at - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+    def get_header_delay(self, response) -> float | None:
+        retry_after = response.headers.get("Retry-After")
+        if retry_after and retry_after.isdigit():
+            return float(retry_after)
+        if response.headers.get("X-RateLimit-Remaining") == "0":
+            reset = response.headers.get("X-RateLimit-Reset", "")
+            if reset.isdigit():
+                # either a timestamp or a number of seconds
+                return max(float(reset) - time.time(), 0) if int(reset) > 1_000_000_000 else float(reset)
+        return None
+
+    def update(self, response, throttled=False):
+        if throttled:
+            self.interval = min(self.interval * 2, self.max_interval)
+        else:
+            self.interval = max(self.interval * 0.75, self.min_interval)
+        header_delay = self.get_header_delay(response) if response is not None else None
+        delay = header_delay if header_delay is not None else self.interval
+        self.next_request_at = time.monotonic() + min(delay, self.max_interval)
+
+
+def get_page(client, url, rate_limiter, max_retries=API_MAX_RETRIES) -> dict:
+    """
+    Fetch a single page, with retries (and backoff) on network errors, 429 & 5xx
+    """
+    for retry_count in range(max_retries + 1):
+        rate_limiter.wait()
+        try:
+            response = client.get(url, timeout=API_TIMEOUT)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            if retry_count == max_retries:
+                raise e
+            logger.warning("Error while fetching `%s`: %s (retry %s)", url, e, retry_count + 1)
+            rate_limiter.update(None, throttled=True)
+            continue
+        if response.status_code in API_RETRY_STATUS_CODES and retry_count < max_retries:
+            logger.warning("Error while fetching `%s`: %s (retry %s)", url, response.status_code, retry_count + 1)
+            rate_limiter.update(response, throttled=True)
+            continue
+        response.raise_for_status()
+        rate_limiter.update(response)
+        return response.json()
+
+
+def check_cache(cache_dir, cache_key, max_age=API_CACHE_MAX_AGE):
+    """
+    The pages of cache_dir are reused only if they were fetched for the same cache_key (endpoint & page size)
+    less than max_age seconds ago: otherwise the cache is cleared, and keyed for the current run
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    cache_info_path = os.path.join(cache_dir, API_CACHE_INFO_FILENAME)
+    try:
+        with open(cache_info_path) as f:
+            cache_info = json.load(f)
+    except (OSError, ValueError):
+        cache_info = dict()
+    if cache_info.get("key") == cache_key and time.time() - cache_info.get("created_at", 0) < max_age:
+        return
+    clear_cache(cache_dir)
+    with open(cache_info_path, "w") as f:
+        json.dump({"key": cache_key, "created_at": time.time()}, f)
+
+
+def get_siae_list(
+    client=None,
+    cache_dir=None,
+    endpoint=API_ENDPOINT,
+    page_size=API_PAGE_SIZE,
+    min_interval=1,
+    cache_max_age=API_CACHE_MAX_AGE,
+):
+    """
+    Generator: yields the siae of each page, as they are fetched
+
+    cache_dir (optional): each page is stored on disk once fetched,
+    so that a failed run can be resumed without fetching the same pages again
+    (the directory should be emptied once the data is processed, see clear_cache();
+    the pages of another endpoint or page size, or older than cache_max_age, are not reused, see check_cache())
+    """
+    if not client:
+        client = get_default_client()
+    rate_limiter = AdaptiveRateLimiter(min_interval=min_interval)
+    if cache_dir:
+        check_cache(cache_dir, f"{endpoint}?page_size={page_size}", max_age=cache_max_age)
 
     # loop on API to fetch all the data
+    pagination = 1
     while True:
-        API_URL = f"{API_ENDPOINT}?page={pagination}&page_size={1000}"
-        logger.info(API_URL)
-        response = requests.get(API_URL, headers=API_HEADERS)
-        data = response.json()
+        cache_path = os.path.join(cache_dir, f"page_{pagination}.json") if cache_dir else None
+        if cache_path and os.path.exists(cache_path):
+            with open(cache_path) as f:
+                data = json.load(f)
+        else:
+            API_URL = f"{endpoint}?page={pagination}&page_size={page_size}"
+            logger.info(API_URL)
+            data = get_page(client, API_URL, rate_limiter)
+            if cache_path:
+                # write then rename: a page in the cache is always complete
+                with open(f"{cache_path}.tmp", "w") as f:
+                    json.dump({"next": data["next"], "results": data["results"]}, f)
+                os.replace(f"{cache_path}.tmp", cache_path)
         if data["results"]:
-            for siae in data["results"]:
-                siae_list.append(siae)
+            yield from data["results"]
         if data["next"]:
             pagination += 1
-            time.sleep(1)
         else:
             break
 
-    return siae_list
+
+def clear_cache(cache_dir):
+    if cache_dir and os.path.isdir(cache_dir):
+        for filename in os.listdir(cache_dir):
+            if filename.startswith("page_") or filename == API_CACHE_INFO_FILENAME:
+                os.remove(os.path.join(cache_dir, filename))
@@ -1,6 +1,8 @@
 # https://github.com/betagouv/itou/blob/master/itou/utils/apis/api_entreprise.py
 
 import logging
+import threading
+import time
 from datetime import date, datetime
 
 import requests
@@ -17,8 +19,49 @@ logger = logging.getLogger(__name__)
 API_ENTREPRISE_REASON = "Mise à jour données Marché de la plateforme de l'Inclusion"
 TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%S"  # "2016-12-31T00:00:00+01:00"  # timezone not managed
 
+# "max. 250 requêtes/min/jeton cumulées sur tous les endpoints"
+API_ENTREPRISE_MAX_REQUESTS_PER_MINUTE = 250
+API_ENTREPRISE_BURST = 10
 
-def entreprise_get_or_error(siren, reason="Inscription au marché de l'inclusion"):
+
+class TokenBucket:
+    """
+    Thread-safe token bucket: acquire() blocks until a token is available.
+    Over any 60s window, at most `burst + rate * 60` requests are made:
+    the rate is computed so that this stays under the quota.
+    """
+
+    def __init__(self, max_requests_per_minute, burst):
+        self.capacity = burst
+        self.rate = (max_requests_per_minute - burst) / 60  # tokens per second
+        self.tokens = burst
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                delay = (1 - self.tokens) / self.rate
+            time.sleep(delay)
+
+
+# shared by all the calls (and threads) of the process
+rate_limiter = TokenBucket(API_ENTREPRISE_MAX_REQUESTS_PER_MINUTE, API_ENTREPRISE_BURST)
+
+
+def api_get(url, client=None):
+    rate_limiter.acquire()
+    headers = {"Authorization": f"Bearer {settings.API_ENTREPRISE_TOKEN}"}
+    return (client or requests).get(url, headers=headers)
+
+
+def entreprise_get_or_error(siren, reason="Inscription au marché de l'inclusion", client=None):
     """
     Obtain company data from entreprises.api.gouv.fr
     documentation: https://doc.entreprise.api.gouv.fr/?json#entreprise-v2
@@ -39,10 +82,9 @@ def entreprise_get_or_error(siren, reason="Inscription au marché de l'inclusion
     )
 
     url = f"{settings.API_ENTREPRISE_BASE_URL}/entreprises/{siren}?{query_string}"
-    headers = {"Authorization": f"Bearer {settings.API_ENTREPRISE_TOKEN}"}
 
     try:
-        r = requests.get(url, headers=headers)
+        r = api_get(url, client=client)
         r.raise_for_status()
         data = r.json()
     except requests.exceptions.HTTPError as e:
@@ -77,6 +119,19 @@ def entreprise_get_or_error(siren, reason="Inscription au marché de l'inclusion
     return entreprise, None
 
 
+def entreprise_update_data(entreprise) -> dict:
+    update_data = dict()
+
+    if entreprise:
+        if entreprise["forme_juridique"]:
+            update_data["api_entreprise_forme_juridique"] = entreprise["forme_juridique"]
+        if entreprise["forme_juridique_code"]:
+            update_data["api_entreprise_forme_juridique_code"] = entreprise["forme_juridique_code"]
+
+    update_data["api_entreprise_entreprise_last_sync_date"] = timezone.now()
+    return update_data
+
+
 def siae_update_entreprise(siae):
     if siae.siret:
         siae_siren = siae.siret[:9]
@@ -84,22 +139,13 @@ def siae_update_entreprise(siae):
         if error:
             return 0, error
 
-        update_data = dict()
-
-        if entreprise:
-            if entreprise["forme_juridique"]:
-                update_data["api_entreprise_forme_juridique"] = entreprise["forme_juridique"]
-            if entreprise["forme_juridique_code"]:
-                update_data["api_entreprise_forme_juridique_code"] = entreprise["forme_juridique_code"]
-
-        update_data["api_entreprise_entreprise_last_sync_date"] = timezone.now()
-        Siae.objects.filter(id=siae.id).update(**update_data)
+        Siae.objects.filter(id=siae.id).update(**entreprise_update_data(entreprise))
 
         return 1, entreprise
     return 0, f"SIAE {siae.id} without SIREN"
 
 
-def etablissement_get_or_error(siret, reason="Inscription au marché de l'inclusion"):
+def etablissement_get_or_error(siret, reason="Inscription au marché de l'inclusion", client=None):
     """
     Obtain company data from entreprises.api.gouv.fr
     documentation: https://doc.entreprise.api.gouv.fr/?json#etablissements-v2
@@ -123,10 +169,9 @@ def etablissement_get_or_error(siret, reason="Inscription au marché de l'inclus
     )
 
     url = f"{settings.API_ENTREPRISE_BASE_URL}/etablissements/{siret}?{query_string}"
-    headers = {"Authorization": f"Bearer {settings.API_ENTREPRISE_TOKEN}"}
 
     try:
-        r = requests.get(url, headers=headers)
+        r = api_get(url, client=client)
         r.raise_for_status()
         data = r.json()
     except requests.exceptions.HTTPError as e:
@@ -173,36 +218,40 @@ def etablissement_get_or_error(siret, reason="Inscription au marché de l'inclus
     return etablissement, None
 
 
+def etablissement_update_data(etablissement) -> dict:
+    update_data = dict()
+
+    if etablissement:
+        # update_data"nature"] = siae_constants.NATURE_HEAD_OFFICE if etablissement["is_head_office"] else siae_constants.NATURE_ANTENNA  # noqa
+        # update_data"is_active"] = False if not etablissement["is_closed"] else True
+        if etablissement["employees"]:
+            update_data["api_entreprise_employees"] = (
+                etablissement["employees"]
+                if (etablissement["employees"] != "Unités non employeuses")
+                else "Non renseigné"
+            )
+        if etablissement["employees_date_reference"]:
+            update_data["api_entreprise_employees_year_reference"] = etablissement["employees_date_reference"]
+        if etablissement["date_constitution"]:
+            update_data["api_entreprise_date_constitution"] = etablissement["date_constitution"]
+
+    update_data["api_entreprise_etablissement_last_sync_date"] = timezone.now()
+    return update_data
+
+
 def siae_update_etablissement(siae):
     if siae.siret:
         etablissement, error = etablissement_get_or_error(siae.siret, reason=API_ENTREPRISE_REASON)
         if error:
             return 0, error
 
-        update_data = dict()
-
-        if etablissement:
-            # update_data"nature"] = siae_constants.NATURE_HEAD_OFFICE if etablissement["is_head_office"] else siae_constants.NATURE_ANTENNA  # noqa
-            # update_data"is_active"] = False if not etablissement["is_closed"] else True
-            if etablissement["employees"]:
-                update_data["api_entreprise_employees"] = (
-                    etablissement["employees"]
-                    if (etablissement["employees"] != "Unités non employeuses")
-                    else "Non renseigné"
-                )
-            if etablissement["employees_date_reference"]:
-                update_data["api_entreprise_employees_year_reference"] = etablissement["employees_date_reference"]
-            if etablissement["date_constitution"]:
-                update_data["api_entreprise_date_constitution"] = etablissement["date_constitution"]
-
-        update_data["api_entreprise_etablissement_last_sync_date"] = timezone.now()
-        Siae.objects.filter(id=siae.id).update(**update_data)
+        Siae.objects.filter(id=siae.id).update(**etablissement_update_data(etablissement))
 
         return 1, etablissement
     return 0, f"SIAE {siae.id} without SIRET"
 
 
-def exercice_get_or_error(siret, reason="Inscription au marché de l'inclusion"):
+def exercice_get_or_error(siret, reason="Inscription au marché de l'inclusion", client=None):
     """
     Obtain company data from entreprises.api.gouv.fr
     documentation: https://entreprise.api.gouv.fr/catalogue/#a-exercices
@@ -225,10 +274,9 @@ def exercice_get_or_error(siret, reason="Inscription au marché de l'inclusion")
     )
 
     url = f"{settings.API_ENTREPRISE_BASE_URL}/exercices/{siret}?{query_string}"
-    headers = {"Authorization": f"Bearer {settings.API_ENTREPRISE_TOKEN}"}
 
     try:
-        r = requests.get(url, headers=headers)
+        r = api_get(url, client=client)
         r.raise_for_status()
         data = r.json()
     except requests.exceptions.HTTPError as e:
@@ -259,25 +307,28 @@ def exercice_get_or_error(siret, reason="Inscription au marché de l'inclusion")
     return exercice, None
 
 
+def exercice_update_data(exercice) -> dict:
+    update_data = dict()
+
+    if exercice:
+        if exercice["ca"]:
+            update_data["api_entreprise_ca"] = exercice["ca"]
+        if exercice["date_fin_exercice"]:
+            update_data["api_entreprise_ca_date_fin_exercice"] = datetime.strptime(
+                exercice["date_fin_exercice"][:-6], TIMESTAMP_FORMAT
+            ).date()
+
+    update_data["api_entreprise_exercice_last_sync_date"] = timezone.now()
+    return update_data
+
+
 def siae_update_exercice(siae):
     if siae.siret:
         exercice, error = exercice_get_or_error(siae.siret, reason=API_ENTREPRISE_REASON)  # noqa
         if error:
             return 0, error
 
-        update_data = dict()
-
-        if exercice:
-            update_data = dict()
-            if exercice["ca"]:
-                update_data["api_entreprise_ca"] = exercice["ca"]
-            if exercice["date_fin_exercice"]:
-                update_data["api_entreprise_ca_date_fin_exercice"] = datetime.strptime(
-                    exercice["date_fin_exercice"][:-6], TIMESTAMP_FORMAT
-                ).date()
-
-        update_data["api_entreprise_exercice_last_sync_date"] = timezone.now()
-        Siae.objects.filter(id=siae.id).update(**update_data)
+        Siae.objects.filter(id=siae.id).update(**exercice_update_data(exercice))
 
         return 1, exercice
     return 0, f"SIAE {siae.id} without SIRET"
@@ -1,18 +1,54 @@
 # https://github.com/betagouv/itou/blob/master/itou/utils/apis/geocoding.py
 
+import csv
+import hashlib
+import io
 import json
 import logging
 
 import requests
 from django.conf import settings
 from django.contrib.gis.geos import GEOSGeometry
+from django.core.cache import caches
+from django.utils.connection import ConnectionProxy
 from django.utils.http import urlencode
 
 
 logger = logging.getLogger(__name__)
 
+API_TIMEOUT = 10
+API_CSV_TIMEOUT = 300
+API_CSV_BATCH_SIZE = 1000
+# stored in the cache when an address is not found (negative caching)
+GEOCODING_NOT_FOUND = "not_found"
 
-def call_ban_geocoding_api(address, post_code=None, limit=1):
+# dedicated cache (see settings.CACHES): the geocoding results must not evict (or be evicted by) the other entries
+geocoding_cache = ConnectionProxy(caches, "geocoding")
+
+client = requests.Session()
+
+
+class GeocodingError(Exception):
+    pass
+
+
+def normalize_address(address) -> str:
+    return " ".join((address or "").lower().split())
+
+
+def get_cache_key(address, post_code=None) -> str:
+    key = f"{normalize_address(address)}|{(post_code or '').strip()}"
+    return f"geocoding:{hashlib.sha1(key.encode()).hexdigest()}"
+
+
+def cache_feature(cache_key, feature):
+    if feature:
+        geocoding_cache.set(cache_key, feature, settings.GEOCODING_CACHE_TIMEOUT)
+    else:
+        geocoding_cache.set(cache_key, GEOCODING_NOT_FOUND, settings.GEOCODING_NOT_FOUND_CACHE_TIMEOUT)
+
+
+def fetch_ban_geocoding_feature(address, post_code=None, limit=1):
     api_url = f"{settings.API_BAN_BASE_URL}/search/"
 
     args = {"q": address, "limit": limit}
@@ -25,25 +61,93 @@ def call_ban_geocoding_api(address, post_code=None, limit=1):
     url = f"{api_url}?{query_string}"
 
     try:
-        r = requests.get(url)
-    except requests.RequestError as e:
-        logger.info("Error while fetching `%s`: %s", url, e)
+        r = client.get(url, timeout=API_TIMEOUT)
+        features = r.json()["features"]
+    except requests.RequestException as e:
+        raise GeocodingError(f"Error while fetching `{url}`: {e}")
+    except KeyError as e:
+        raise GeocodingError(f"Error key missing for `{url}`: {e}")
+    except json.decoder.JSONDecodeError as e:
+        raise GeocodingError(f"Error decoding json for `{url}`: {e}")
+
+    if not features:
+        logger.info("Geocoding error, no result found for `%s`", url)
         return None
+    return features[0]
+
+
+def call_ban_geocoding_api(address, post_code=None, limit=1):
+    """
+    Results (and "not found") are cached, keyed by the normalized address & post_code.
+    Errors are not cached.
+    """
+    cache_key = get_cache_key(address, post_code)
+    cached_feature = geocoding_cache.get(cache_key)
+    if cached_feature is not None:
+        return None if cached_feature == GEOCODING_NOT_FOUND else cached_feature
 
     try:
-        return r.json()["features"][0]
-    except IndexError:
-        # try again without the post_code, sometimes it's a strange CEDEX
-        if post_code:
-            return call_ban_geocoding_api(address)
-        else:
-            logger.info("Geocoding error, no result found for `%s`", url)
-            return None
-    except KeyError as e:
-        logger.info("Error key missing for `%s`: %s", url, e)
-    except json.decoder.JSONDecodeError as e:
-        logger.info("Error decoding json for `%s`: %s", url, e)
+        feature = fetch_ban_geocoding_feature(address, post_code=post_code, limit=limit)
+        if not feature and post_code:
+            # try again without the post_code, sometimes it's a strange CEDEX
+            feature = fetch_ban_geocoding_feature(address, limit=limit)
+    except GeocodingError as e:
+        logger.info(e)
+        return None
+
+    cache_feature(cache_key, feature)
+    return feature
+
+
+def csv_row_to_feature(row):
+    """
+    Convert a row of the BAN /search/csv/ response to a /search/ feature
+    """
+    if not row.get("latitude") or not row.get("result_label"):
         return None
+    properties = {
+        "score": float(row["result_score"] or 0),
+        "name": row["result_name"],
+        "postcode": row["result_postcode"],
+        "citycode": row["result_citycode"],
+        "city": row["result_city"],
+    }
+    for key in ["housenumber", "street"]:
+        if row.get(f"result_{key}"):
+            properties[key] = row[f"result_{key}"]
+    return {
+        "geometry": {"coordinates": [float(row["longitude"]), float(row["latitude"])]},
+        "properties": properties,
+    }
+
+
+def call_ban_geocoding_csv_api(address_list):
+    """
+    Geocode a batch of addresses with a single request to the BAN /search/csv/ endpoint
+    address_list: list of (address, post_code)
+    Returns the list of features (None if not found), in the same order
+    """
+    csv_file = io.StringIO()
+    writer = csv.writer(csv_file)
+    writer.writerow(["q", "postcode"])
+    writer.writerows([(address, post_code or "") for (address, post_code) in address_list])
+
+    url = f"{settings.API_BAN_BASE_URL}/search/csv/"
+    try:
+        r = client.post(
+            url,
+            data=[("columns", "q"), ("postcode", "postcode")],
+            files={"data": ("addresses.csv", csv_file.getvalue().encode(), "text/csv")},
+            timeout=API_CSV_TIMEOUT,
+        )
+        r.raise_for_status()
+    except requests.RequestException as e:
+        raise GeocodingError(f"Error while fetching `{url}`: {e}")
+
+    feature_list = [csv_row_to_feature(row) for row in csv.DictReader(io.StringIO(r.content.decode("utf-8-sig")))]
+    if len(feature_list) != len(address_list):
+        raise GeocodingError(f"Unexpected number of rows for `{url}`: {len(feature_list)}/{len(address_list)}")
+    return feature_list
 
 
 def process_geocoding_data(data):
@@ -86,3 +190,61 @@ def get_geocoding_data(address, post_code=None, limit=1):
     geocoding_data = call_ban_geocoding_api(address, post_code=post_code, limit=limit)
 
     return process_geocoding_data(geocoding_data)
+
+
+def fetch_ban_geocoding_features_bulk(address_dict) -> dict:
+    """
+    address_dict: {cache_key: (address, post_code)}
+    Returns {cache_key: feature (None if not found)}
+    The addresses not found with their post_code are sent again without it (see call_ban_geocoding_api)
+    """
+    cache_key_list = list(address_dict.keys())
+    feature_list = call_ban_geocoding_csv_api(list(address_dict.values()))
+    feature_dict = dict(zip(cache_key_list, feature_list))
+
+    retry_address_dict = {
+        cache_key: (address, None)
+        for cache_key, (address, post_code) in address_dict.items()
+        if not feature_dict[cache_key] and post_code
+    }
+    if retry_address_dict:
+        retry_feature_list = call_ban_geocoding_csv_api(list(retry_address_dict.values()))
+        feature_dict.update(zip(retry_address_dict.keys(), retry_feature_list))
+    return feature_dict
+
+
+def get_geocoding_data_bulk(address_list, batch_size=API_CSV_BATCH_SIZE) -> list:
+    """
+    Same as get_geocoding_data, for a list of (address, post_code):
+    the cached addresses are not sent, the others are sent by batches to the CSV endpoint.
+    Returns the list of geocoding data (None if not found or on error), in the same order
+    """
+    cache_key_list = [get_cache_key(address, post_code) for (address, post_code) in address_list]
+    feature_dict = geocoding_cache.get_many(set(cache_key_list))
+
+    address_to_fetch_dict = {
+        cache_key: address for cache_key, address in zip(cache_key_list, address_list) if cache_key not in feature_dict
+    }
+    address_to_fetch_items = list(address_to_fetch_dict.items())
+    for index in range(0, len(address_to_fetch_items), batch_size):
+        try:
+            batch_feature_dict = fetch_ban_geocoding_features_bulk(
+                dict(address_to_fetch_items[index : index + batch_size])
+            )
+        except GeocodingError as e:
+            logger.info(e)
+            continue
+        found_dict = {key: feature for key, feature in batch_feature_dict.items() if feature}
+        not_found_dict = {key: GEOCODING_NOT_FOUND for key, feature in batch_feature_dict.items() if not feature}
+        geocoding_cache.set_many(found_dict, settings.GEOCODING_CACHE_TIMEOUT)
+        geocoding_cache.set_many(not_found_dict, settings.GEOCODING_NOT_FOUND_CACHE_TIMEOUT)
+        feature_dict.update(found_dict)
+
+    return [
+        (
+            process_geocoding_data(feature_dict.get(cache_key))
+            if feature_dict.get(cache_key) != GEOCODING_NOT_FOUND
+            else None
+        )
+        for cache_key in cache_key_list
+    ]
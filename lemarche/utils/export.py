@@ -1,9 +1,16 @@
 import xlwt
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font
 
 from lemarche.siaes.models import Siae
 from lemarche.utils.urls import get_object_share_url
 
 
+# number of Siae fetched from the database at a time (the sector groups are prefetched by chunk)
+EXPORT_CHUNK_SIZE = 2000
+
+
 SIAE_FIELDS_TO_EXPORT = [
     "name",
     "brand",
@@ -35,7 +42,7 @@ SIAE_CUSTOM_FIELDS = ["Inscrite", "Lien vers le marché"]
 
 
 def get_siae_fields(with_contact_info=False):
-    siae_field_list = SIAE_FIELDS_TO_EXPORT
+    siae_field_list = SIAE_FIELDS_TO_EXPORT.copy()
     if with_contact_info:
         siae_field_list += SIAE_CONTACT_FIELDS
     siae_field_list += SIAE_CUSTOM_FIELDS
@@ -83,6 +90,15 @@ def generate_siae_row(siae: Siae, siae_field_list):
     return siae_row
 
 
+def iter_siae_rows(siae_queryset, siae_field_list):
+    """
+    Iterate on the queryset by chunks (constant memory), with the sector groups prefetched for each chunk
+    """
+    siae_queryset = siae_queryset.prefetch_related("activities__sector_group")
+    for siae in siae_queryset.iterator(chunk_size=EXPORT_CHUNK_SIZE):
+        yield generate_siae_row(siae, siae_field_list)
+
+
 def export_siae_to_csv(csv_writer, siae_queryset, with_contact_info=False):
     # columns
     field_list = get_siae_fields(with_contact_info)
@@ -91,13 +107,38 @@ def export_siae_to_csv(csv_writer, siae_queryset, with_contact_info=False):
     csv_writer.writerow(generate_header(field_list))
 
     # rows
-    for siae in siae_queryset:
-        siae_row = generate_siae_row(siae, field_list)
+    for siae_row in iter_siae_rows(siae_queryset, field_list):
         csv_writer.writerow(siae_row)
 
     return csv_writer
 
 
+def stream_siae_to_csv(csv_writer, siae_queryset, with_contact_info=False):
+    """
+    Same as export_siae_to_csv, but yields each line: to be used with a StreamingHttpResponse
+    (the csv_writer should write to a pseudo-buffer that returns the line, see EchoBuffer)
+    """
+    # columns
+    field_list = get_siae_fields(with_contact_info)
+
+    # header
+    yield csv_writer.writerow(generate_header(field_list))
+
+    # rows
+    for siae_row in iter_siae_rows(siae_queryset, field_list):
+        yield csv_writer.writerow(siae_row)
+
+
+class EchoBuffer:
+    """
+    Pseudo-buffer: write() returns the value instead of storing it
+    https://docs.djangoproject.com/en/dev/howto/outputting-csv/#streaming-large-csv-files
+    """
+
+    def write(self, value):
+        return value
+
+
 def export_siae_to_excel(siae_queryset, with_contact_info=False):
     wb = xlwt.Workbook(encoding="utf-8")
     ws = wb.add_sheet("Structures")
@@ -118,10 +159,36 @@ def export_siae_to_excel(siae_queryset, with_contact_info=False):
     # rows
     font_style = xlwt.XFStyle()
     font_style.alignment.wrap = 1
-    for siae in siae_queryset:
+    for siae_row in iter_siae_rows(siae_queryset, field_list):
         row_number += 1
-        siae_row = generate_siae_row(siae, field_list)
         for index, row_item in enumerate(siae_row):
             ws.write(row_number, index, row_item, font_style)
 
     return wb
+
+
+def export_siae_to_xlsx(file, siae_queryset, with_contact_info=False):
+    """
+    XLSX export in constant memory (openpyxl write-only mode: the rows are flushed to a temporary file)
+    No 65536 rows limit, unlike the .xls format
+    """
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("Structures")
+
+    # columns
+    field_list = get_siae_fields(with_contact_info)
+
+    # header
+    header_row = []
+    for header_item in generate_header(field_list):
+        header_cell = WriteOnlyCell(ws, value=str(header_item))
+        header_cell.font = Font(bold=True)
+        header_row.append(header_cell)
+    ws.append(header_row)
+
+    # rows
+    for siae_row in iter_siae_rows(siae_queryset, field_list):
+        ws.append(siae_row)
+
+    wb.save(file)
+    return file
@@ -0,0 +1,89 @@
+import base64
+import json
+from datetime import datetime
+
+from django.core.cache import cache
+from django.core.paginator import Paginator
+from django.db.models import Q
+from django.utils.functional import cached_property
+
+
+KEYSET_CURSOR_VALUE_TYPES = (bool, int, float, str, datetime)
+
+
+class CachedCountKeysetPaginator(Paginator):
+    """
+    Paginator for (big) ordered querysets:
+    - the count can be cached (count_cache_key), to avoid a full COUNT(*) on every page
+    - a page can be fetched with a keyset "cursor" (the ordering values of the last row of the previous page),
+      instead of an OFFSET that forces the database to scan all the previous rows
+
+    Pages reached without a (valid) cursor fall back to the usual OFFSET pagination.
+    Orderings on values that cannot be compared in SQL from a cursor (NULL, Distance...) don't get a cursor.
+    """
+
+    def __init__(self, object_list, per_page, count_cache_key=None, count_cache_timeout=None, **kwargs):
+        super().__init__(object_list, per_page, **kwargs)
+        self.count_cache_key = count_cache_key
+        self.count_cache_timeout = count_cache_timeout
+
+    @cached_property
+    def count(self):
+        if not self.count_cache_key:
+            return super().count
+        count = cache.get(self.count_cache_key)
+        if count is None:
+            count = super().count
+            cache.set(self.count_cache_key, count, self.count_cache_timeout)
+        return count
+
+    @cached_property
+    def ordering(self) -> list:
+        return list(self.object_list.query.order_by)
+
+    def get_cursor(self, page) -> str | None:
+        """
+        Cursor to fetch the next page (None if there is no next page, or if the ordering doesn't allow it)
+        """
+        if not page.has_next() or not len(page.object_list):
+            return None
+        last_object = list(page.object_list)[-1]
+        values = list()
+        for field in self.ordering:
+            value = getattr(last_object, field.lstrip("-"), None)
+            if not isinstance(value, KEYSET_CURSOR_VALUE_TYPES):
+                return None
+            values.append(value.isoformat() if isinstance(value, datetime) else value)
+        cursor = {"page": page.number + 1, "ordering": self.ordering, "values": values}
+        return base64.urlsafe_b64encode(json.dumps(cursor).encode()).decode().rstrip("=")
+
+    def decode_cursor(self, cursor: str, number: int) -> list | None:
+        """
+        Return the cursor values, if the cursor matches the page number and the current ordering
+        """
+        try:
+            cursor = json.loads(base64.urlsafe_b64decode(cursor.encode() + b"=" * (-len(cursor) % 4)))
+            if (cursor["page"] == number) and (cursor["ordering"] == self.ordering):
+                if len(cursor["values"]) == len(self.ordering):
+                    return cursor["values"]
+        except (ValueError, TypeError, KeyError):
+            pass
+        return None
+
+    def page_with_cursor(self, number, cursor: str = None):
+        """
+        Same as page(), but uses the keyset cursor when it is valid
+        """
+        number = self.validate_number(number)
+        values = self.decode_cursor(cursor, number) if cursor else None
+        if values is None:
+            return self.page(number)
+        # (a, b, c) "after" (va, vb, vc) <=> a > va OR (a = va AND b > vb) OR (a = va AND b = vb AND c > vc)
+        keyset_filter = Q()
+        previous_fields = dict()
+        for field, value in zip(self.ordering, values):
+            field_name = field.lstrip("-")
+            lookup = "lt" if field.startswith("-") else "gt"
+            keyset_filter |= Q(**previous_fields, **{f"{field_name}__{lookup}": value})
+            previous_fields[field_name] = value
+        return self._get_page(self.object_list.filter(keyset_filter)[: self.per_page], number, self)
@@ -3,6 +3,8 @@ Useful functions to interact with an S3 bucket.
 https://github.com/betagouv/itou/blob/master/itou/utils/storage/s3.py
 """
 
+import io
+
 import boto3
 from botocore.client import Config
 from django.conf import settings
@@ -62,3 +64,75 @@ class S3Upload:
         config["allowed_mime_types"] = ",".join(config["allowed_mime_types"])
 
         return config
+
+
+class S3MultipartUpload:
+    """
+    File-like object (text or bytes), uploaded to S3 by parts as it is written (multipart upload):
+    the file is never stored on disk, and only one part is kept in memory.
+
+    Usage:
+    with S3MultipartUpload(bucket_name, key, content_type="text/csv") as file:
+        writer = csv.writer(file)
+        ...
+
+    with S3MultipartUpload(bucket_name, key, content_type="application/gzip") as file:
+        with gzip.GzipFile(fileobj=file, mode="wb") as gzip_file:
+            ...
+
+    The upload is completed when leaving the block, or aborted on error.
+    """
+
+    # S3 minimum size for a part (except the last one) is 5MB
+    PART_SIZE = 8 * 1024 * 1024
+
+    def __init__(self, bucket_name, key, content_type, acl="public-read", client=None):
+        self.client = client or boto3.client("s3", **API_CONNECTION_DICT)
+        self.bucket_name = bucket_name
+        self.key = key
+        self.content_type = content_type
+        self.acl = acl
+        self.buffer = io.BytesIO()
+        self.part_list = list()
+        self.upload_id = None
+
+    def __enter__(self):
+        response = self.client.create_multipart_upload(
+            Bucket=self.bucket_name, Key=self.key, ACL=self.acl, ContentType=self.content_type
+        )
+        self.upload_id = response["UploadId"]
+        return self
+
+    def write(self, value):
+        if isinstance(value, str):
+            value = value.encode("utf-8")
+        self.buffer.write(value)
+        if self.buffer.tell() >= self.PART_SIZE:
+            self.upload_part()
+
+    def flush(self):
+        pass
+
+    def upload_part(self):
+        part_number = len(self.part_list) + 1
+        response = self.client.upload_part(
+            Bucket=self.bucket_name,
+            Key=self.key,
+            UploadId=self.upload_id,
+            PartNumber=part_number,
+            Body=self.buffer.getvalue(),
+        )
+        self.part_list.append({"PartNumber": part_number, "ETag": response["ETag"]})
+        self.buffer = io.BytesIO()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            self.client.abort_multipart_upload(Bucket=self.bucket_name, Key=self.key, UploadId=self.upload_id)
+            return False
+        # the last part can be smaller than PART_SIZE (and there is at least one part)
+        if self.buffer.tell() or not self.part_list:
+            self.upload_part()
+        self.client.complete_multipart_upload(
+            Bucket=self.bucket_name, Key=self.key, UploadId=self.upload_id, MultipartUpload={"Parts": self.part_list}
+        )
+        return False
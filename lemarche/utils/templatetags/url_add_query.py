@@ -11,10 +11,14 @@ register = template.Library()
 def url_add_query(context, **kwargs):
     """
     Link to a page without losing existing GET parameters.
+    A None value removes the parameter.
     """
     querydict = context["request"].GET
     mutable_querydict = querydict.copy()
     for item in kwargs:
-        mutable_querydict[item] = str(kwargs[item])
+        if kwargs[item] is None:
+            mutable_querydict.pop(item, None)
+        else:
+            mutable_querydict[item] = str(kwargs[item])
     link = "?{}".format(mutable_querydict.urlencode())
     return link
@@ -0,0 +1,127 @@
+from unittest.mock import patch
+
+from django.test import SimpleTestCase, override_settings
+from sib_api_v3_sdk.models import CreateSmtpEmail
+from sib_api_v3_sdk.rest import ApiException
+from urllib3.exceptions import ReadTimeoutError
+
+from lemarche.utils.apis import api_brevo
+
+
+class FakeTransactionalEmailsApi:
+    """
+    Rejects the whole request (400) if one of the recipients (or the template) is invalid, like Brevo
+    """
+
+    def __init__(self):
+        self.request_list = list()
+
+    def send_transac_email(self, send_smtp_email):
+        email_list = [version["to"][0]["email"] for version in send_smtp_email.message_versions]
+        self.request_list.append(email_list)
+        if not send_smtp_email.template_id or any(email.startswith("invalid") for email in email_list):
+            raise ApiException(status=400, reason="Bad Request")
+        if any(email.startswith("timeout") for email in email_list):
+            raise ReadTimeoutError(None, "/v3/smtp/email", "Read timed out.")
+        if any(email.startswith("lost") for email in email_list):
+            return CreateSmtpEmail(message_ids=[f"<{email}>" for email in email_list[1:]])
+        return CreateSmtpEmail(message_ids=[f"<{email}>" for email in email_list])
+
+
+@override_settings(BITOUBI_ENV="prod")
+class SendTransactionalEmailBatchTest(SimpleTestCase):
+    def setUp(self):
+        self.api = FakeTransactionalEmailsApi()
+        patcher = patch.object(api_brevo, "get_transactional_emails_api", return_value=self.api)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def get_recipient_list(self, email_list):
+        return [{"recipient_email": email, "recipient_name": "", "variables": {}} for email in email_list]
+
+    def test_batches_of_message_versions(self):
+        email_list = [f"user{index}@example.com" for index in range(5)]
+        with patch.object(api_brevo, "MESSAGE_VERSIONS_BATCH_SIZE", 2):
+            result_list = api_brevo.send_transactional_email_batch_with_template.call_local(
+                1, self.get_recipient_list(email_list), subject="Sujet"
+            )
+        self.assertEqual([len(request) for request in self.api.request_list], [2, 2, 1])
+        self.assertEqual(result_list, [{"message_id": f"<{email}>"} for email in email_list])
+
+    def test_errors_are_reported_per_version(self):
+        email_list = ["user0@example.com", "invalid1@example.com", "user2@example.com", "user3@example.com"]
+        result_list = api_brevo.send_transactional_email_batch_with_template.call_local(
+            1, self.get_recipient_list(email_list)
+        )
+        self.assertEqual([("error" in result) for result in result_list], [False, True, False, False])
+        self.assertEqual(result_list[0], {"message_id": "<user0@example.com>"})
+        self.assertEqual(result_list[3], {"message_id": "<user3@example.com>"})
+        # the batch, the first version alone, the 3 other versions, then their halves
+        self.assertEqual(
+            self.api.request_list,
+            [
+                email_list,
+                email_list[:1],
+                email_list[1:],
+                email_list[1:2],
+                email_list[2:],
+            ],
+        )
+
+    def test_invalid_first_version_does_not_fail_the_others(self):
+        email_list = ["invalid0@example.com", "user1@example.com", "user2@example.com", "user3@example.com"]
+        result_list = api_brevo.send_transactional_email_batch_with_template.call_local(
+            1, self.get_recipient_list(email_list)
+        )
+        self.assertEqual([("error" in result) for result in result_list], [True, False, False, False])
+        self.assertEqual(result_list[1:], [{"message_id": f"<{email}>"} for email in email_list[1:]])
+        # the batch, the first version alone, then the 3 other versions
+        self.assertEqual(self.api.request_list, [email_list, email_list[:1], email_list[1:]])
+
+    def test_request_level_error_is_not_split(self):
+        email_list = [f"user{index}@example.com" for index in range(100)]
+        result_list = api_brevo.send_transactional_email_batch_with_template.call_local(
+            None, self.get_recipient_list(email_list)
+        )
+        self.assertTrue(all("error" in result for result in result_list))
+        # the batch, the first version alone, the 99 others, then the second version alone
+        self.assertEqual(self.api.request_list, [email_list, email_list[:1], email_list[1:], email_list[1:2]])
+
+    def test_split_depth_is_capped(self):
+        email_list = ["user0@example.com"] + [f"invalid{index}@example.com" for index in range(1, 100)]
+        with patch.object(api_brevo, "MESSAGE_VERSIONS_MAX_SPLIT_DEPTH", 3):
+            result_list = api_brevo.send_transactional_email_batch_with_template.call_local(
+                1, self.get_recipient_list(email_list)
+            )
+        self.assertEqual(result_list[0], {"message_id": "<user0@example.com>"})
+        self.assertTrue(all("error" in result for result in result_list[1:]))
+        # the batch, the first version alone, the 99 others, then 2 halves and 4 quarters (depth 3)
+        self.assertEqual(len(self.api.request_list), 9)
+
+    def test_other_errors_only_fail_their_batch(self):
+        email_list = ["user0@example.com", "user1@example.com", "timeout2@example.com", "user3@example.com"]
+        with patch.object(api_brevo, "MESSAGE_VERSIONS_BATCH_SIZE", 2):
+            result_list = api_brevo.send_transactional_email_batch_with_template.call_local(
+                1, self.get_recipient_list(email_list)
+            )
+        self.assertEqual([("error" in result) for result in result_list], [False, False, True, True])
+        self.assertIn("ReadTimeoutError", result_list[2]["error"])
+
+    def test_message_ids_length_mismatch(self):
+        email_list = ["lost0@example.com", "user1@example.com", "user2@example.com", "user3@example.com"]
+        with patch.object(api_brevo, "MESSAGE_VERSIONS_BATCH_SIZE", 2):
+            with patch.object(api_brevo, "logger") as mock_logger:
+                result_list = api_brevo.send_transactional_email_batch_with_template.call_local(
+                    1, self.get_recipient_list(email_list)
+                )
+        mock_logger.error.assert_any_call("Brevo returned 1 message ids for 2 message versions")
+        # one result per version, and the next batch is still sent
+        self.assertEqual(
+            result_list,
+            [
+                {"message_id": "<user1@example.com>"},
+                {"message_id": None},
+                {"message_id": "<user2@example.com>"},
+                {"message_id": "<user3@example.com>"},
+            ],
+        )
@@ -0,0 +1,93 @@
+import json
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from django.test import SimpleTestCase
+
+from lemarche.utils.apis import api_emplois_inclusion
+
+
+class StubEmploisInclusionHandler(BaseHTTPRequestHandler):
+    """
+    3 pages of 2 siaes; the first request on page 2 is throttled (429)
+    """
+
+    def do_GET(self):
+        self.server.request_list.append(self.path)
+        page = int(parse_qs(urlparse(self.path).query)["page"][0])
+        if page == 2 and self.server.request_list.count(self.path) == 1:
+            self.send_response(429)
+            self.send_header("Retry-After", "0")
+            self.end_headers()
+            return
+        data = {
+            "next": f"http://stub/marche?page={page + 1}" if page < 3 else None,
+            "results": [{"id": (page - 1) * 2 + 1}, {"id": (page - 1) * 2 + 2}],
+        }
+        body = json.dumps(data).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class ApiEmploisInclusionTest(SimpleTestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), StubEmploisInclusionHandler)
+        self.server.request_list = list()
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.endpoint = f"http://127.0.0.1:{self.server.server_address[1]}/marche"
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_get_siae_list_streams_all_pages_with_retry(self):
+        siae_list = api_emplois_inclusion.get_siae_list(endpoint=self.endpoint, min_interval=0)
+        self.assertNotIsInstance(siae_list, list)  # generator
+        self.assertEqual([siae["id"] for siae in siae_list], [1, 2, 3, 4, 5, 6])
+        self.assertEqual(len(self.server.request_list), 4)  # 3 pages + 1 retry
+
+    def test_get_siae_list_resumes_from_cache(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            siae_list = api_emplois_inclusion.get_siae_list(
+                endpoint=self.endpoint, cache_dir=cache_dir, min_interval=0
+            )
+            self.assertEqual(len(list(siae_list)), 6)
+            request_count = len(self.server.request_list)
+            # second run: all the pages are read from the cache
+            siae_list = api_emplois_inclusion.get_siae_list(
+                endpoint=self.endpoint, cache_dir=cache_dir, min_interval=0
+            )
+            self.assertEqual(len(list(siae_list)), 6)
+            self.assertEqual(len(self.server.request_list), request_count)
+            # once cleared, the pages are fetched again
+            api_emplois_inclusion.clear_cache(cache_dir)
+            siae_list = api_emplois_inclusion.get_siae_list(
+                endpoint=self.endpoint, cache_dir=cache_dir, min_interval=0
+            )
+            self.assertEqual(len(list(siae_list)), 6)
+            self.assertGreater(len(self.server.request_list), request_count)
+
+    def test_get_siae_list_does_not_reuse_a_stale_cache(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            list(api_emplois_inclusion.get_siae_list(endpoint=self.endpoint, cache_dir=cache_dir, min_interval=0))
+            request_count = len(self.server.request_list)
+            # another page size: the pages are fetched again
+            siae_list = api_emplois_inclusion.get_siae_list(
+                endpoint=self.endpoint, cache_dir=cache_dir, page_size=500, min_interval=0
+            )
+            self.assertEqual(len(list(siae_list)), 6)
+            self.assertEqual(len(self.server.request_list), request_count + 4)  # 3 pages + 1 retry (new url)
+            # too old: the pages are fetched again
+            siae_list = api_emplois_inclusion.get_siae_list(
+                endpoint=self.endpoint, cache_dir=cache_dir, page_size=500, min_interval=0, cache_max_age=0
+            )
+            self.assertEqual(len(list(siae_list)), 6)
+            self.assertEqual(len(self.server.request_list), request_count + 4 + 3)
@@ -0,0 +1,153 @@
+import csv
+import io
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from django.core.cache import caches
+from django.test import SimpleTestCase, override_settings
+
+from lemarche.utils.apis import geocoding
+
+
+# known addresses: (normalized query, post_code or None) -> (post_code, longitude, latitude)
+STUB_ADDRESSES = {
+    ("1 rue de la paix paris", "75002"): ("75002", 2.3311, 48.8689),
+    ("zone industrielle cedex grenoble", None): ("38000", 5.7301, 45.1825),
+}
+
+CSV_RESULT_COLUMNS = ["latitude", "longitude", "result_label", "result_score", "result_name"]
+CSV_RESULT_COLUMNS += ["result_housenumber", "result_street", "result_postcode", "result_citycode", "result_city"]
+
+
+def stub_lookup(query, post_code):
+    return STUB_ADDRESSES.get((geocoding.normalize_address(query), post_code or None))
+
+
+class StubBanHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.server.request_list.append(self.path)
+        args = parse_qs(urlparse(self.path).query)
+        result = stub_lookup(args["q"][0], args.get("postcode", [None])[0])
+        features = list()
+        if result:
+            post_code, longitude, latitude = result
+            features.append(
+                {
+                    "geometry": {"coordinates": [longitude, latitude]},
+                    "properties": {
+                        "score": 0.9,
+                        "name": args["q"][0],
+                        "postcode": post_code,
+                        "citycode": "00000",
+                        "city": "Ville",
+                    },
+                }
+            )
+        self.send_body(json.dumps({"features": features}).encode(), "application/json")
+
+    def do_POST(self):
+        self.server.request_list.append(self.path)
+        body = self.rfile.read(int(self.headers["Content-Length"])).decode()
+        # multipart body: the CSV file is between the "text/csv" header and the next boundary
+        csv_content = body.split("Content-Type: text/csv\r\n\r\n")[1].split("\r\n--")[0]
+        rows = list(csv.DictReader(io.StringIO(csv_content)))
+        output = io.StringIO()
+        writer = csv.DictWriter(output, fieldnames=["q", "postcode"] + CSV_RESULT_COLUMNS)
+        writer.writeheader()
+        for row in rows:
+            result = stub_lookup(row["q"], row["postcode"])
+            if result:
+                post_code, longitude, latitude = result
+                row.update(
+                    latitude=latitude,
+                    longitude=longitude,
+                    result_label=row["q"],
+                    result_score=0.9,
+                    result_name=row["q"],
+                    result_postcode=post_code,
+                    result_citycode="00000",
+                    result_city="Ville",
+                )
+            writer.writerow(row)
+        self.send_body(output.getvalue().encode(), "text/csv")
+
+    def send_body(self, body, content_type):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@override_settings(
+    CACHES={
+        "default": {"BACKEND": "django.core.cache.backends.dummy.DummyCache"},
+        "geocoding": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+    }
+)
+class GeocodingTest(SimpleTestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), StubBanHandler)
+        self.server.request_list = list()
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.settings_override = override_settings(
+            API_BAN_BASE_URL=f"http://127.0.0.1:{self.server.server_address[1]}"
+        )
+        self.settings_override.enable()
+        geocoding.geocoding_cache.clear()
+
+    def tearDown(self):
+        self.settings_override.disable()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_get_geocoding_data_is_cached(self):
+        geocoding_data = geocoding.get_geocoding_data("1 rue de la Paix  Paris", post_code="75002")
+        self.assertEqual(geocoding_data["post_code"], "75002")
+        self.assertEqual(len(self.server.request_list), 1)
+        # same normalized address: from the cache
+        geocoding_data = geocoding.get_geocoding_data("1 RUE DE LA PAIX PARIS", post_code="75002")
+        self.assertEqual(geocoding_data["latitude"], 48.8689)
+        self.assertEqual(len(self.server.request_list), 1)
+
+    def test_get_geocoding_data_uses_the_geocoding_cache(self):
+        geocoding.get_geocoding_data("1 rue de la Paix Paris", post_code="75002")
+        cache_key = geocoding.get_cache_key("1 rue de la Paix Paris", post_code="75002")
+        self.assertIsNotNone(caches["geocoding"].get(cache_key))
+        self.assertIsNone(caches["default"].get(cache_key))
+
+    def test_get_geocoding_data_not_found_is_cached(self):
+        self.assertIsNone(geocoding.get_geocoding_data("nowhere"))
+        self.assertIsNone(geocoding.get_geocoding_data("nowhere"))
+        self.assertEqual(len(self.server.request_list), 1)
+
+    def test_get_geocoding_data_retries_without_post_code(self):
+        geocoding_data = geocoding.get_geocoding_data("Zone industrielle CEDEX Grenoble", post_code="38099")
+        self.assertEqual(geocoding_data["post_code"], "38000")
+        self.assertEqual(len(self.server.request_list), 2)
+
+    def test_get_geocoding_data_bulk(self):
+        geocoding.get_geocoding_data("1 rue de la Paix Paris", post_code="75002")  # cached
+        geocoding_data_list = geocoding.get_geocoding_data_bulk(
+            [
+                ("1 rue de la Paix Paris", "75002"),
+                ("nowhere", None),
+                ("Zone industrielle CEDEX Grenoble", "38099"),
+                ("nowhere", None),
+            ]
+        )
+        self.assertEqual(geocoding_data_list[0]["post_code"], "75002")
+        self.assertIsNone(geocoding_data_list[1])
+        self.assertEqual(geocoding_data_list[2]["post_code"], "38000")
+        self.assertEqual(geocoding_data_list[2]["coords"].x, 5.7301)
+        self.assertIsNone(geocoding_data_list[3])
+        # 1 GET, then 1 CSV batch + 1 CSV retry without the post_code
+        self.assertEqual(len(self.server.request_list), 3)
+        # everything is cached now
+        geocoding.get_geocoding_data_bulk([("nowhere", None), ("Zone industrielle CEDEX Grenoble", "38099")])
+        self.assertEqual(len(self.server.request_list), 3)
@@ -0,0 +1,63 @@
+import csv
+import gzip
+
+from django.test import SimpleTestCase
+
+from lemarche.utils.s3 import S3MultipartUpload
+
+
+class FakeS3Client:
+    def __init__(self):
+        self.part_list = list()
+        self.completed = None
+        self.aborted = False
+
+    def create_multipart_upload(self, **kwargs):
+        return {"UploadId": "upload-id"}
+
+    def upload_part(self, PartNumber, Body, **kwargs):
+        self.part_list.append(Body)
+        return {"ETag": f"etag-{PartNumber}"}
+
+    def complete_multipart_upload(self, MultipartUpload, **kwargs):
+        self.completed = MultipartUpload["Parts"]
+
+    def abort_multipart_upload(self, **kwargs):
+        self.aborted = True
+
+
+class S3MultipartUploadTest(SimpleTestCase):
+    def test_upload_by_parts(self):
+        client = FakeS3Client()
+        with S3MultipartUpload("bucket", "key.csv", content_type="text/csv", client=client) as file:
+            file.PART_SIZE = 100
+            writer = csv.writer(file)
+            for index in range(30):
+                writer.writerow([index, "é" * 5])
+        self.assertGreater(len(client.part_list), 1)
+        self.assertTrue(all(len(part) >= 100 for part in client.part_list[:-1]))
+        self.assertEqual(
+            client.completed, [{"PartNumber": i + 1, "ETag": f"etag-{i + 1}"} for i in range(len(client.part_list))]
+        )
+        content = b"".join(client.part_list).decode("utf-8")
+        self.assertEqual(len(list(csv.reader(content.splitlines()))), 30)
+
+    def test_empty_file_and_abort_on_error(self):
+        client = FakeS3Client()
+        with S3MultipartUpload("bucket", "key.csv", content_type="text/csv", client=client):
+            pass
+        self.assertEqual(client.part_list, [b""])
+        client = FakeS3Client()
+        with self.assertRaises(ValueError):
+            with S3MultipartUpload("bucket", "key.csv", content_type="text/csv", client=client) as file:
+                file.write("a,b\r\n")
+                raise ValueError
+        self.assertTrue(client.aborted)
+        self.assertIsNone(client.completed)
+
+    def test_binary_write(self):
+        client = FakeS3Client()
+        with S3MultipartUpload("bucket", "key.jsonl.gz", content_type="application/gzip", client=client) as file:
+            with gzip.GzipFile(fileobj=file, mode="wb") as gzip_file:
+                gzip_file.write(b"line 1\nline 2\n")
+        self.assertEqual(gzip.decompress(b"".join(client.part_list)), b"line 1\nline 2\n")
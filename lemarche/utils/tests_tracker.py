@@ -1,9 +1,10 @@
 from unittest import mock
 
-from django.test import TestCase
+from django.test import SimpleTestCase, TestCase
 from django.urls import reverse
 
 from lemarche.utils.emails import whitelist_recipient_list
+from lemarche.utils.tracker import TrackerBuffer
 
 
 def mock_track(path, action, **kargs):
@@ -37,6 +38,48 @@ class TrackerTest(TestCase):
         self.assertEqual(mock_track.call_count, 0)
 
 
+class TrackerBufferTest(SimpleTestCase):
+    def setUp(self):
+        # no background thread (nor atexit handler): the tests flush synchronously
+        start_patcher = mock.patch.object(TrackerBuffer, "start")
+        self.mock_start = start_patcher.start()
+        self.addCleanup(start_patcher.stop)
+        self.tracker_buffer = TrackerBuffer(max_size=3, flush_size=10, flush_interval=3600)
+        self.payload = {"version": 3, "env": "test", "source": "tracker", "page": "/", "action": "load", "data": {}}
+
+    @mock.patch("lemarche.utils.tracker.Tracker.objects.bulk_create")
+    def test_flush_writes_the_events_by_batch(self, mock_bulk_create):
+        for _ in range(2):
+            self.assertTrue(self.tracker_buffer.put(self.payload))
+        self.assertEqual(self.tracker_buffer.get_stats()["pending"], 2)
+        mock_bulk_create.assert_not_called()
+        self.assertEqual(self.tracker_buffer.flush(), 2)
+        self.assertEqual(mock_bulk_create.call_count, 1)
+        self.assertEqual(len(mock_bulk_create.call_args.args[0]), 2)
+        stats = self.tracker_buffer.get_stats()
+        self.assertEqual(stats["flushed"], 2)
+        self.assertEqual(stats["pending"], 0)
+        # nothing to flush
+        self.assertEqual(self.tracker_buffer.flush(), 0)
+        self.assertEqual(mock_bulk_create.call_count, 1)
+        self.assertEqual(self.mock_start.call_count, 2)
+
+    @mock.patch("lemarche.utils.tracker.Tracker.objects.bulk_create")
+    def test_events_are_dropped_when_the_buffer_is_full(self, mock_bulk_create):
+        for _ in range(5):
+            self.tracker_buffer.put(self.payload)
+        stats = self.tracker_buffer.get_stats()
+        self.assertEqual(stats["queued"], 3)
+        self.assertEqual(stats["dropped"], 2)
+        self.assertEqual(self.tracker_buffer.flush(), 3)
+
+    @mock.patch("lemarche.utils.tracker.Tracker.objects.bulk_create", side_effect=Exception("DB down"))
+    def test_failed_flush_is_counted(self, mock_bulk_create):
+        self.tracker_buffer.put(self.payload)
+        self.tracker_buffer.flush()
+        self.assertEqual(self.tracker_buffer.get_stats()["failed"], 1)
+
+
 class EmailTest(TestCase):
     def should_filter_out_non_betagouv_emails_when_not_in_prod(self):
         email_list = ["test@inclusion.gouv.fr", "test@example.com"]
@@ -3,16 +3,18 @@
 # Not used that much :
 # - adopt (adoption event) / already have adopt_search...
 
-# TODO: Make Async / non-blocking.
-# But unless the whole application becomes async,
-# the only way would be to use threads, which is another problem in itself.
-# However, nothing keeps the Django app from writing
-# to the tracking database directly, which would be magnitudes faster.
+# Non-blocking: the events are buffered in memory (TrackerBuffer),
+# and written by batches to the tracking database by a background thread.
 
+import atexit
 import logging
+import os
+import queue
+import threading
 
 from crawlerdetect import CrawlerDetect
 from django.conf import settings
+from django.db import close_old_connections
 from django.http import HttpRequest, HttpResponse
 from django.urls import reverse
 from django.utils import timezone
@@ -22,9 +24,6 @@ from lemarche.stats.models import Tracker
 from lemarche.users.models import User
 
 
-# from huey.contrib.djhuey import task
-
-
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
 
@@ -51,7 +50,99 @@ DEFAULT_PAYLOAD = {
 }
 
 
-# @task()
+class TrackerBuffer:
+    """
+    In-process buffer of Tracker events, written with bulk_create by a background thread
+    - the thread flushes every `flush_interval` seconds, or as soon as `flush_size` events are waiting
+    - back-pressure: the queue is bounded (`max_size`), new events are dropped (and counted) when it is full
+    - the remaining events are flushed when the worker shuts down (atexit)
+
+    The counters are available with get_stats() (and logged when events are dropped)
+    """
+
+    def __init__(self, max_size: int, flush_size: int, flush_interval: int):
+        self.queue = queue.Queue(maxsize=max_size)
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.stats = {"queued": 0, "dropped": 0, "flushed": 0, "failed": 0}
+        self._stats_lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._thread_pid = None
+
+    def increment_stat(self, key: str, value: int = 1):
+        with self._stats_lock:
+            self.stats[key] += value
+
+    def get_stats(self) -> dict:
+        with self._stats_lock:
+            return self.stats | {"pending": self.queue.qsize()}
+
+    def put(self, payload: dict) -> bool:
+        self.start()
+        try:
+            self.queue.put_nowait(payload)
+        except queue.Full:
+            self.increment_stat("dropped")
+            if self.stats["dropped"] % 1000 == 1:  # avoid flooding the logs
+                logger.warning("Tracker buffer full, events dropped", extra=self.get_stats())
+            return False
+        self.increment_stat("queued")
+        if self.queue.qsize() >= self.flush_size:
+            self._wakeup.set()
+        return True
+
+    def flush(self) -> int:
+        with self._flush_lock:
+            payload_list = []
+            while True:
+                try:
+                    payload_list.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            if payload_list:
+                try:
+                    Tracker.objects.bulk_create(
+                        [Tracker(**payload) for payload in payload_list], batch_size=self.flush_size
+                    )
+                    self.increment_stat("flushed", len(payload_list))
+                except Exception as e:
+                    self.increment_stat("failed", len(payload_list))
+                    logger.exception(e)
+                    logger.warning("Failed to save trackers")
+                logger.debug("Tracker buffer flushed", extra=self.get_stats())
+            return len(payload_list)
+
+    def run(self):
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            # the thread has its own database connection: respect CONN_MAX_AGE & drop broken ones
+            close_old_connections()
+            self.flush()
+
+    def start(self):
+        """
+        Start the background thread (lazily: after the fork of the web server workers)
+        """
+        if self._thread_pid == os.getpid():
+            return
+        with self._stats_lock:
+            if self._thread_pid != os.getpid():
+                self._thread = threading.Thread(target=self.run, name="tracker-buffer", daemon=True)
+                self._thread.start()
+                self._thread_pid = os.getpid()
+                atexit.register(self.flush)
+
+
+tracker_buffer = TrackerBuffer(
+    max_size=settings.TRACKER_BUFFER_MAX_SIZE,
+    flush_size=settings.TRACKER_BUFFER_FLUSH_SIZE,
+    flush_interval=settings.TRACKER_BUFFER_FLUSH_INTERVAL,
+)
+
+
 def track(page: str = "", action: str = "load", meta: dict = {}):  # noqa B006
     # Don't log in dev
     if settings.BITOUBI_ENV not in ("dev", "test"):
@@ -84,11 +175,14 @@ def track(page: str = "", action: str = "load", meta: dict = {}):  # noqa B006
         }
         payload = DEFAULT_PAYLOAD | set_payload
 
-        try:
-            Tracker.objects.create(**payload)
-        except Exception as e:
-            logger.exception(e)
-            logger.warning("Failed to save tracker")
+        if settings.TRACKER_BUFFER_ENABLED:
+            tracker_buffer.put(payload)
+        else:
+            try:
+                Tracker.objects.create(**payload)
+            except Exception as e:
+                logger.exception(e)
+                logger.warning("Failed to save tracker")
 
 
 class TrackerMiddleware:
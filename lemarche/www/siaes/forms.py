@@ -393,8 +393,8 @@ class SiaeFilterForm(forms.Form):
         if full_text_string:
             ORDER_BY_FIELDS = ["-similarity"]
 
-        # final ordering
-        qs = qs.order_by(*ORDER_BY_FIELDS)
+        # final ordering (with the id as a tie-breaker, to have a stable pagination)
+        qs = qs.order_by(*ORDER_BY_FIELDS, "-id")
 
         return qs
 
@@ -431,7 +431,10 @@ class SiaeDownloadForm(SiaeFilterForm):
     )
     download_source = forms.CharField(required=False, widget=forms.HiddenInput())
     format = forms.ChoiceField(
-        label="Format", widget=forms.RadioSelect, choices=(("xls", "xls"), ("csv", "csv")), required=False
+        label="Format",
+        widget=forms.RadioSelect,
+        choices=(("xlsx", "xlsx"), ("xls", "xls"), ("csv", "csv")),
+        required=False,
     )
 
 
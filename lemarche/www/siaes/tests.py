@@ -1,7 +1,10 @@
+from io import BytesIO
+
 from django.contrib.gis.geos import Point
 from django.contrib.sites.models import Site
 from django.test import TestCase
 from django.urls import reverse
+from openpyxl import load_workbook
 
 from lemarche.labels.factories import LabelFactory
 from lemarche.networks.factories import NetworkFactory
@@ -68,6 +71,71 @@ class SiaeSearchNumQueriesTest(TestCase):
             self.assertEqual(len(siaes), 20)
 
 
+class SiaeSearchPaginationTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        SiaeFactory.create_batch(45)
+        SiaeFactory.create_batch(5, description="coucou")
+        cls.url = reverse("siae:search_results")
+
+    def test_next_page_cursor_returns_the_same_results_as_the_offset(self):
+        response = self.client.get(self.url)
+        self.assertIsNotNone(response.context["next_page_cursor"])
+        self.assertContains(response, f"cursor={response.context['next_page_cursor']}")
+        for page in [2, 3]:
+            response_offset = self.client.get(f"{self.url}?page={page}")
+            response_cursor = self.client.get(f"{self.url}?page={page}&cursor={response.context['next_page_cursor']}")
+            self.assertEqual(
+                [siae.id for siae in response_cursor.context["siaes"]],
+                [siae.id for siae in response_offset.context["siaes"]],
+            )
+            response = response_cursor
+        # last page
+        self.assertEqual(len(response.context["siaes"]), 10)
+        self.assertIsNone(response.context["next_page_cursor"])
+
+    def test_invalid_cursor_falls_back_to_the_offset(self):
+        response_offset = self.client.get(f"{self.url}?page=2")
+        for cursor in ["wrong", response_offset.context["next_page_cursor"]]:  # wrong page number
+            response = self.client.get(f"{self.url}?page=2&cursor={cursor}")
+            self.assertEqual(
+                [siae.id for siae in response.context["siaes"]],
+                [siae.id for siae in response_offset.context["siaes"]],
+            )
+
+
+class SiaeSearchResultsDownloadTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.url = reverse("siae:search_results_download")
+        cls.user = UserFactory(kind="BUYER")
+        cls.sector = SectorFactory()
+        for index in range(3):
+            siae = SiaeFactory(name=f"Structure {index}", kind=siae_constants.KIND_EI)
+            SiaeActivityFactory(siae=siae, sector_group=cls.sector.group, sectors=[cls.sector])
+        SiaeFactory(kind=siae_constants.KIND_AI)
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def test_download_csv_is_streamed(self):
+        response = self.client.get(f"{self.url}?kind={siae_constants.KIND_EI}&format=csv")
+        self.assertTrue(response.streaming)
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        self.assertEqual(len(lines), 1 + 3)  # header + siaes
+        self.assertIn("Raison sociale", lines[0])
+        self.assertIn(self.sector.group.name, lines[1])
+
+    def test_download_xlsx(self):
+        response = self.client.get(f"{self.url}?kind={siae_constants.KIND_EI}&format=xlsx")
+        self.assertTrue(response.streaming)
+        wb = load_workbook(BytesIO(b"".join(response.streaming_content)))
+        rows = list(wb["Structures"].values)
+        self.assertEqual(len(rows), 1 + 3)
+        self.assertEqual(rows[0][0], "Raison sociale")
+        self.assertIn("Structure", rows[1][0])
+
+
 class SiaeKindSearchFilterTest(TestCase):
     @classmethod
     def setUpTestData(cls):
@@ -1,4 +1,6 @@
 import csv
+import hashlib
+import tempfile
 from datetime import date
 from urllib.parse import quote
 
@@ -6,9 +8,9 @@ from django.conf import settings
 from django.contrib import messages
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.contrib.messages.views import SuccessMessageMixin
-from django.core.paginator import Paginator
+from django.core.paginator import InvalidPage
 from django.core.serializers import serialize
-from django.http import Http404, HttpResponse, HttpResponseRedirect
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseRedirect, StreamingHttpResponse
 from django.shortcuts import get_object_or_404, redirect
 from django.urls import reverse_lazy
 from django.utils.safestring import mark_safe
@@ -21,7 +23,8 @@ from lemarche.favorites.models import FavoriteList
 from lemarche.siaes.models import Siae
 from lemarche.utils import settings_context_processors
 from lemarche.utils.emails import add_to_contact_list
-from lemarche.utils.export import export_siae_to_csv, export_siae_to_excel
+from lemarche.utils.export import EchoBuffer, export_siae_to_excel, export_siae_to_xlsx, stream_siae_to_csv
+from lemarche.utils.pagination import CachedCountKeysetPaginator
 from lemarche.utils.s3 import API_CONNECTION_DICT
 from lemarche.utils.urls import get_domain_url, get_encoded_url_from_params
 from lemarche.www.conversations.forms import ContactForm
@@ -49,7 +52,8 @@ class SiaeSearchResultsView(FormMixin, ListView):
     filter_form = None
     context_object_name = "siaes"
     paginate_by = 20
-    paginator_class = Paginator
+    paginator_class = CachedCountKeysetPaginator
+    cursor_kwarg = "cursor"
 
     def get_filter_form(self):
         if not self.filter_form:
@@ -78,6 +82,38 @@ class SiaeSearchResultsView(FormMixin, ListView):
             results_ordered = results_ordered.with_in_user_favorite_list_stats(user)
         return results_ordered
 
+    def get_count_cache_key(self):
+        """
+        The results count only depends on the search filters (not on the page): normalize them to build the key
+        """
+        user = self.request.user
+        search_params = sorted(
+            (key, sorted(self.request.GET.getlist(key)))
+            for key in self.request.GET.keys()
+            if key not in (self.page_kwarg, self.cursor_kwarg)
+        )
+        search_params_hash = hashlib.md5(f"{user.is_authenticated}{search_params}".encode()).hexdigest()
+        return f"siae_search_count_{search_params_hash}"
+
+    def paginate_queryset(self, queryset, page_size):
+        """
+        - the results count is cached (see get_count_cache_key)
+        - the "next page" links carry a keyset cursor (see CachedCountKeysetPaginator)
+        """
+        paginator = self.get_paginator(
+            queryset,
+            page_size,
+            count_cache_key=self.get_count_cache_key(),
+            count_cache_timeout=settings.SIAE_SEARCH_COUNT_CACHE_TIMEOUT,
+        )
+        page_number = self.request.GET.get(self.page_kwarg) or 1
+        try:
+            page = paginator.page_with_cursor(page_number, cursor=self.request.GET.get(self.cursor_kwarg))
+        except InvalidPage as e:
+            raise Http404(f"Page invalide ({page_number}) : {e}")
+        self.next_page_cursor = paginator.get_cursor(page)
+        return (paginator, page, page.object_list, page.has_other_pages())
+
     def get_mailto_share_url(self):
         """
         Function to generate url for share search with url
@@ -128,6 +164,7 @@ class SiaeSearchResultsView(FormMixin, ListView):
         context["paginator_range"] = range(
             max(context["page_obj"].number - 4, 1), min(context["page_obj"].number + 4, context["paginator"].num_pages)
         )
+        context["next_page_cursor"] = self.next_page_cursor
         # pass the results in json for javascript (leaflet map)
         context["siaes_json"] = serialize(
             "geojson", context["siaes"], geometry_field="coords", fields=("id", "name", "brand", "slug")
@@ -148,7 +185,10 @@ class SiaeSearchResultsDownloadView(LoginRequiredMixin, View):
 
     def get(self, request, *args, **kwargs):
         """
-        Build and return a CSV or XLS.
+        Build and return a CSV, XLSX or XLS.
+        - CSV: streamed line by line
+        - XLSX: generated in constant memory in a temporary file, then streamed
+        - XLS (legacy format, limited to 65536 rows): generated in memory
         """
         siae_list = self.get_queryset()
         format = self.request.GET.get("format", "xls")
@@ -170,11 +210,22 @@ class SiaeSearchResultsDownloadView(LoginRequiredMixin, View):
 
         else:
             if format == "csv":
-                response = HttpResponse(content_type="text/csv", charset="utf-8")
+                writer = csv.writer(EchoBuffer())
+                response = StreamingHttpResponse(
+                    stream_siae_to_csv(writer, siae_list, with_contact_info), content_type="text/csv; charset=utf-8"
+                )
                 response["Content-Disposition"] = 'attachment; filename="{}"'.format(filename_with_extension)
 
-                writer = csv.writer(response)
-                export_siae_to_csv(writer, siae_list, with_contact_info)
+            elif format == "xlsx":
+                file = tempfile.TemporaryFile()
+                export_siae_to_xlsx(file, siae_list, with_contact_info)
+                file.seek(0)
+                response = FileResponse(
+                    file,
+                    as_attachment=True,
+                    filename=filename_with_extension,
+                    content_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                )
 
             else:  # "xls"
                 response = HttpResponse(content_type="application/ms-excel")
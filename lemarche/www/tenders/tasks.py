@@ -5,6 +5,8 @@ from django.conf import settings
 from django.template.loader import render_to_string
 from django.urls import reverse
 from django.utils import timezone
+from huey.contrib.djhuey import lock_task, task
+from huey.exceptions import TaskLockedException
 from sesame.utils import get_query_string as sesame_get_query_string
 
 from lemarche.conversations.models import TemplateTransactional
@@ -21,6 +23,9 @@ from lemarche.utils.urls import get_domain_url, get_object_admin_url, get_object
 
 logger = logging.getLogger(__name__)
 
+# send_tender_emails_to_siaes: number of siaes sent (then stamped) together
+SEND_TENDER_EMAILS_CHUNK_SIZE = 100
+
 
 def send_validated_tender(tender: Tender):
     # find the matching Siaes? done in Tender post_save signal
@@ -55,6 +60,31 @@ def restart_send_tender_task(tender: Tender):
     tender.save()
 
 
+@task()
+def send_validated_tender_task(tender_id: int, batch: bool = False):
+    """
+    Dispatch mode of the send_validated_tenders command: each Tender is sent by its own huey task,
+    so that several workers can drain the queue concurrently.
+
+    - a lock per Tender ensures that it is never sent by 2 workers at the same time
+    - once the lock is acquired, we check again that the Tender still needs to be sent
+      (it may have been enqueued twice by consecutive cron runs)
+    - the siae batches of a Tender stay sequential: they share the Tender logs & counters
+    """
+    try:
+        with lock_task(f"send-tender-{tender_id}"):
+            if batch:
+                tender = Tender.objects.validated_sent_batch().is_not_outdated().filter(id=tender_id).first()
+                if tender:
+                    send_validated_sent_batch_tender(tender)
+            else:
+                tender = Tender.objects.validated_but_not_sent().is_not_outdated().filter(id=tender_id).first()
+                if tender:
+                    send_validated_tender(tender)
+    except TaskLockedException:
+        logger.info(f"Tender {tender_id} is already being sent by another worker")
+
+
 # @task()
 def send_tender_emails_to_siaes(tender: Tender):
     """
@@ -62,6 +92,11 @@ def send_tender_emails_to_siaes(tender: Tender):
     - we send emails to both the Siae's 'contact_email' & the Siae's users 'email'
     - but we avoid sending duplicate emails
 
+    The batch is preloaded (TenderSiae, users, sector groups) in a constant number of queries,
+    then sent by chunks of SEND_TENDER_EMAILS_CHUNK_SIZE siaes (Brevo message versions, see
+    send_transactional_email_batch): the TenderSiae 'email_send_date' of a chunk are stamped (in a single update)
+    as soon as it is sent, so that an error mid-batch does not send the emails of the previous chunks again.
+
     previous email_subject: f"{tender.get_kind_display()} : {tender.title} ({tender.author.company_name})"
     """
     if tender.source == tender_constants.SOURCE_TALLY:
@@ -73,27 +108,55 @@ def send_tender_emails_to_siaes(tender: Tender):
     # queryset
     all_siaes = tender.siaes.filter(tendersiae__email_send_date=None).order_by_super_siaes()
     logger.info(f"total siaes {all_siaes.count()}")
-    siaes = all_siaes[: tender.limit_send_to_siae_batch]
+    siaes = list(all_siaes[: tender.limit_send_to_siae_batch].prefetch_related("users", "activities__sector_group"))
+    tendersiae_dict = {
+        tendersiae.siae_id: tendersiae for tendersiae in TenderSiae.objects.filter(tender=tender, siae__in=siaes)
+    }
+
+    # shared by all the emails of the batch
+    email_template = TemplateTransactional.objects.get_by_code("TENDERS_SIAE_PRESENTATION")
+    tender_variables = get_tender_email_variables(tender)
 
     siae_users_count = 0
     siae_users_send_count = 0
 
-    for siae in siaes:
-        tendersiae = TenderSiae.objects.get(tender=tender, siae=siae)
-        # send to siae 'contact_email'
-        send_tender_email_to_siae(tendersiae, email_subject)
-        # also send to the siae's user(s) 'email' (if its value is different)
-        for user in siae.users.all():
-            siae_users_count += 1
-            if user.email != siae.contact_email:
-                send_tender_email_to_siae(tendersiae, email_subject, recipient_to_override=user)
-                siae_users_send_count += 1
+    for index in range(0, len(siaes), SEND_TENDER_EMAILS_CHUNK_SIZE):
+        tendersiae_sent_id_list = []
+        recipient_list = []
+
+        for siae in siaes[index : index + SEND_TENDER_EMAILS_CHUNK_SIZE]:
+            tendersiae = tendersiae_dict[siae.id]
+            # avoid a query to fetch them again
+            tendersiae.tender = tender
+            tendersiae.siae = siae
+            # send to siae 'contact_email'
+            if recipient := get_tender_email_recipient(tendersiae, tender_variables):
+                recipient_list.append(recipient)
+                tendersiae_sent_id_list.append(tendersiae.id)
+            # also send to the siae's user(s) 'email' (if its value is different)
+            for user in siae.users.all():
+                siae_users_count += 1
+                if user.email != siae.contact_email:
+                    if recipient := get_tender_email_recipient(
+                        tendersiae, tender_variables, recipient_to_override=user
+                    ):
+                        recipient_list.append(recipient)
+                        tendersiae_sent_id_list.append(tendersiae.id)
+                    siae_users_send_count += 1
+
+        email_template.send_transactional_email_batch(recipient_list, subject=email_subject)
+
+        # update tendersiae (of the chunk)
+        email_send_date = timezone.now()
+        TenderSiae.objects.filter(id__in=tendersiae_sent_id_list).update(
+            email_send_date=email_send_date, updated_at=email_send_date
+        )
 
     # log email batch
     siaes_log_item = {
         "action": "email_siaes_matched",
         "email_subject": email_subject,
-        "email_count": siaes.count(),
+        "email_count": len(siaes),
         "email_timestamp": timezone.now().isoformat(),
     }
     tender.logs.append(siaes_log_item)
@@ -112,9 +175,33 @@ def send_tender_emails_to_siaes(tender: Tender):
     tender.save()
 
 
-# @task()
-def send_tender_email_to_siae(tendersiae: TenderSiae, email_subject: str, recipient_to_override: User = None):
-    email_template = TemplateTransactional.objects.get(code="TENDERS_SIAE_PRESENTATION")
+def get_tender_email_variables(tender: Tender) -> dict:
+    """
+    The Tender variables of the TENDERS_SIAE_PRESENTATION email: they are the same for every recipient
+    """
+    return {
+        "TENDER_ID": tender.id,
+        "TENDER_TITLE": tender.title,
+        "TENDER_AUTHOR_COMPANY": tender.author.company_name,
+        "TENDER_KIND": tender.get_kind_display(),
+        "TENDER_KIND_LOWER": tender.get_kind_display().lower(),
+        "TENDER_SECTORS": tender.sectors_list_string(),
+        "TENDER_PERIMETERS": tender.location_display,
+        "TENDER_AMOUNT": tender.amount_display,
+        "TENDER_DEADLINE_DATE": date_to_string(tender.deadline_date),
+        "TENDER_SHARE_URL": get_object_share_url(tender),
+    }
+
+
+def get_tender_email_recipient(
+    tendersiae: TenderSiae,
+    tender_variables: dict,
+    recipient_to_override: User = None,
+) -> dict | None:
+    """
+    The recipient of the TENDERS_SIAE_PRESENTATION email (see TemplateTransactional.send_transactional_email_batch)
+    Returns None if the email can't be sent (the caller is in charge of updating the TenderSiae 'email_send_date')
+    """
     # override siae.contact_email if email_to_override is provided
     email_to = recipient_to_override.email if recipient_to_override else tendersiae.siae.contact_email
     recipient_list = whitelist_recipient_list([email_to])
@@ -122,10 +209,10 @@ def send_tender_email_to_siae(tendersiae: TenderSiae, email_subject: str, recipi
         recipient_email = recipient_list[0]
         recipient_name = tendersiae.siae.contact_email_name_display
 
-        tender_url = f"{get_object_share_url(tendersiae.tender)}?siae_id={tendersiae.siae.id}"
-        tender_not_interested_url = (
-            f"{get_object_share_url(tendersiae.tender)}?siae_id={tendersiae.siae.id}&not_interested=True"
-        )
+        tender_variables = tender_variables.copy()
+        tender_share_url = tender_variables.pop("TENDER_SHARE_URL")
+        tender_url = f"{tender_share_url}?siae_id={tendersiae.siae.id}"
+        tender_not_interested_url = f"{tender_share_url}?siae_id={tendersiae.siae.id}&not_interested=True"
         if recipient_to_override:
             tender_url += f"&user_id={recipient_to_override.id}"
             tender_not_interested_url += f"&user_id={recipient_to_override.id}"
@@ -134,32 +221,20 @@ def send_tender_email_to_siae(tendersiae: TenderSiae, email_subject: str, recipi
             "SIAE_ID": tendersiae.siae.id,
             "SIAE_CONTACT_FIRST_NAME": tendersiae.siae.contact_first_name,
             "SIAE_SECTORS": tendersiae.siae.sector_groups_list_string(),
-            "TENDER_ID": tendersiae.tender.id,
-            "TENDER_TITLE": tendersiae.tender.title,
-            "TENDER_AUTHOR_COMPANY": tendersiae.tender.author.company_name,
-            "TENDER_KIND": tendersiae.tender.get_kind_display(),
-            "TENDER_KIND_LOWER": tendersiae.tender.get_kind_display().lower(),
-            "TENDER_SECTORS": tendersiae.tender.sectors_list_string(),
-            "TENDER_PERIMETERS": tendersiae.tender.location_display,
-            "TENDER_AMOUNT": tendersiae.tender.amount_display,
-            "TENDER_DEADLINE_DATE": date_to_string(tendersiae.tender.deadline_date),
+            **tender_variables,
             "TENDER_URL": tender_url,
             "TENDER_NOT_INTERESTED_URL": tender_not_interested_url,
             "TENDERSIAE_ID": tendersiae.id,
         }
 
-        email_template.send_transactional_email(
-            recipient_email=recipient_email,
-            recipient_name=recipient_name,
-            variables=variables,
-            subject=email_subject,
-            recipient_content_object=recipient_to_override if recipient_to_override else tendersiae.siae,
-            parent_content_object=tendersiae,
-        )
-
-        # update tendersiae
-        tendersiae.email_send_date = timezone.now()
-        tendersiae.save()
+        return {
+            "recipient_email": recipient_email,
+            "recipient_name": recipient_name,
+            "variables": variables,
+            "recipient_content_object": recipient_to_override if recipient_to_override else tendersiae.siae,
+            "parent_content_object": tendersiae,
+        }
+    return None
 
 
 def send_tender_emails_to_partners(tender: Tender):
@@ -186,7 +261,7 @@ def send_tender_emails_to_partners(tender: Tender):
 
 
 def send_tender_email_to_partner(tender: Tender, partner: PartnerShareTender, email_subject: str):
-    email_template = TemplateTransactional.objects.get(code="TENDERS_PARTNER_PRESENTATION")
+    email_template = TemplateTransactional.objects.get_by_code("TENDERS_PARTNER_PRESENTATION")
     recipient_list = whitelist_recipient_list(partner.contact_email_list)
     if recipient_list:
         variables = {
@@ -227,11 +302,11 @@ def send_tender_contacted_reminder_email_to_siaes(
     tender: Tender, days_since_email_send_date=2, send_on_weekends=False
 ):
     if days_since_email_send_date == 2:
-        email_template = TemplateTransactional.objects.get(code="TENDERS_SIAE_CONTACTED_REMINDER_2D")
+        email_template = TemplateTransactional.objects.get_by_code("TENDERS_SIAE_CONTACTED_REMINDER_2D")
     elif days_since_email_send_date == 3:
-        email_template = TemplateTransactional.objects.get(code="TENDERS_SIAE_CONTACTED_REMINDER_3D")
+        email_template = TemplateTransactional.objects.get_by_code("TENDERS_SIAE_CONTACTED_REMINDER_3D")
     elif days_since_email_send_date == 4:
-        email_template = TemplateTransactional.objects.get(code="TENDERS_SIAE_CONTACTED_REMINDER_4D")
+        email_template = TemplateTransactional.objects.get_by_code("TENDERS_SIAE_CONTACTED_REMINDER_4D")
     else:
         error_message = f"send_tender_contacted_reminder_email_to_siaes: days_since_email_send_date has a non-managed value ({days_since_email_send_date})"  # noqa
         raise Exception(error_message)
@@ -299,7 +374,7 @@ def send_tender_contacted_reminder_email_to_siae(tendersiae: TenderSiae, email_t
 def send_tender_interested_reminder_email_to_siaes(
     tender: Tender, days_since_detail_contact_click_date=2, send_on_weekends=False
 ):
-    email_template = TemplateTransactional.objects.get(code="TENDERS_SIAE_INTERESTED_REMINDER_2D")
+    email_template = TemplateTransactional.objects.get_by_code("TENDERS_SIAE_INTERESTED_REMINDER_2D")
 
     current_weekday = timezone.now().weekday()
 
@@ -373,7 +448,7 @@ def send_confirmation_published_email_to_author(tender: Tender):
         if tender.send_to_commercial_partners_only
         else "TENDERS_AUTHOR_CONFIRMATION_VALIDATED"
     )
-    email_template = TemplateTransactional.objects.get(code=template_code)
+    email_template = TemplateTransactional.objects.get_by_code(template_code)
     recipient_list = whitelist_recipient_list([tender.author.email])
     if len(recipient_list):
         recipient_email = recipient_list[0]
@@ -425,16 +500,16 @@ def send_siae_interested_email_to_author(tender: Tender):
 
         if tender_siae_detail_contact_click_count == 1:
             should_send_email = True
-            email_template = TemplateTransactional.objects.get(code="TENDERS_AUTHOR_SIAE_INTERESTED_1")
+            email_template = TemplateTransactional.objects.get_by_code("TENDERS_AUTHOR_SIAE_INTERESTED_1")
         elif tender_siae_detail_contact_click_count == 2:
             should_send_email = True
-            email_template = TemplateTransactional.objects.get(code="TENDERS_AUTHOR_SIAE_INTERESTED_2")
+            email_template = TemplateTransactional.objects.get_by_code("TENDERS_AUTHOR_SIAE_INTERESTED_2")
         elif tender_siae_detail_contact_click_count == 5:
             should_send_email = True
-            email_template = TemplateTransactional.objects.get(code="TENDERS_AUTHOR_SIAE_INTERESTED_5")
+            email_template = TemplateTransactional.objects.get_by_code("TENDERS_AUTHOR_SIAE_INTERESTED_5")
         elif tender_siae_detail_contact_click_count % 5 == 0:
             should_send_email = True
-            email_template = TemplateTransactional.objects.get(code="TENDERS_AUTHOR_SIAE_INTERESTED_5_MORE")
+            email_template = TemplateTransactional.objects.get_by_code("TENDERS_AUTHOR_SIAE_INTERESTED_5_MORE")
         else:
             pass
 
@@ -507,7 +582,7 @@ def send_tenders_author_feedback_or_survey(tender: Tender, kind="feedback_30d"):
         }
 
         if kind in ["transactioned_question_7d", "transactioned_question_7d_reminder"]:
-            email_template = TemplateTransactional.objects.get(code="TENDERS_AUTHOR_TRANSACTIONED_QUESTION_7D")
+            email_template = TemplateTransactional.objects.get_by_code("TENDERS_AUTHOR_TRANSACTIONED_QUESTION_7D")
             user_sesame_query_string = sesame_get_query_string(tender.author)  # TODO: sesame scope parameter
             answer_url_with_sesame_token = (
                 f"https://{get_domain_url()}"
@@ -520,7 +595,7 @@ def send_tenders_author_feedback_or_survey(tender: Tender, kind="feedback_30d"):
             # add timestamp
             tender.survey_transactioned_send_date = timezone.now()
         else:
-            email_template = TemplateTransactional.objects.get(code="TENDERS_AUTHOR_FEEDBACK_30D")
+            email_template = TemplateTransactional.objects.get_by_code("TENDERS_AUTHOR_FEEDBACK_30D")
 
         if not tender.contact_notifications_disabled:
             email_template.send_transactional_email(
@@ -555,7 +630,7 @@ def send_tender_author_modification_request(tender: Tender):
         "TENDER_UPDATE_URL": tender_update_url,
     }
 
-    email_template = TemplateTransactional.objects.get(code="TENDERS_AUTHOR_MODIFICATION_REQUEST")
+    email_template = TemplateTransactional.objects.get_by_code("TENDERS_AUTHOR_MODIFICATION_REQUEST")
 
     if not tender.contact_notifications_disabled:
         email_template.send_transactional_email(
@@ -586,7 +661,7 @@ def send_tender_author_reject_message(tender: Tender):
         "TENDER_AUTHOR_FIRST_NAME": tender.author.first_name,
     }
 
-    email_template = TemplateTransactional.objects.get(code="TENDERS_AUTHOR_REJECT_MESSAGE")
+    email_template = TemplateTransactional.objects.get_by_code("TENDERS_AUTHOR_REJECT_MESSAGE")
 
     if not tender.contact_notifications_disabled:
         email_template.send_transactional_email(
@@ -621,7 +696,7 @@ def send_tenders_siaes_survey(tender: Tender, kind="transactioned_question_7d"):
 
 
 def send_tenders_siae_survey(tendersiae: TenderSiae, kind="transactioned_question_7d"):
-    email_template = TemplateTransactional.objects.get(code="TENDERS_SIAE_TRANSACTIONED_QUESTION_7D")
+    email_template = TemplateTransactional.objects.get_by_code("TENDERS_SIAE_TRANSACTIONED_QUESTION_7D")
 
     for user in tendersiae.siae.users.all():
         recipient_list = whitelist_recipient_list([user.email])
@@ -667,7 +742,7 @@ def send_tenders_siae_survey(tendersiae: TenderSiae, kind="transactioned_questio
 
 
 def send_super_siaes_email_to_author(tender: Tender, top_siaes: list[Siae]):
-    email_template = TemplateTransactional.objects.get(code="TENDERS_AUTHOR_SUPER_SIAES")
+    email_template = TemplateTransactional.objects.get_by_code("TENDERS_AUTHOR_SUPER_SIAES")
     recipient_list = whitelist_recipient_list([tender.author.email])
     if len(recipient_list):
         recipient_email = recipient_list[0]
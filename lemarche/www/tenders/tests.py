@@ -4,7 +4,9 @@ from unittest.mock import patch
 
 from django.conf import settings
 from django.contrib.messages import get_messages
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from django.utils import timezone
 from sesame.utils import get_query_string as sesame_get_query_string
@@ -15,7 +17,7 @@ from lemarche.perimeters.factories import PerimeterFactory
 from lemarche.perimeters.models import Perimeter
 from lemarche.sectors.factories import SectorFactory
 from lemarche.siaes import constants as siae_constants
-from lemarche.siaes.factories import SiaeFactory
+from lemarche.siaes.factories import SiaeActivityFactory, SiaeFactory
 from lemarche.tenders import constants as tender_constants
 from lemarche.tenders.enums import SurveyDoesNotExistQuestionChoices, SurveyScaleQuestionChoices
 from lemarche.tenders.factories import TenderFactory, TenderQuestionFactory
@@ -23,6 +25,7 @@ from lemarche.tenders.models import Tender, TenderSiae, TenderStepsData
 from lemarche.users.factories import UserFactory
 from lemarche.users.models import User
 from lemarche.utils import constants
+from lemarche.www.tenders.tasks import send_tender_emails_to_siaes
 from lemarche.www.tenders.views import TenderCreateMultiStepView
 
 
@@ -1788,3 +1791,53 @@ class TenderDetailSiaeSurveyTransactionedViewTest(TestCase):
         self.assertRedirects(response, reverse("tenders:detail", kwargs={"slug": self.tender.slug}))
         self.assertContains(response, "Votre réponse a déjà été prise en compte")
         self.assertFalse(TenderSiae.objects.get(tender=self.tender, siae=self.siae).survey_transactioned_answer)
+
+
+class TenderSendEmailsToSiaesTaskTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        TemplateTransactionalFactory(code="TENDERS_SIAE_PRESENTATION", is_active=True, brevo_id=1)
+        cls.siaes = []
+        for index in range(3):
+            siae_user = UserFactory(kind=User.KIND_SIAE, email=f"siae_user{index}@inclusion.gouv.fr")
+            siae = SiaeFactory(users=[siae_user])
+            SiaeActivityFactory(siae=siae)
+            cls.siaes.append(siae)
+        cls.tender = TenderFactory(siaes=cls.siaes, limit_send_to_siae_batch=2)
+
+    @patch("lemarche.conversations.models.api_brevo.send_transactional_email_batch_with_template")
+    def test_send_tender_emails_to_siaes_batch(self, mock_send_email):
+        with CaptureQueriesContext(connection) as queries:
+            send_tender_emails_to_siaes(self.tender)
+        # 2 siaes (limit_send_to_siae_batch): 1 email to the contact_email + 1 email to the user, in 1 task
+        self.assertEqual(mock_send_email.call_count, 1)
+        self.assertEqual(len(mock_send_email.call_args.kwargs["recipient_list"]), 2 * 2)
+        self.assertEqual(TenderSiae.objects.filter(tender=self.tender, email_send_date__isnull=False).count(), 2)
+        self.assertEqual(TenderSiae.objects.filter(tender=self.tender, email_send_date__isnull=True).count(), 1)
+        # the Siae activities are prefetched once for the whole batch
+        activity_queries = [query for query in queries if '"siaes_siaeactivity"' in query["sql"]]
+        self.assertEqual(len(activity_queries), 1)
+        # logs
+        self.tender.refresh_from_db()
+        self.assertEqual(self.tender.logs[-2]["action"], "email_siaes_matched")
+        self.assertEqual(self.tender.logs[-2]["email_count"], 2)
+        self.assertEqual(self.tender.logs[-1]["action"], "email_siae_users_matched")
+        self.assertEqual(self.tender.logs[-1]["email_count"], 2)
+        # next batch
+        send_tender_emails_to_siaes(self.tender)
+        self.assertEqual(mock_send_email.call_count, 2)
+        self.assertEqual(len(mock_send_email.call_args.kwargs["recipient_list"]), 1 * 2)
+        self.assertEqual(TenderSiae.objects.filter(tender=self.tender, email_send_date__isnull=True).count(), 0)
+
+    @patch("lemarche.www.tenders.tasks.SEND_TENDER_EMAILS_CHUNK_SIZE", 1)
+    @patch("lemarche.conversations.models.api_brevo.send_transactional_email_batch_with_template")
+    def test_send_tender_emails_to_siaes_error_mid_batch(self, mock_send_email):
+        mock_send_email.side_effect = [None, ValueError]
+        with self.assertRaises(ValueError):
+            send_tender_emails_to_siaes(self.tender)
+        # the first chunk is stamped: not sent again by the next batch
+        self.assertEqual(TenderSiae.objects.filter(tender=self.tender, email_send_date__isnull=False).count(), 1)
+        mock_send_email.side_effect = None
+        send_tender_emails_to_siaes(self.tender)
+        self.assertEqual(mock_send_email.call_count, 4)
+        self.assertEqual(TenderSiae.objects.filter(tender=self.tender, email_send_date__isnull=True).count(), 0)